@@ -0,0 +1,113 @@
+"""
+API Endpoints - Alertas
+Sistema de Gases Medicinales MSPBS
+"""
+
+from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from datetime import datetime
+
+from app.core.database import get_db
+from app.core.security import get_current_user, get_current_active_admin
+from app.models.models import Alerta, Usuario, Auditoria
+from app.schemas.schemas import AlertaResponse, AlertaResolver
+from app.services.alertas_service import detectar_alertas
+from app.services.versiones_service import incrementar_version
+
+router = APIRouter(prefix="/alertas", tags=["Alertas"])
+
+
+@router.get("/", response_model=List[AlertaResponse])
+async def listar_alertas(
+    skip: int = 0,
+    limit: int = 100,
+    resuelta: Optional[bool] = None,
+    tipo: Optional[str] = None,
+    hospital_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user)
+):
+    """
+    Listar alertas. Los usuarios de hospital solo ven las de su hospital.
+    """
+    query = db.query(Alerta)
+
+    if current_user.rol == "HOSPITAL_USER":
+        query = query.filter(Alerta.hospital_id == current_user.hospital_id)
+    elif hospital_id:
+        query = query.filter(Alerta.hospital_id == hospital_id)
+
+    if resuelta is not None:
+        query = query.filter(Alerta.resuelta == resuelta)
+    if tipo:
+        query = query.filter(Alerta.tipo == tipo)
+
+    query = query.order_by(Alerta.fecha_deteccion.desc())
+
+    return query.offset(skip).limit(limit).all()
+
+
+@router.post("/detectar")
+async def ejecutar_detector(
+    request: Request,
+    forzar: bool = False,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_active_admin)
+):
+    """
+    Ejecutar el detector de alertas inmediatamente (solo ADMIN).
+    Con `forzar=true` se reevalúan todos los hospitales, no solo los modificados.
+    """
+    # El detector recorre todas las series: no bloquear el event loop
+    resumen = await run_in_threadpool(detectar_alertas, db, forzar=forzar)
+
+    # Auditoría
+    auditoria = Auditoria(
+        usuario_id=current_user.id,
+        accion="DETECTAR_ALERTAS",
+        detalle=f"Detector ejecutado: {resumen.get('nuevas', 0)} alertas nuevas",
+        ip=request.client.host if request.client else None
+    )
+    db.add(auditoria)
+    db.commit()
+
+    return resumen
+
+
+@router.put("/{alerta_id}/resolver", response_model=AlertaResponse)
+async def resolver_alerta(
+    request: Request,
+    alerta_id: int,
+    datos: AlertaResolver,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_active_admin)
+):
+    """Marcar una alerta como resuelta (solo ADMIN)"""
+    alerta = db.query(Alerta).filter(Alerta.id == alerta_id).first()
+    if not alerta:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Alerta no encontrada"
+        )
+
+    alerta.resuelta = True
+    alerta.resuelta_por = current_user.id
+    alerta.fecha_resolucion = datetime.utcnow()
+    alerta.notas_resolucion = datos.notas_resolucion
+    incrementar_version(db, "alertas")
+    db.commit()
+    db.refresh(alerta)
+
+    # Auditoría
+    auditoria = Auditoria(
+        usuario_id=current_user.id,
+        accion="RESOLVER_ALERTA",
+        detalle=f"Alerta resuelta: ID {alerta_id}",
+        ip=request.client.host if request.client else None
+    )
+    db.add(auditoria)
+    db.commit()
+
+    return alerta
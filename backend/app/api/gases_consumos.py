@@ -4,11 +4,19 @@ Sistema de Gases Medicinales MSPBS
 """
 
 from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import date
+import csv
+import json
+import os
 
+from app.core.cargas import recibir_cuerpo
+from app.core.config import settings
 from app.core.database import get_db
+from app.core.etag import etag_versiones
 from app.core.security import (
     get_current_user,
     get_current_active_admin,
@@ -23,6 +31,26 @@ from app.schemas.schemas import (
     ConsumoUpdate,
     ConsumoResponse
 )
+from app.services.cierres_service import bloquear_periodo, periodo_cerrado, periodo_de_consumo
+from app.services.consultas_service import (
+    resolver_campos,
+    select_consumos_respuesta,
+    serializar_consumos
+)
+from app.services.cumplimiento_service import actualizar_cumplimiento
+from app.services.ingesta_service import (
+    importar_lote,
+    importar_xlsx,
+    leer_csv_consumos
+)
+from app.services.pivot_service import cache_pivot
+from app.services.ranking_service import cache_ranking
+from app.services.unidades_service import (
+    UnidadNoConvertible,
+    normalizar_cantidad,
+    recalcular_cantidades_normalizadas
+)
+from app.services.versiones_service import incrementar_version
 
 # ============ GASES ============
 router_gases = APIRouter(prefix="/gases", tags=["Gases Medicinales"])
@@ -46,6 +74,7 @@ async def crear_gas(
     
     nuevo_gas = Gas(**gas_data.dict())
     db.add(nuevo_gas)
+    incrementar_version(db, "gases")
     db.commit()
     db.refresh(nuevo_gas)
     
@@ -62,7 +91,7 @@ async def crear_gas(
     return nuevo_gas
 
 
-@router_gases.get("/", response_model=List[GasResponse])
+@router_gases.get("/", response_model=List[GasResponse], dependencies=[Depends(etag_versiones("gases"))])
 async def listar_gases(
     skip: int = 0,
     limit: int = 100,
@@ -113,10 +142,19 @@ async def actualizar_gas(
         )
     
     # Actualizar campos
+    unidad_previa = (gas.unidad_base, gas.codigo)
     update_data = gas_data.dict(exclude_unset=True)
     for field, value in update_data.items():
         setattr(gas, field, value)
     
+    # Las cantidades normalizadas dependen de la unidad base y del código (densidad)
+    if (gas.unidad_base, gas.codigo) != unidad_previa:
+        db.flush()
+        recalcular_cantidades_normalizadas(db, gas_id=gas.id)
+        cache_pivot.limpiar()
+        cache_ranking.limpiar()
+    
+    incrementar_version(db, "gases")
     db.commit()
     db.refresh(gas)
     
@@ -149,6 +187,7 @@ async def eliminar_gas(
         )
     
     gas.estado = False
+    incrementar_version(db, "gases")
     db.commit()
     
     # Auditoría
@@ -168,6 +207,27 @@ async def eliminar_gas(
 router_consumos = APIRouter(prefix="/consumos", tags=["Consumos"])
 
 
+def verificar_periodo_abierto(db: Session, fecha_inicio: date, fecha_fin: date):
+    """
+    Rechazar cambios en consumos de un periodo cerrado o que se está
+    cerrando. El bloqueo compartido del mes se mantiene hasta el commit.
+    """
+    periodo = periodo_de_consumo(fecha_inicio, fecha_fin)
+    if periodo is None:
+        return
+    if not bloquear_periodo(db, periodo):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"El periodo {periodo.strftime('%Y-%m')} se está cerrando"
+        )
+    cierre = periodo_cerrado(db, fecha_inicio, fecha_fin)
+    if cierre:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"El periodo {cierre.periodo.strftime('%Y-%m')} está cerrado"
+        )
+
+
 @router_consumos.post("/", response_model=ConsumoResponse, status_code=status.HTTP_201_CREATED)
 async def crear_consumo(
     request: Request,
@@ -200,16 +260,41 @@ async def crear_consumo(
             detail="Gas no encontrado"
         )
     
+    verificar_periodo_abierto(db, consumo_data.fecha_inicio, consumo_data.fecha_fin)
+    
+    # Cantidad en la unidad base del gas
+    try:
+        cantidad_normalizada = normalizar_cantidad(consumo_data.cantidad, consumo_data.unidad_medida, gas)
+    except UnidadNoConvertible as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
     # Crear consumo
     nuevo_consumo = Consumo(
         **consumo_data.dict(),
+        cantidad_normalizada=cantidad_normalizada,
         usuario_id=current_user.id
     )
     
     db.add(nuevo_consumo)
+    db.flush()
+    
+    # Mantener índice de cumplimiento
+    actualizar_cumplimiento(db, [(
+        nuevo_consumo.hospital_id, nuevo_consumo.gas_id,
+        nuevo_consumo.fecha_inicio, nuevo_consumo.fecha_fin
+    )])
+    incrementar_version(db, "consumos")
+    
     db.commit()
     db.refresh(nuevo_consumo)
     
+    # Invalidar tablas dinámicas y rankings cacheados
+    cache_pivot.limpiar()
+    cache_ranking.limpiar()
+    
     # Auditoría
     auditoria = Auditoria(
         usuario_id=current_user.id,
@@ -223,6 +308,139 @@ async def crear_consumo(
     return nuevo_consumo
 
 
+@router_consumos.post("/lote")
+async def crear_consumos_lote(
+    request: Request,
+    todo_o_nada: bool = False,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user)
+):
+    """
+    Crear muchos consumos en una sola transacción. El cuerpo es un arreglo
+    JSON de consumos o un CSV (Content-Type: text/csv) cuyos encabezados son
+    los campos de consumo. Las filas inválidas se informan (número de
+    elemento del arreglo, o de línea del CSV) y el resto se inserta, salvo
+    con todo_o_nada=true, donde cualquier error cancela el lote. El cuerpo
+    se corta con 413 al superar MAX_UPLOAD_SIZE.
+    """
+    ruta = await recibir_cuerpo(request, settings.MAX_UPLOAD_SIZE)
+    try:
+        with open(ruta, "rb") as archivo:
+            cuerpo = archivo.read()
+    finally:
+        os.remove(ruta)
+    es_csv = request.headers.get("content-type", "").startswith("text/csv")
+    try:
+        if es_csv:
+            registros = await run_in_threadpool(leer_csv_consumos, cuerpo.decode("utf-8"))
+        else:
+            registros = await run_in_threadpool(json.loads, cuerpo)
+    except (ValueError, csv.Error):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El cuerpo debe ser un arreglo JSON o un CSV en UTF-8"
+        )
+    
+    if not isinstance(registros, list) or not registros:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El lote debe contener al menos un consumo"
+        )
+    if len(registros) > settings.CONSUMOS_LOTE_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"El lote supera el máximo de {settings.CONSUMOS_LOTE_MAX} consumos"
+        )
+    
+    # En el CSV la primera fila de datos es la línea 2. La validación y el
+    # insert pueden tardar: se ejecutan fuera del event loop
+    resultado = await run_in_threadpool(
+        importar_lote, db, registros, current_user, 2 if es_csv else 1, todo_o_nada
+    )
+    if resultado["errores"] and todo_o_nada:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"mensaje": "El lote tiene errores; no se insertó ningún consumo", "errores": resultado["errores"]}
+        )
+    
+    db.commit()
+    insertados = resultado["insertados"]
+    
+    if insertados:
+        # Invalidar tablas dinámicas y rankings cacheados
+        cache_pivot.limpiar()
+        cache_ranking.limpiar()
+    
+    # Auditoría
+    auditoria = Auditoria(
+        usuario_id=current_user.id,
+        accion="CREAR_CONSUMOS_LOTE",
+        detalle=f"Lote de consumos: {insertados} insertados, {len(resultado['errores'])} con errores",
+        ip=request.client.host if request.client else None
+    )
+    db.add(auditoria)
+    db.commit()
+    
+    return resultado
+
+
+@router_consumos.post("/importar-excel")
+async def importar_consumos_excel(
+    request: Request,
+    hoja: Optional[str] = None,
+    todo_o_nada: bool = False,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user)
+):
+    """
+    Importar consumos desde un libro .xlsx enviado como cuerpo del pedido
+    (hasta MAX_UPLOAD_SIZE). La primera fila es el encabezado: columnas con
+    los campos de consumo o las del reporte exportado (Código Hospital,
+    Código Gas, Fecha Inicio, ...). El libro se lee por streaming y se
+    valida e inserta por lotes en una sola transacción; las filas inválidas
+    se informan con su número de fila.
+    """
+    ruta = await recibir_cuerpo(request, settings.MAX_UPLOAD_SIZE, sufijo=".xlsx")
+    try:
+        resultado = await run_in_threadpool(importar_xlsx, db, ruta, current_user, hoja, todo_o_nada)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    finally:
+        os.remove(ruta)
+    
+    if resultado["errores_total"] and todo_o_nada:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"mensaje": "El libro tiene errores; no se insertó ningún consumo", **resultado, "insertados": 0}
+        )
+    db.commit()
+    
+    if resultado["insertados"]:
+        # Invalidar tablas dinámicas y rankings cacheados
+        cache_pivot.limpiar()
+        cache_ranking.limpiar()
+    
+    # Auditoría
+    auditoria = Auditoria(
+        usuario_id=current_user.id,
+        accion="IMPORTAR_CONSUMOS_EXCEL",
+        detalle=(
+            f"Importación de consumos: {resultado['insertados']} insertados, "
+            f"{resultado['errores_total']} con errores"
+        ),
+        ip=request.client.host if request.client else None
+    )
+    db.add(auditoria)
+    db.commit()
+    
+    return resultado
+
+
 @router_consumos.get("/", response_model=List[ConsumoResponse])
 async def listar_consumos(
     skip: int = 0,
@@ -233,40 +451,51 @@ async def listar_consumos(
     fecha_fin: Optional[date] = None,
     modo_suministro: Optional[str] = None,
     validado: Optional[bool] = None,
+    fields: Optional[str] = None,
+    embed: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: Usuario = Depends(get_current_user)
 ):
-    """Listar consumos con filtros"""
-    query = db.query(Consumo)
+    """
+    Listar consumos con filtros. Las filas se arman desde tuplas de una sola
+    consulta con joins y se serializan con orjson, sin hidratar objetos ORM.
+    
+    `fields` limita los campos (p. ej. `id,fecha_inicio,cantidad,hospital.codigo`)
+    y `embed` los objetos anidados completos (`hospital`, `gas`; vacío para
+    ninguno). Con `fields` y sin `embed` no se incluye ningún objeto anidado
+    completo. Solo se consultan las columnas y tablas pedidas.
+    """
+    try:
+        campos = resolver_campos(fields, embed)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    stmt = select_consumos_respuesta(campos)
     
     # Si es usuario de hospital, solo ver sus consumos
     if current_user.rol == "HOSPITAL_USER":
-        query = query.filter(Consumo.hospital_id == current_user.hospital_id)
+        stmt = stmt.where(Consumo.hospital_id == current_user.hospital_id)
     elif hospital_id:
-        query = query.filter(Consumo.hospital_id == hospital_id)
+        stmt = stmt.where(Consumo.hospital_id == hospital_id)
     
     if gas_id:
-        query = query.filter(Consumo.gas_id == gas_id)
+        stmt = stmt.where(Consumo.gas_id == gas_id)
     if fecha_inicio:
-        query = query.filter(Consumo.fecha_inicio >= fecha_inicio)
+        stmt = stmt.where(Consumo.fecha_inicio >= fecha_inicio)
     if fecha_fin:
-        query = query.filter(Consumo.fecha_fin <= fecha_fin)
+        stmt = stmt.where(Consumo.fecha_fin <= fecha_fin)
     if modo_suministro:
-        query = query.filter(Consumo.modo_suministro == modo_suministro)
+        stmt = stmt.where(Consumo.modo_suministro == modo_suministro)
     if validado is not None:
-        query = query.filter(Consumo.validado == validado)
+        stmt = stmt.where(Consumo.validado == validado)
     
     # Ordenar por fecha más reciente
-    query = query.order_by(Consumo.created_at.desc())
-    
-    consumos = query.offset(skip).limit(limit).all()
-    
-    # Cargar relaciones
-    for consumo in consumos:
-        consumo.hospital
-        consumo.gas
+    stmt = stmt.order_by(Consumo.created_at.desc()).offset(skip).limit(limit)
     
-    return consumos
+    filas = db.execute(stmt).all()
+    return ORJSONResponse(serializar_consumos(filas, campos))
 
 
 @router_consumos.get("/{consumo_id}", response_model=ConsumoResponse)
@@ -322,14 +551,51 @@ async def actualizar_consumo(
                 detail="No tiene permisos para editar este consumo"
             )
     
+    verificar_periodo_abierto(db, consumo.fecha_inicio, consumo.fecha_fin)
+    
+    intervalo_previo = (consumo.hospital_id, consumo.gas_id, consumo.fecha_inicio, consumo.fecha_fin)
+    
     # Actualizar campos
     update_data = consumo_data.dict(exclude_unset=True)
     for field, value in update_data.items():
         setattr(consumo, field, value)
     
+    # Tampoco se puede mover un consumo a un periodo cerrado
+    if {"fecha_inicio", "fecha_fin"} & update_data.keys():
+        verificar_periodo_abierto(db, consumo.fecha_inicio, consumo.fecha_fin)
+    
+    # Recalcular la cantidad en la unidad base del gas
+    if {"gas_id", "cantidad", "unidad_medida"} & update_data.keys():
+        gas = db.query(Gas).filter(Gas.id == consumo.gas_id).first()
+        if not gas:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Gas no encontrado"
+            )
+        try:
+            consumo.cantidad_normalizada = normalizar_cantidad(consumo.cantidad, consumo.unidad_medida, gas)
+        except UnidadNoConvertible as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+    
+    db.flush()
+    
+    # Mantener índice de cumplimiento (intervalo anterior y nuevo)
+    actualizar_cumplimiento(db, [
+        intervalo_previo,
+        (consumo.hospital_id, consumo.gas_id, consumo.fecha_inicio, consumo.fecha_fin)
+    ])
+    incrementar_version(db, "consumos")
+    
     db.commit()
     db.refresh(consumo)
     
+    # Invalidar tablas dinámicas y rankings cacheados
+    cache_pivot.limpiar()
+    cache_ranking.limpiar()
+    
     # Auditoría
     auditoria = Auditoria(
         usuario_id=current_user.id,
@@ -366,10 +632,24 @@ async def eliminar_consumo(
                 detail="No tiene permisos para eliminar este consumo"
             )
     
+    verificar_periodo_abierto(db, consumo.fecha_inicio, consumo.fecha_fin)
+    
+    intervalo = (consumo.hospital_id, consumo.gas_id, consumo.fecha_inicio, consumo.fecha_fin)
+    
     # Eliminar
     db.delete(consumo)
+    db.flush()
+    
+    # Mantener índice de cumplimiento
+    actualizar_cumplimiento(db, [intervalo])
+    incrementar_version(db, "consumos")
+    
     db.commit()
     
+    # Invalidar tablas dinámicas y rankings cacheados
+    cache_pivot.limpiar()
+    cache_ranking.limpiar()
+    
     # Auditoría
     auditoria = Auditoria(
         usuario_id=current_user.id,
@@ -403,6 +683,7 @@ async def validar_consumo(
     consumo.validado = True
     consumo.validado_por = current_user.id
     consumo.fecha_validacion = datetime.utcnow()
+    incrementar_version(db, "consumos")
     db.commit()
     
     # Auditoría
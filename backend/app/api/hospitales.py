@@ -8,6 +8,7 @@ from sqlalchemy.orm import Session
 from typing import List, Optional
 
 from app.core.database import get_db
+from app.core.etag import etag_versiones
 from app.core.security import get_current_user, get_current_active_admin
 from app.models.models import Hospital, Usuario, Auditoria
 from app.schemas.schemas import (
@@ -15,6 +16,7 @@ from app.schemas.schemas import (
     HospitalUpdate,
     HospitalResponse
 )
+from app.services.versiones_service import incrementar_version
 
 router = APIRouter(prefix="/hospitales", tags=["Hospitales"])
 
@@ -39,6 +41,7 @@ async def crear_hospital(
     
     nuevo_hospital = Hospital(**hospital_data.dict())
     db.add(nuevo_hospital)
+    incrementar_version(db, "hospitales")
     db.commit()
     db.refresh(nuevo_hospital)
     
@@ -55,7 +58,7 @@ async def crear_hospital(
     return nuevo_hospital
 
 
-@router.get("/", response_model=List[HospitalResponse])
+@router.get("/", response_model=List[HospitalResponse], dependencies=[Depends(etag_versiones("hospitales"))])
 async def listar_hospitales(
     skip: int = 0,
     limit: int = 100,
@@ -87,7 +90,7 @@ async def listar_hospitales(
     return hospitales
 
 
-@router.get("/departamentos")
+@router.get("/departamentos", dependencies=[Depends(etag_versiones("hospitales"))])
 async def listar_departamentos(
     db: Session = Depends(get_db),
     current_user: Usuario = Depends(get_current_user)
@@ -149,6 +152,7 @@ async def actualizar_hospital(
     for field, value in update_data.items():
         setattr(hospital, field, value)
     
+    incrementar_version(db, "hospitales")
     db.commit()
     db.refresh(hospital)
     
@@ -183,6 +187,7 @@ async def eliminar_hospital(
         )
     
     hospital.estado = False
+    incrementar_version(db, "hospitales")
     db.commit()
     
     # Registrar en auditoría
@@ -230,7 +235,7 @@ async def obtener_estadisticas_hospital(
     # Construir query
     query = db.query(
         Gas.nombre,
-        func.sum(Consumo.cantidad).label("total"),
+        func.sum(Consumo.cantidad_normalizada).label("total"),
         Gas.unidad_base
     ).join(Consumo).filter(Consumo.hospital_id == hospital_id)
     
@@ -0,0 +1,131 @@
+"""
+API Endpoints - Planificación de Suministro
+Sistema de Gases Medicinales MSPBS
+"""
+
+from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from typing import List, Optional
+import numpy as np
+
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.procesos import ejecutar_en_proceso
+from app.core.security import get_current_user, get_current_active_admin
+from app.models.models import Gas, PronosticoConsumo, Usuario, Auditoria
+from app.schemas.schemas import PronosticoResponse, SimulacionOxigenoRequest
+from app.services.pronostico_service import generar_pronosticos
+from app.services.simulacion_service import armar_resultado, cargar_linea_base, simular_demanda
+
+router = APIRouter(prefix="/planificacion", tags=["Planificación"])
+
+
+@router.get("/pronosticos", response_model=List[PronosticoResponse])
+async def listar_pronosticos(
+    hospital_id: Optional[int] = None,
+    gas_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user)
+):
+    """
+    Pronósticos de consumo mensual para los próximos meses.
+    Los usuarios de hospital solo ven los de su hospital.
+    """
+    query = db.query(PronosticoConsumo)
+
+    if current_user.rol == "HOSPITAL_USER":
+        query = query.filter(PronosticoConsumo.hospital_id == current_user.hospital_id)
+    elif hospital_id:
+        query = query.filter(PronosticoConsumo.hospital_id == hospital_id)
+
+    if gas_id:
+        query = query.filter(PronosticoConsumo.gas_id == gas_id)
+
+    return query.order_by(
+        PronosticoConsumo.hospital_id, PronosticoConsumo.gas_id, PronosticoConsumo.periodo
+    ).all()
+
+
+@router.post("/pronosticos/generar")
+async def ejecutar_pronosticos(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_active_admin)
+):
+    """Recalcular los pronósticos de todas las series inmediatamente (solo ADMIN)"""
+    resumen = await run_in_threadpool(generar_pronosticos, db)
+
+    # Auditoría
+    auditoria = Auditoria(
+        usuario_id=current_user.id,
+        accion="GENERAR_PRONOSTICOS",
+        detalle=f"Pronósticos generados: {resumen.get('series', 0)} series",
+        ip=request.client.host if request.client else None
+    )
+    db.add(auditoria)
+    db.commit()
+
+    return resumen
+
+
+@router.post("/simulacion-oxigeno")
+async def simular_aumento_demanda(
+    datos: SimulacionOxigenoRequest,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_active_admin)
+):
+    """
+    Simulación Monte Carlo de un aumento de demanda por región sanitaria
+    (solo ADMIN). Ejemplo: {"aumentos": {"Central": 40}, "aumento_general": 10}
+    devuelve bandas de percentiles del consumo mensual de cada región.
+    """
+    if datos.escenarios > settings.SIMULACION_MAX_ESCENARIOS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Máximo {settings.SIMULACION_MAX_ESCENARIOS} escenarios"
+        )
+    
+    if datos.gas_id:
+        gas = db.query(Gas).filter(Gas.id == datos.gas_id).first()
+    else:
+        gas = db.query(Gas).filter(Gas.codigo == "O2").first()
+    if not gas:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Gas no encontrado"
+        )
+    
+    linea_base = await run_in_threadpool(cargar_linea_base, db, gas.id)
+    if len(linea_base["base"]) == 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No hay consumos del gas en los últimos 12 meses"
+        )
+    
+    desconocidas = sorted(set(datos.aumentos) - set(linea_base["regiones"]))
+    if desconocidas:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Regiones sin datos: {', '.join(desconocidas)}"
+        )
+    
+    aumentos_region = np.array([
+        datos.aumentos.get(r, datos.aumento_general) / 100 for r in linea_base["regiones"]
+    ])
+    simulacion = await ejecutar_en_proceso(
+        simular_demanda,
+        linea_base["base"],
+        linea_base["cv"],
+        linea_base["region"],
+        aumentos_region,
+        datos.incertidumbre,
+        datos.escenarios,
+        datos.percentiles,
+        datos.semilla
+    )
+    
+    return armar_resultado(
+        linea_base, simulacion, datos.aumentos, datos.aumento_general,
+        datos.percentiles, gas, datos.escenarios
+    )
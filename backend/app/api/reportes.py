@@ -3,32 +3,76 @@ API Endpoints - Reportes y Dashboard
 Sistema de Gases Medicinales MSPBS
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from typing import Optional
+from typing import List, Optional
 from datetime import date, datetime
-import io
+import asyncio
+import os
+import tempfile
+import numpy as np
 
+from app.core.archivos import ArchivoResponse
+from app.core.config import settings
 from app.core.database import get_db
+from app.core.etag import etag_versiones
 from app.core.security import get_current_user, get_current_active_admin
 from app.models.models import (
-    Usuario, Hospital, Gas, Consumo, Alerta
+    Usuario, Hospital, Gas, Consumo, Alerta, Auditoria, TrabajoExportacion, CierrePeriodo
 )
 from app.schemas.schemas import (
+    CierrePeriodoDetalle,
+    CierrePeriodoRequest,
+    CierrePeriodoResponse,
     DashboardStats,
     EstadisticaGas,
     EstadisticaHospital,
-    FiltroReporte
+    ExportacionRequest,
+    FiltroReporte,
+    PivotRequest,
+    TrabajoExportacionResponse
+)
+from app.services.exportacion_service import generar_csv_streaming
+from app.services.archivos_exportacion_service import MEDIA_TYPES, MODOS_PDF, obtener_o_generar
+from app.services.cola_exportacion_service import encolar_trabajo, ruta_trabajo
+from app.services.cierres_service import (
+    ARCHIVOS_CIERRE,
+    PeriodoNoCerrable,
+    archivo_cierre,
+    cerrar_periodo,
+    reabrir_periodo
+)
+from app.services.cache_analitico_service import DIMENSIONES, cache_analitico
+from app.services.columnar_service import FORMATOS_COLUMNARES, exportar_consumos_columnar
+from app.services.cumplimiento_service import calcular_faltantes, hospitales_sin_registro
+from app.services.pivot_service import DIMENSIONES_PIVOT, calcular_pivot
+from app.services.ranking_service import calcular_ranking_pares
+from app.services.prorrateo_service import (
+    GRANULARIDADES,
+    prorratear,
+    cargar_intervalos,
+    formatear_periodos
 )
-from app.services.pdf_service import generar_reporte_pdf
-from app.services.excel_service import generar_reporte_excel
 
 router = APIRouter(prefix="/reportes", tags=["Reportes y Dashboard"])
 
+# Pedidos que generan PDF a la vez. Se espera en el event loop, antes de
+# tomar un hilo del threadpool, para no ocupar hilos compartidos esperando
+# el pool de procesos.
+_limite_pdf = asyncio.Semaphore(settings.PDF_MAX_CONCURRENTES)
+
 
-@router.get("/dashboard", response_model=DashboardStats)
+@router.get(
+    "/dashboard",
+    response_model=DashboardStats,
+    dependencies=[Depends(etag_versiones(
+        "consumos", "gases", "hospitales", "alertas", usuario_dependencia=get_current_active_admin
+    ))]
+)
 async def obtener_dashboard(
     fecha_inicio: Optional[date] = None,
     fecha_fin: Optional[date] = None,
@@ -56,32 +100,24 @@ async def obtener_dashboard(
     consumo_oxigeno = 0
     if oxigeno:
         result = query_consumos.filter(Consumo.gas_id == oxigeno.id).with_entities(
-            func.sum(Consumo.cantidad)
+            func.sum(Consumo.cantidad_normalizada)
         ).scalar()
         consumo_oxigeno = float(result) if result else 0
     
     # Alertas pendientes
     alertas_pendientes = db.query(Alerta).filter(Alerta.resuelta == False).count()
     
-    # Hospitales sin registro en el periodo
-    hospitales_con_registro = query_consumos.with_entities(
-        Consumo.hospital_id
-    ).distinct().all()
-    hospitales_con_registro_ids = [h[0] for h in hospitales_con_registro]
-    
-    hospitales_sin_registro = db.query(Hospital).filter(
-        Hospital.estado == True,
-        ~Hospital.id.in_(hospitales_con_registro_ids)
-    ).all()
+    # Hospitales sin ningún mes cubierto en el periodo (índice de cumplimiento)
+    hospitales_sin_registro_nombres = hospitales_sin_registro(db, fecha_inicio, fecha_fin)
     
-    hospitales_sin_registro_nombres = [h.nombre for h in hospitales_sin_registro]
-    
-    # Top 5 hospitales con mayor consumo
+    # Top 5 hospitales con mayor consumo. Las cantidades sin conversión a la
+    # unidad base quedan en NULL: se suman como 0 para no encabezar el orden
+    total_normalizado = func.coalesce(func.sum(Consumo.cantidad_normalizada), 0)
     top_hospitales = db.query(
         Hospital.id,
         Hospital.nombre,
         Hospital.codigo,
-        func.sum(Consumo.cantidad).label("total_consumo"),
+        total_normalizado.label("total_consumo"),
         func.count(Consumo.id).label("cantidad_registros")
     ).join(Consumo).group_by(Hospital.id, Hospital.nombre, Hospital.codigo)
     
@@ -90,14 +126,14 @@ async def obtener_dashboard(
     if fecha_fin:
         top_hospitales = top_hospitales.filter(Consumo.fecha_fin <= fecha_fin)
     
-    top_hospitales = top_hospitales.order_by(func.sum(Consumo.cantidad).desc()).limit(5).all()
+    top_hospitales = top_hospitales.order_by(total_normalizado.desc()).limit(5).all()
     
     top_consumidores = [
         EstadisticaHospital(
             hospital_id=h[0],
             hospital_nombre=h[1],
             hospital_codigo=h[2],
-            total_consumo=float(h[3]),
+            total_consumo=float(h[3]) if h[3] else 0,
             cantidad_registros=h[4]
         )
         for h in top_hospitales
@@ -108,7 +144,7 @@ async def obtener_dashboard(
         Gas.id,
         Gas.nombre,
         Gas.unidad_base,
-        func.sum(Consumo.cantidad).label("total")
+        total_normalizado.label("total")
     ).join(Consumo).group_by(Gas.id, Gas.nombre, Gas.unidad_base)
     
     if fecha_inicio:
@@ -127,7 +163,7 @@ async def obtener_dashboard(
             gas_nombre=g[1],
             unidad=g[2],
             total_consumo=float(g[3]) if g[3] else 0,
-            porcentaje=round((float(g[3]) / total_general * 100) if total_general > 0 else 0, 2)
+            porcentaje=round((float(g[3]) / total_general * 100) if total_general > 0 and g[3] else 0, 2)
         )
         for g in consumo_por_gas_result
     ]
@@ -143,7 +179,89 @@ async def obtener_dashboard(
     )
 
 
-@router.get("/dashboard/hospital")
+@router.get("/ranking-pares")
+async def obtener_ranking_pares(
+    fecha_inicio: Optional[date] = None,
+    fecha_fin: Optional[date] = None,
+    gas_id: Optional[int] = None,
+    hospital_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user)
+):
+    """
+    Posición, percentil y distancia a la mediana de cada hospital entre sus
+    pares (mismo nivel de atención, tipo y región sanitaria) por gas.
+    Por defecto el periodo es el año en curso.
+    """
+    hoy = date.today()
+    fecha_fin = fecha_fin or hoy
+    fecha_inicio = fecha_inicio or date(fecha_fin.year, 1, 1)
+    if fecha_fin < fecha_inicio:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="fecha_fin debe ser mayor o igual a fecha_inicio"
+        )
+    
+    # Verificar permisos
+    if current_user.rol == "HOSPITAL_USER":
+        hospital_id = current_user.hospital_id
+    
+    filas = await run_in_threadpool(calcular_ranking_pares, db, fecha_inicio, fecha_fin, gas_id)
+    if hospital_id:
+        filas = [f for f in filas if f["hospital_id"] == hospital_id]
+    
+    return {
+        "fecha_inicio": fecha_inicio,
+        "fecha_fin": fecha_fin,
+        "filas": filas
+    }
+
+
+@router.get("/cumplimiento")
+async def obtener_cumplimiento(
+    fecha_inicio: Optional[date] = None,
+    fecha_fin: Optional[date] = None,
+    gas_id: Optional[int] = None,
+    solo_incompletos: bool = True,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_active_admin)
+):
+    """
+    Meses sin registro de cada hospital activo (solo ADMIN).
+    Por defecto la ventana es el año en curso hasta el mes actual; sin
+    `gas_id` un mes cuenta como reportado si se registró cualquier gas.
+    """
+    hoy = date.today()
+    fecha_fin = fecha_fin or hoy
+    fecha_inicio = fecha_inicio or date(fecha_fin.year, 1, 1)
+    if fecha_fin < fecha_inicio:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="fecha_fin debe ser mayor o igual a fecha_inicio"
+        )
+    
+    meses, hospitales, faltantes = calcular_faltantes(db, fecha_inicio, fecha_fin, gas_id)
+    
+    resultado = []
+    for hospital, fila in zip(hospitales, faltantes):
+        if solo_incompletos and not fila.any():
+            continue
+        resultado.append({
+            "hospital_id": hospital.id,
+            "hospital_nombre": hospital.nombre,
+            "hospital_codigo": hospital.codigo,
+            "meses_faltantes": [mes for mes, falta in zip(meses, fila) if falta]
+        })
+    
+    return {
+        "meses": meses,
+        "total_hospitales": len(hospitales),
+        "hospitales_completos": int((~faltantes.any(axis=1)).sum()) if len(hospitales) else 0,
+        "hospitales": resultado
+    }
+
+
+@router.get("/dashboard/hospital", dependencies=[Depends(etag_versiones("consumos", "gases", "hospitales"))])
 async def obtener_dashboard_hospital(
     fecha_inicio: Optional[date] = None,
     fecha_fin: Optional[date] = None,
@@ -181,7 +299,7 @@ async def obtener_dashboard_hospital(
     consumo_por_gas = db.query(
         Gas.nombre,
         Gas.unidad_base,
-        func.sum(Consumo.cantidad).label("total")
+        func.sum(Consumo.cantidad_normalizada).label("total")
     ).join(Consumo).filter(Consumo.hospital_id == hospital_id)
     
     if fecha_inicio:
@@ -205,66 +323,64 @@ async def obtener_dashboard_hospital(
     }
 
 
+def verificar_permisos_reporte(tipo_reporte: str, filtros: FiltroReporte, usuario: Usuario) -> FiltroReporte:
+    """
+    Verificar que el usuario puede generar el tipo de reporte. Retorna los
+    filtros limitados al hospital del usuario si es HOSPITAL_USER.
+    """
+    if tipo_reporte == "global" and usuario.rol != "ADMIN":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Solo ADMIN puede generar reportes globales"
+        )
+    
+    if usuario.rol == "HOSPITAL_USER":
+        if tipo_reporte == "hospital" and filtros.hospital_id != usuario.hospital_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Solo puede generar reportes de su hospital"
+            )
+        filtros = filtros.model_copy(update={"hospital_id": usuario.hospital_id})
+    
+    return filtros
+
+
 @router.post("/generar-pdf")
 async def generar_pdf(
     filtros: FiltroReporte,
     tipo_reporte: str = "global",  # global, hospital, gas
+    modo: str = "detalle",  # detalle, resumen, resumen_anexo
     db: Session = Depends(get_db),
     current_user: Usuario = Depends(get_current_user)
 ):
     """
-    Generar reporte en PDF
+    Generar reporte en PDF (servido desde el caché de exportaciones si los
+    datos no cambiaron). En modo resumen el PDF contiene solo tablas de
+    totales por gas, hospital y modo de suministro calculadas en una sola
+    consulta; resumen_anexo agrega el detalle como anexo.
     """
-    # Verificar permisos para tipo de reporte
-    if tipo_reporte == "global" and current_user.rol != "ADMIN":
+    if modo not in MODOS_PDF:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Solo ADMIN puede generar reportes globales"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Modo inválido. Opciones: {', '.join(MODOS_PDF)}"
         )
     
-    if tipo_reporte == "hospital" and current_user.rol == "HOSPITAL_USER":
-        if not filtros.hospital_id or filtros.hospital_id != current_user.hospital_id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Solo puede generar reportes de su hospital"
-            )
+    filtros = verificar_permisos_reporte(tipo_reporte, filtros, current_user)
     
-    # Obtener datos para el reporte
-    query = db.query(Consumo)
-    
-    if filtros.hospital_id:
-        query = query.filter(Consumo.hospital_id == filtros.hospital_id)
-    if filtros.gas_id:
-        query = query.filter(Consumo.gas_id == filtros.gas_id)
-    if filtros.fecha_inicio:
-        query = query.filter(Consumo.fecha_inicio >= filtros.fecha_inicio)
-    if filtros.fecha_fin:
-        query = query.filter(Consumo.fecha_fin <= filtros.fecha_fin)
-    if filtros.modo_suministro:
-        query = query.filter(Consumo.modo_suministro == filtros.modo_suministro)
-    
-    consumos = query.all()
-    
-    # Cargar relaciones
-    for consumo in consumos:
-        consumo.hospital
-        consumo.gas
-    
-    # Generar PDF
-    pdf_buffer = generar_reporte_pdf(
-        consumos=consumos,
-        tipo_reporte=tipo_reporte,
-        filtros=filtros,
-        usuario=current_user
-    )
+    # Reutilizar el archivo si ya se generó con los mismos filtros y datos.
+    # La sesión se cierra tras leer las filas para no retener la conexión
+    # mientras se renderiza.
+    async with _limite_pdf:
+        nombre, _ = await run_in_threadpool(
+            obtener_o_generar, db, tipo_reporte, "PDF", filtros, current_user, modo, liberar_sesion=db.close
+        )
     
-    # Retornar PDF
     filename = f"reporte_{tipo_reporte}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
     
-    return StreamingResponse(
-        io.BytesIO(pdf_buffer),
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    return ArchivoResponse(
+        os.path.join(settings.REPORTS_DIR, nombre),
+        media_type=MEDIA_TYPES["PDF"],
+        filename=filename
     )
 
 
@@ -272,51 +388,449 @@ async def generar_pdf(
 async def generar_excel(
     filtros: FiltroReporte,
     formato: str = "xlsx",  # xlsx, csv
+    comprimir: bool = False,  # solo csv: .csv.gz
     db: Session = Depends(get_db),
     current_user: Usuario = Depends(get_current_user)
 ):
     """
-    Generar reporte en Excel o CSV
+    Generar reporte en Excel o CSV. Ambos se leen por lotes desde un cursor
+    del servidor: el CSV se envía por streaming (opcionalmente con gzip) y el
+    XLSX se escribe con memoria constante en el caché de exportaciones.
     """
-    # Obtener datos
-    query = db.query(Consumo)
-    
-    if filtros.hospital_id:
-        query = query.filter(Consumo.hospital_id == filtros.hospital_id)
-    if filtros.gas_id:
-        query = query.filter(Consumo.gas_id == filtros.gas_id)
-    if filtros.fecha_inicio:
-        query = query.filter(Consumo.fecha_inicio >= filtros.fecha_inicio)
-    if filtros.fecha_fin:
-        query = query.filter(Consumo.fecha_fin <= filtros.fecha_fin)
-    
-    consumos = query.all()
-    
-    # Cargar relaciones
-    for consumo in consumos:
-        consumo.hospital
-        consumo.gas
-    
-    # Generar archivo
-    if formato == "xlsx":
-        file_buffer = generar_reporte_excel(consumos)
-        media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        extension = "xlsx"
-    else:
-        file_buffer = generar_reporte_excel(consumos, formato="csv")
-        media_type = "text/csv"
-        extension = "csv"
+    if formato not in ("xlsx", "csv"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Formato inválido. Opciones: xlsx, csv"
+        )
+    
+    # Los usuarios de hospital solo exportan su hospital
+    if current_user.rol == "HOSPITAL_USER":
+        filtros = filtros.model_copy(update={"hospital_id": current_user.hospital_id})
+    
+    marca = datetime.now().strftime('%Y%m%d_%H%M%S')
+    
+    if formato == "csv":
+        extension = "csv.gz" if comprimir else "csv"
+        return StreamingResponse(
+            generar_csv_streaming(filtros, comprimir=comprimir),
+            media_type="application/gzip" if comprimir else "text/csv",
+            headers={"Content-Disposition": f"attachment; filename=reporte_consumos_{marca}.{extension}"}
+        )
+    
+    nombre, _ = await run_in_threadpool(obtener_o_generar, db, "consumos", "XLSX", filtros, current_user)
+    
+    return ArchivoResponse(
+        os.path.join(settings.REPORTS_DIR, nombre),
+        media_type=MEDIA_TYPES["XLSX"],
+        filename=f"reporte_consumos_{marca}.xlsx"
+    )
+
+
+@router.post(
+    "/exportaciones",
+    response_model=TrabajoExportacionResponse,
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def encolar_exportacion(
+    request: Request,
+    datos: ExportacionRequest,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user)
+):
+    """
+    Encolar un reporte (PDF, XLSX o CSV) para generarlo en segundo plano.
+    Responde 202 de inmediato; el estado se consulta en
+    /reportes/exportaciones/{id} y el archivo se baja de .../descarga.
+    """
+    filtros = verificar_permisos_reporte(datos.tipo_reporte, datos.filtros, current_user)
+    trabajo = encolar_trabajo(db, current_user, datos.tipo_reporte, datos.formato, filtros, datos.modo)
+    
+    # Auditoría
+    auditoria = Auditoria(
+        usuario_id=current_user.id,
+        accion="ENCOLAR_EXPORTACION",
+        detalle=f"Exportación {trabajo.id}: {datos.tipo_reporte} {trabajo.formato}",
+        ip=request.client.host if request.client else None
+    )
+    db.add(auditoria)
+    db.commit()
+    db.refresh(trabajo)
     
-    filename = f"reporte_consumos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return trabajo
+
+
+@router.post(
+    "/paquetes-hospitales",
+    response_model=TrabajoExportacionResponse,
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def encolar_paquete_hospitales(
+    request: Request,
+    filtros: FiltroReporte,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_active_admin)
+):
+    """
+    Encolar el paquete de reportes por hospital: un zip con el PDF y el XLSX
+    de cada hospital con consumos en el periodo (solo ADMIN). El avance se
+    consulta en /reportes/exportaciones/{id} (progreso / progreso_total) y el
+    zip se baja de .../descarga.
+    """
+    trabajo = encolar_trabajo(db, current_user, "hospitales", "ZIP", filtros)
+    
+    # Auditoría
+    auditoria = Auditoria(
+        usuario_id=current_user.id,
+        accion="ENCOLAR_PAQUETE_HOSPITALES",
+        detalle=f"Exportación {trabajo.id}: paquete por hospital",
+        ip=request.client.host if request.client else None
+    )
+    db.add(auditoria)
+    db.commit()
+    db.refresh(trabajo)
     
-    return StreamingResponse(
-        io.BytesIO(file_buffer),
+    return trabajo
+
+
+@router.get("/exportaciones", response_model=List[TrabajoExportacionResponse])
+async def listar_exportaciones(
+    limit: int = 20,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user)
+):
+    """Últimas exportaciones del usuario"""
+    return db.query(TrabajoExportacion).filter(
+        TrabajoExportacion.usuario_id == current_user.id
+    ).order_by(TrabajoExportacion.id.desc()).limit(min(limit, 100)).all()
+
+
+def obtener_trabajo_usuario(db: Session, trabajo_id: int, usuario: Usuario) -> TrabajoExportacion:
+    """Trabajo de exportación visible para el usuario (propio, o cualquiera si es ADMIN)"""
+    trabajo = db.query(TrabajoExportacion).filter(TrabajoExportacion.id == trabajo_id).first()
+    if not trabajo or (usuario.rol != "ADMIN" and trabajo.usuario_id != usuario.id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Exportación no encontrada"
+        )
+    return trabajo
+
+
+@router.get("/exportaciones/{trabajo_id}", response_model=TrabajoExportacionResponse)
+async def obtener_exportacion(
+    trabajo_id: int,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user)
+):
+    """Estado de una exportación en segundo plano"""
+    return obtener_trabajo_usuario(db, trabajo_id, current_user)
+
+
+@router.get("/exportaciones/{trabajo_id}/descarga")
+async def descargar_exportacion(
+    trabajo_id: int,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user)
+):
+    """Descargar el archivo de una exportación completada"""
+    trabajo = obtener_trabajo_usuario(db, trabajo_id, current_user)
+    
+    if trabajo.estado != "completado":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"La exportación está en estado {trabajo.estado}"
+        )
+    
+    ruta = ruta_trabajo(trabajo)
+    if not os.path.exists(ruta):
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="El archivo de la exportación ya no está disponible"
+        )
+    
+    return ArchivoResponse(
+        ruta,
+        media_type=MEDIA_TYPES[trabajo.formato],
+        filename=f"reporte_{trabajo.tipo_reporte}_{trabajo.id}.{trabajo.formato.lower()}"
+    )
+
+
+# ============ CIERRE DE PERIODOS ============
+def obtener_cierre(db: Session, periodo: str) -> CierrePeriodo:
+    """Cierre de un periodo AAAA-MM"""
+    try:
+        fecha = datetime.strptime(periodo, "%Y-%m").date()
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Periodo inválido. Formato: AAAA-MM"
+        )
+    
+    cierre = db.query(CierrePeriodo).filter(CierrePeriodo.periodo == fecha).first()
+    if not cierre:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="El periodo no está cerrado"
+        )
+    return cierre
+
+
+@router.post("/cierres", response_model=CierrePeriodoResponse, status_code=status.HTTP_201_CREATED)
+async def cerrar_periodo_endpoint(
+    request: Request,
+    datos: CierrePeriodoRequest,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_active_admin)
+):
+    """
+    Cerrar un mes con todos sus consumos validados (solo ADMIN). Congela los
+    totales por hospital y gas y genera el resumen JSON, el PDF global y el
+    XLSX del mes; los reportes de ese mes se sirven desde ellos y sus
+    consumos ya no se pueden modificar.
+    """
+    periodo = datetime.strptime(datos.periodo, "%Y-%m").date()
+    if db.query(CierrePeriodo).filter(CierrePeriodo.periodo == periodo).first():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="El periodo ya está cerrado"
+        )
+    
+    try:
+        async with _limite_pdf:
+            cierre = await run_in_threadpool(cerrar_periodo, db, periodo, current_user)
+    except PeriodoNoCerrable as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    
+    # Auditoría
+    auditoria = Auditoria(
+        usuario_id=current_user.id,
+        accion="CERRAR_PERIODO",
+        detalle=f"Periodo cerrado: {datos.periodo} ({cierre.registros} consumos)",
+        ip=request.client.host if request.client else None
+    )
+    db.add(auditoria)
+    db.commit()
+    db.refresh(cierre)
+    
+    return cierre
+
+
+@router.get("/cierres", response_model=List[CierrePeriodoResponse])
+async def listar_cierres(
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_active_admin)
+):
+    """Periodos cerrados, del más reciente al más antiguo"""
+    return db.query(CierrePeriodo).order_by(CierrePeriodo.periodo.desc()).all()
+
+
+@router.get("/cierres/{periodo}", response_model=CierrePeriodoDetalle)
+async def obtener_cierre_endpoint(
+    periodo: str,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_active_admin)
+):
+    """Cierre de un periodo con sus totales por hospital y gas"""
+    return obtener_cierre(db, periodo)
+
+
+@router.get("/cierres/{periodo}/descarga")
+async def descargar_cierre(
+    periodo: str,
+    formato: str = "pdf",  # json, pdf, xlsx
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_active_admin)
+):
+    """Descargar el resumen JSON, el PDF o el XLSX congelados de un periodo"""
+    formato = formato.upper()
+    if formato not in ARCHIVOS_CIERRE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Formato inválido. Opciones: json, pdf, xlsx"
+        )
+    
+    cierre = obtener_cierre(db, periodo)
+    ruta = os.path.join(settings.REPORTS_DIR, archivo_cierre(cierre, formato))
+    if not os.path.exists(ruta):
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="El archivo del cierre ya no está disponible"
+        )
+    
+    return ArchivoResponse(
+        ruta,
+        media_type=MEDIA_TYPES[formato],
+        filename=f"cierre_{periodo}.{formato.lower()}"
+    )
+
+
+@router.delete("/cierres/{periodo}")
+async def reabrir_periodo_endpoint(
+    request: Request,
+    periodo: str,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_active_admin)
+):
+    """Reabrir un periodo cerrado: elimina su cierre y sus archivos (solo ADMIN)"""
+    cierre = obtener_cierre(db, periodo)
+    reabrir_periodo(db, cierre)
+    
+    # Auditoría
+    auditoria = Auditoria(
+        usuario_id=current_user.id,
+        accion="REABRIR_PERIODO",
+        detalle=f"Periodo reabierto: {periodo}",
+        ip=request.client.host if request.client else None
+    )
+    db.add(auditoria)
+    db.commit()
+    
+    return {"mensaje": "Periodo reabierto exitosamente"}
+
+
+@router.post("/exportar-columnar")
+async def exportar_columnar(
+    request: Request,
+    filtros: FiltroReporte,
+    formato: str = "parquet",  # parquet, arrow
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_active_admin)
+):
+    """
+    Exportar consumos con atributos de hospital y gas en Parquet o Arrow IPC
+    (solo ADMIN). Tipado, comprimido y escrito por lotes desde un cursor
+    del servidor.
+    """
+    if formato not in FORMATOS_COLUMNARES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Formato inválido. Opciones: {', '.join(FORMATOS_COLUMNARES)}"
+        )
+    extension, media_type = FORMATOS_COLUMNARES[formato]
+    
+    descriptor, ruta = tempfile.mkstemp(suffix=f".{extension}")
+    os.close(descriptor)
+    try:
+        total = await run_in_threadpool(exportar_consumos_columnar, db, filtros, ruta, formato)
+    except Exception:
+        os.remove(ruta)
+        raise
+    
+    # Auditoría
+    auditoria = Auditoria(
+        usuario_id=current_user.id,
+        accion="EXPORTAR_COLUMNAR",
+        detalle=f"Exportación {formato}: {total} registros",
+        ip=request.client.host if request.client else None
+    )
+    db.add(auditoria)
+    db.commit()
+    
+    filename = f"consumos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    
+    return ArchivoResponse(
+        ruta,
         media_type=media_type,
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        filename=filename,
+        background=BackgroundTask(os.remove, ruta)
+    )
+
+
+@router.get("/analitica")
+async def obtener_analitica(
+    agrupar: str = "gas",  # lista separada por comas de DIMENSIONES
+    fecha_inicio: Optional[date] = None,
+    fecha_fin: Optional[date] = None,
+    hospital_id: Optional[int] = None,
+    gas_id: Optional[int] = None,
+    modo_suministro: Optional[str] = None,
+    departamento: Optional[str] = None,
+    region_sanitaria: Optional[str] = None,
+    nivel_atencion: Optional[str] = None,
+    tipo: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_active_admin)
+):
+    """
+    Agregaciones ad-hoc sobre el caché analítico en memoria (solo ADMIN).
+    Ejemplo: agrupar=departamento,gas&nivel_atencion=terciario
+    """
+    dimensiones = [d.strip() for d in agrupar.split(",") if d.strip()]
+    invalidas = [d for d in dimensiones if d not in DIMENSIONES]
+    if invalidas:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Dimensiones inválidas: {', '.join(invalidas)}. Opciones: {', '.join(DIMENSIONES)}"
+        )
+    
+    filtros = {
+        "hospital_id": hospital_id,
+        "gas_id": gas_id,
+        "modo_suministro": modo_suministro,
+        "departamento": departamento,
+        "region_sanitaria": region_sanitaria,
+        "nivel_atencion": nivel_atencion,
+        "tipo": tipo
+    }
+    filas = await run_in_threadpool(
+        cache_analitico.agregar, db, dimensiones, fecha_inicio, fecha_fin, filtros
+    )
+    
+    return {
+        "dimensiones": dimensiones,
+        "total": round(sum(f["total"] for f in filas), 4),
+        "filas": filas,
+        "cache": cache_analitico.estado()
+    }
+
+
+@router.post("/pivot")
+async def obtener_pivot(
+    solicitud: PivotRequest,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user)
+):
+    """
+    Tabla dinámica de consumo con subtotales por fila, por columna y total
+    general. Dimensiones: hospital, departamento, region_sanitaria, gas,
+    modo_suministro, mes.
+    """
+    dimensiones = solicitud.filas + solicitud.columnas
+    invalidas = [d for d in dimensiones if d not in DIMENSIONES_PIVOT]
+    if invalidas:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Dimensiones inválidas: {', '.join(invalidas)}. Opciones: {', '.join(DIMENSIONES_PIVOT)}"
+        )
+    if len(set(dimensiones)) != len(dimensiones):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Una dimensión no puede repetirse ni estar en filas y columnas a la vez"
+        )
+    
+    # Verificar permisos
+    filtros = solicitud.filtros
+    if current_user.rol == "HOSPITAL_USER":
+        filtros = filtros.model_copy(update={"hospital_id": current_user.hospital_id})
+    
+    return await run_in_threadpool(
+        calcular_pivot, db, solicitud.filas, solicitud.columnas, filtros
     )
 
 
-@router.get("/consumo-mensual")
+@router.post("/analitica/refrescar")
+async def refrescar_analitica(
+    completo: bool = False,
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_active_admin)
+):
+    """Forzar el refresco del caché analítico (solo ADMIN)"""
+    return await run_in_threadpool(cache_analitico.refrescar, db, completo)
+
+
+@router.get("/consumo-mensual", dependencies=[Depends(etag_versiones("consumos"))])
 async def obtener_consumo_mensual(
     hospital_id: Optional[int] = None,
     gas_id: Optional[int] = None,
@@ -325,17 +839,19 @@ async def obtener_consumo_mensual(
     current_user: Usuario = Depends(get_current_user)
 ):
     """
-    Obtener consumo mensual para gráficos
+    Obtener consumo mensual para gráficos.
+    Los consumos que abarcan varios meses se prorratean por días.
     """
-    from sqlalchemy import extract
-    
     # Verificar permisos
     if current_user.rol == "HOSPITAL_USER":
         hospital_id = current_user.hospital_id
     
-    query = db.query(
-        extract('month', Consumo.fecha_inicio).label('mes'),
-        func.sum(Consumo.cantidad).label('total')
+    desde = date(año, 1, 1)
+    hasta = date(año, 12, 31)
+    
+    query = db.query(Consumo.fecha_inicio, Consumo.fecha_fin, Consumo.cantidad_normalizada).filter(
+        Consumo.fecha_inicio <= hasta,
+        Consumo.fecha_fin >= desde
     )
     
     if hospital_id:
@@ -343,21 +859,100 @@ async def obtener_consumo_mensual(
     if gas_id:
         query = query.filter(Consumo.gas_id == gas_id)
     
-    query = query.filter(extract('year', Consumo.fecha_inicio) == año)
-    query = query.group_by(extract('month', Consumo.fecha_inicio))
-    query = query.order_by(extract('month', Consumo.fecha_inicio))
-    
-    resultados = query.all()
+    inicios, fines, cantidades = cargar_intervalos(query)
+    _, valores = prorratear(inicios, fines, cantidades, "mes", desde, hasta)
     
     # Crear array con todos los meses
     meses = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", 
              "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
     
-    datos_mensuales = {i+1: 0 for i in range(12)}
-    for mes, total in resultados:
-        datos_mensuales[int(mes)] = float(total) if total else 0
-    
     return {
         "meses": meses,
-        "valores": [datos_mensuales[i+1] for i in range(12)]
+        "valores": [round(float(v), 4) for v in valores]
+    }
+
+
+@router.get("/serie-temporal")
+async def obtener_serie_temporal(
+    granularidad: str = "mes",  # dia, semana, mes
+    fecha_inicio: Optional[date] = None,
+    fecha_fin: Optional[date] = None,
+    hospital_id: Optional[int] = None,
+    gas_id: Optional[int] = None,
+    agrupar_por: Optional[str] = None,  # gas, hospital
+    db: Session = Depends(get_db),
+    current_user: Usuario = Depends(get_current_user)
+):
+    """
+    Serie temporal de consumo prorrateado por día, semana o mes,
+    opcionalmente separada por gas u hospital, con el total general
+    """
+    if granularidad not in GRANULARIDADES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Granularidad inválida. Opciones: {', '.join(GRANULARIDADES)}"
+        )
+    if agrupar_por not in (None, "gas", "hospital"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="agrupar_por debe ser 'gas' o 'hospital'"
+        )
+    if fecha_inicio and fecha_fin and fecha_fin < fecha_inicio:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="fecha_fin debe ser mayor o igual a fecha_inicio"
+        )
+    
+    # Verificar permisos
+    if current_user.rol == "HOSPITAL_USER":
+        hospital_id = current_user.hospital_id
+    
+    columna_grupo = {"gas": Consumo.gas_id, "hospital": Consumo.hospital_id}.get(agrupar_por)
+    columnas = [Consumo.fecha_inicio, Consumo.fecha_fin, Consumo.cantidad_normalizada]
+    if columna_grupo is not None:
+        columnas.append(columna_grupo)
+    
+    # Consumos que se superponen con la ventana
+    query = db.query(*columnas)
+    if fecha_inicio:
+        query = query.filter(Consumo.fecha_fin >= fecha_inicio)
+    if fecha_fin:
+        query = query.filter(Consumo.fecha_inicio <= fecha_fin)
+    if hospital_id:
+        query = query.filter(Consumo.hospital_id == hospital_id)
+    if gas_id:
+        query = query.filter(Consumo.gas_id == gas_id)
+    
+    arreglos = cargar_intervalos(query)
+    inicios, fines, cantidades = arreglos[:3]
+    
+    if columna_grupo is None:
+        periodos, total = prorratear(inicios, fines, cantidades, granularidad, fecha_inicio, fecha_fin)
+        series = []
+    else:
+        ids, claves = np.unique(arreglos[3], return_inverse=True)
+        periodos, matriz = prorratear(
+            inicios, fines, cantidades, granularidad, fecha_inicio, fecha_fin,
+            claves=claves, n_claves=len(ids)
+        )
+        total = matriz.sum(axis=0)
+        
+        modelo = Gas if agrupar_por == "gas" else Hospital
+        nombres = dict(
+            db.query(modelo.id, modelo.nombre).filter(modelo.id.in_(ids.tolist())).all()
+        ) if len(ids) else {}
+        series = [
+            {
+                "id": int(id_),
+                "nombre": nombres.get(int(id_)),
+                "valores": [round(float(v), 4) for v in fila]
+            }
+            for id_, fila in zip(ids, matriz)
+        ]
+    
+    return {
+        "granularidad": granularidad,
+        "periodos": formatear_periodos(periodos, granularidad),
+        "total": [round(float(v), 4) for v in total],
+        "series": series
     }
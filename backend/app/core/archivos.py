@@ -0,0 +1,124 @@
+"""
+Respuestas de Archivos con Rangos
+Sistema de Gases Medicinales MSPBS
+
+FileResponse de Starlette 0.27 no atiende el encabezado Range, de modo que
+una descarga interrumpida vuelve a empezar desde cero. ArchivoResponse
+agrega Range/If-Range (un solo rango, respuesta 206 o 416), Accept-Ranges y
+Content-Length del tramo enviado. Si el servidor ASGI ofrece la extensión
+`http.response.zerocopysend`, el archivo se envía con sendfile sin pasar
+por Python; si no, se lee por bloques.
+"""
+
+import os
+import re
+import stat
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+
+PATRON_RANGO = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def interpretar_rango(valor: str, tamano: int) -> Optional[Tuple[int, int]]:
+    """
+    (inicio, fin) inclusivos de un encabezado Range de un solo tramo.
+    Retorna None si el encabezado no se puede usar (se envía el archivo
+    completo) y lanza ValueError si el rango no es satisfacible.
+    """
+    coincidencia = PATRON_RANGO.match(valor.replace(" ", ""))
+    if not coincidencia:
+        # Varios tramos o unidades distintas de bytes: se ignora el Range
+        return None
+    inicio, fin = coincidencia.groups()
+    if not inicio and not fin:
+        return None
+    if not inicio:
+        # Sufijo: los últimos N bytes
+        largo = int(fin)
+        if largo == 0:
+            raise ValueError("Rango vacío")
+        return max(tamano - largo, 0), tamano - 1
+    inicio = int(inicio)
+    fin = min(int(fin), tamano - 1) if fin else tamano - 1
+    if inicio >= tamano or inicio > fin:
+        raise ValueError("Rango fuera del archivo")
+    return inicio, fin
+
+
+class ArchivoResponse(FileResponse):
+    """FileResponse con descargas reanudables (Range) y envío zero-copy"""
+
+    def _rango_pedido(self, scope: Scope, tamano: int) -> Optional[Tuple[int, int]]:
+        encabezados = Headers(scope=scope)
+        rango = encabezados.get("range")
+        if not rango:
+            return None
+        # If-Range: solo reanudar si el archivo sigue siendo el mismo
+        condicion = encabezados.get("if-range")
+        if condicion and condicion.strip('"') not in (
+            self.headers.get("etag"), self.headers.get("last-modified")
+        ):
+            return None
+        return interpretar_rango(rango, tamano)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.stat_result is None:
+            try:
+                self.stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+            except FileNotFoundError:
+                raise RuntimeError(f"File at path {self.path} does not exist.")
+            if not stat.S_ISREG(self.stat_result.st_mode):
+                raise RuntimeError(f"File at path {self.path} is not a file.")
+            self.set_stat_headers(self.stat_result)
+
+        tamano = self.stat_result.st_size
+        self.headers["accept-ranges"] = "bytes"
+        inicio, fin = 0, tamano - 1
+        try:
+            rango = self._rango_pedido(scope, tamano)
+        except ValueError:
+            rango = None
+            self.status_code = 416
+            self.headers["content-range"] = f"bytes */{tamano}"
+            self.headers["content-length"] = "0"
+            self.send_header_only = True
+        if rango:
+            inicio, fin = rango
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {inicio}-{fin}/{tamano}"
+            self.headers["content-length"] = str(fin - inicio + 1)
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+        if self.send_header_only or tamano == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as archivo:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": archivo.fileno(),
+                    "offset": inicio,
+                    "count": fin - inicio + 1,
+                    "more_body": False
+                })
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as archivo:
+                await archivo.seek(inicio)
+                restantes = fin - inicio + 1
+                while restantes > 0:
+                    bloque = await archivo.read(min(self.chunk_size, restantes))
+                    if not bloque:
+                        break
+                    restantes -= len(bloque)
+                    await send({"type": "http.response.body", "body": bloque, "more_body": restantes > 0})
+                if restantes > 0:
+                    # El archivo se acortó durante el envío
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+        if self.background is not None:
+            await self.background()
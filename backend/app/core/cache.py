@@ -0,0 +1,54 @@
+"""
+Caché en Memoria con Vencimiento
+Sistema de Gases Medicinales MSPBS
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+def clave_cache(*partes: Any) -> str:
+    """Clave estable a partir de parámetros (dicts, listas, fechas, modelos Pydantic)"""
+    normalizadas = [p.model_dump() if hasattr(p, "model_dump") else p for p in partes]
+    return json.dumps(normalizadas, sort_keys=True, default=str)
+
+
+class CacheTTL:
+    """
+    Caché LRU por proceso con vencimiento por tiempo
+    """
+
+    def __init__(self, ttl: int, max_items: int = 256):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave: str) -> Optional[Any]:
+        """Valor guardado o None si no existe o venció"""
+        with self._lock:
+            item = self._items.get(clave)
+            if item is None:
+                return None
+            vence, valor = item
+            if vence < time.monotonic():
+                del self._items[clave]
+                return None
+            self._items.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave: str, valor: Any):
+        """Guardar un valor, descartando el menos usado si se supera el máximo"""
+        with self._lock:
+            self._items[clave] = (time.monotonic() + self.ttl, valor)
+            self._items.move_to_end(clave)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def limpiar(self):
+        """Descartar todo el contenido"""
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,49 @@
+"""
+Recepción de Archivos Subidos
+Sistema de Gases Medicinales MSPBS
+
+El cuerpo del pedido se copia a un archivo temporal a medida que llega, de
+modo que un archivo grande nunca se tiene entero en memoria, y se corta
+con 413 apenas supera el límite (sin esperar al final si Content-Length ya
+lo anuncia).
+"""
+
+import os
+import tempfile
+
+from fastapi import HTTPException, Request, status
+
+
+async def recibir_cuerpo(request: Request, limite: int, sufijo: str = "") -> str:
+    """
+    Guardar el cuerpo del pedido en un archivo temporal de a lo sumo
+    `limite` bytes. Retorna la ruta; quien llama debe borrar el archivo.
+    """
+    error = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"El archivo supera el máximo de {limite // (1024 * 1024)} MB"
+    )
+    largo = request.headers.get("content-length")
+    if largo and largo.isdigit() and int(largo) > limite:
+        raise error
+
+    descriptor, ruta = tempfile.mkstemp(suffix=sufijo)
+    recibidos = 0
+    try:
+        with os.fdopen(descriptor, "wb") as archivo:
+            async for bloque in request.stream():
+                recibidos += len(bloque)
+                if recibidos > limite:
+                    raise error
+                archivo.write(bloque)
+    except BaseException:
+        os.remove(ruta)
+        raise
+
+    if not recibidos:
+        os.remove(ruta)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El pedido no contiene un archivo"
+        )
+    return ruta
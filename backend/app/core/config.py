@@ -48,8 +48,41 @@ class Settings(BaseSettings):
     REPORTS_DIR: str = "static/reports"
     LOGO_PATH: str = "static/logos/mspbs_logo.png"
     
+    # Detección de alertas (0 desactiva la ejecución programada)
+    ALERTAS_INTERVALO: int = 3600  # 1 hora
+    ALERTAS_MESES_HISTORIA: int = 12
+    ALERTAS_MIN_MESES: int = 6
+    ALERTAS_UMBRAL_Z: float = 3.5
+    
+    # Pronóstico de demanda (0 desactiva la ejecución programada)
+    PRONOSTICO_INTERVALO: int = 86400  # 1 día
+    PRONOSTICO_HORIZONTE: int = 3  # meses
+    PRONOSTICO_MESES_HISTORIA: int = 36
+    
+    # Pool de procesos para cálculos pesados (simulaciones, renderizado)
+    PROCESOS_MAX_WORKERS: int = 2
+    PDF_MAX_CONCURRENTES: int = 4  # Pedidos de la API generando PDF a la vez; el resto espera sin tomar hilos
+    PDF_FILAS_RAPIDO: int = 2000  # Desde cuántas filas se usa el renderizador de canvas
+    PAQUETE_HOSPITALES_EN_CURSO: int = 4  # Hospitales de un paquete renderizándose a la vez
+    SIMULACION_MAX_ESCENARIOS: int = 100000
+    
+    # Caché analítico en memoria (segundos entre refrescos incrementales)
+    ANALITICA_REFRESCO_SEGUNDOS: int = 60
+    
+    # Caché de tablas dinámicas y rankings (segundos de vigencia)
+    PIVOT_CACHE_TTL: int = 300
+    RANKING_CACHE_TTL: int = 900
+    
+    # Exportaciones en segundo plano (segundos entre sondeos de la cola;
+    # 0 desactiva el worker interno y deja la cola a scripts/worker_exportaciones.py)
+    EXPORTACION_SONDEO: int = 10
+    EXPORTACION_TIMEOUT: int = 1800  # Trabajos "procesando" más antiguos se reintentan
+    EXPORTACION_MAX_INTENTOS: int = 3
+    EXPORTACION_CACHE_MAX_MB: int = 500  # Tamaño máximo de REPORTS_DIR (poda LRU)
+    
     # Límites de archivos
     MAX_UPLOAD_SIZE: int = 10485760  # 10 MB
+    CONSUMOS_LOTE_MAX: int = 5000  # Registros por pedido a /consumos/lote
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,59 @@
+"""
+ETags a partir de Versiones de Tablas
+Sistema de Gases Medicinales MSPBS
+
+Dependencia para endpoints de lectura: calcula un ETag con las versiones de
+las tablas consultadas, los parámetros de la petición y el usuario, y
+responde 304 Not Modified si coincide con If-None-Match, antes de ejecutar
+la consulta del endpoint.
+"""
+
+import hashlib
+from datetime import date
+from typing import Callable
+
+from fastapi import Depends, HTTPException, Request, Response, status
+from sqlalchemy.orm import Session
+
+from app.core.database import get_db
+from app.core.security import get_current_user
+from app.models.models import Usuario
+from app.services.versiones_service import obtener_versiones
+
+
+def calcular_etag(versiones: dict, request: Request, usuario: Usuario) -> str:
+    """ETag débil: cambia con cualquier versión, parámetro, usuario o día"""
+    partes = [
+        request.url.path,
+        str(sorted(request.query_params.multi_items())),
+        f"{usuario.id}:{usuario.rol}:{usuario.hospital_id}",
+        # Algunos endpoints usan la fecha actual como valor por defecto
+        date.today().isoformat(),
+    ] + [f"{tabla}={version}" for tabla, version in sorted(versiones.items())]
+    return 'W/"' + hashlib.sha1("|".join(partes).encode()).hexdigest() + '"'
+
+
+def etag_versiones(*tablas: str, usuario_dependencia: Callable = get_current_user) -> Callable:
+    """
+    Dependencia que responde 304 si el cliente ya tiene la versión actual.
+    `usuario_dependencia` debe ser la misma que usa el endpoint (p. ej.
+    get_current_active_admin) para que los permisos se verifiquen antes.
+
+    Uso: @router.get("/", dependencies=[Depends(etag_versiones("gases"))])
+    """
+    async def verificar_etag(
+        request: Request,
+        response: Response,
+        db: Session = Depends(get_db),
+        current_user: Usuario = Depends(usuario_dependencia)
+    ):
+        etag = calcular_etag(obtener_versiones(db, tablas), request, current_user)
+        encabezados = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+        candidatos = request.headers.get("if-none-match", "")
+        if etag in [c.strip() for c in candidatos.split(",")] or candidatos.strip() == "*":
+            raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=encabezados)
+
+        response.headers.update(encabezados)
+
+    return verificar_etag
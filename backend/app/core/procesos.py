@@ -0,0 +1,50 @@
+"""
+Pool de Procesos para Cálculos Pesados
+Sistema de Gases Medicinales MSPBS
+
+Los cálculos intensivos en CPU (simulaciones, renderizado) se ejecutan en
+procesos aparte para no bloquear el event loop ni retener el GIL de los
+workers de la API. Las funciones enviadas deben ser de nivel de módulo y
+recibir y retornar datos serializables (sin sesiones ni objetos ORM).
+"""
+
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+from app.core.config import settings
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def obtener_pool() -> ProcessPoolExecutor:
+    """Pool compartido, creado en el primer uso"""
+    global _pool
+    with _lock:
+        if _pool is None:
+            # spawn evita heredar hilos y conexiones abiertas del proceso de la API
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.PROCESOS_MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+async def ejecutar_en_proceso(funcion: Callable, *args, **kwargs) -> Any:
+    """Ejecutar `funcion(*args, **kwargs)` en el pool y esperar el resultado"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(obtener_pool(), partial(funcion, *args, **kwargs))
+
+
+def cerrar_pool():
+    """Cerrar el pool (al detener la aplicación)"""
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
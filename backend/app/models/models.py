@@ -4,7 +4,7 @@ DGGIES - Dirección General de Gestión de Información y Estadísticas de Salud
 Ministerio de Salud y Bienestar Social - Paraguay
 """
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Text, Boolean, Date
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, ForeignKey, Text, Boolean, Date, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.core.database import Base
@@ -30,7 +30,7 @@ class Usuario(Base):
 
     # Relaciones
     hospital = relationship("Hospital", back_populates="usuarios")
-    consumos = relationship("Consumo", back_populates="usuario")
+    consumos = relationship("Consumo", back_populates="usuario", foreign_keys="Consumo.usuario_id")
     auditorias = relationship("Auditoria", back_populates="usuario")
 
 
@@ -91,6 +91,7 @@ class Consumo(Base):
     modo_suministro = Column(String(50), nullable=False)  # tanque_criogenico, cilindros, red_central, PSA
     unidad_medida = Column(String(20), nullable=False)
     cantidad = Column(Float, nullable=False)
+    cantidad_normalizada = Column(Float, nullable=True)  # En Gas.unidad_base
     observaciones = Column(Text, nullable=True)
     usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
     validado = Column(Boolean, default=False)  # Para validación por ADMIN
@@ -105,6 +106,39 @@ class Consumo(Base):
     usuario = relationship("Usuario", back_populates="consumos", foreign_keys=[usuario_id])
 
 
+class CumplimientoRegistro(Base):
+    """
+    Índice de cumplimiento de registro: meses cubiertos por consumos de un
+    hospital y gas en un año, como bitset (bit 0 = enero ... bit 11 = diciembre)
+    """
+    __tablename__ = "cumplimiento_registro"
+    __table_args__ = (UniqueConstraint("hospital_id", "gas_id", "anio", name="uq_cumplimiento_hospital_gas_anio"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    hospital_id = Column(Integer, ForeignKey("hospitales.id"), nullable=False)
+    gas_id = Column(Integer, ForeignKey("gases.id"), nullable=False)
+    anio = Column(Integer, nullable=False, index=True)
+    meses = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class PronosticoConsumo(Base):
+    """Pronóstico de consumo mensual de un hospital y gas"""
+    __tablename__ = "pronosticos_consumo"
+    __table_args__ = (UniqueConstraint("hospital_id", "gas_id", "periodo", name="uq_pronostico_hospital_gas_periodo"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    hospital_id = Column(Integer, ForeignKey("hospitales.id"), nullable=False, index=True)
+    gas_id = Column(Integer, ForeignKey("gases.id"), nullable=False)
+    periodo = Column(Date, nullable=False)  # Mes pronosticado (primer día)
+    cantidad = Column(Float, nullable=False)  # En Gas.unidad_base
+    limite_inferior = Column(Float, nullable=False)
+    limite_superior = Column(Float, nullable=False)
+    modelo = Column(String(30), nullable=False)  # suavizado_exponencial, estacional_ingenuo
+    error_medio = Column(Float, nullable=True)  # MAE dentro de la muestra
+    generado_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class Auditoria(Base):
     """Registro de auditoría del sistema"""
     __tablename__ = "auditoria"
@@ -127,6 +161,8 @@ class Alerta(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     hospital_id = Column(Integer, ForeignKey("hospitales.id"), nullable=True)
+    gas_id = Column(Integer, ForeignKey("gases.id"), nullable=True)
+    periodo = Column(Date, nullable=True, index=True)  # Mes evaluado (primer día)
     tipo = Column(String(50), nullable=False)  # consumo_alto, consumo_bajo, sin_registro
     severidad = Column(String(20), nullable=False)  # info, warning, critical
     mensaje = Column(Text, nullable=False)
@@ -152,6 +188,15 @@ class Configuracion(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
 
+class VersionTabla(Base):
+    """Contador de cambios por tabla, incrementado por cada escritura (para ETags)"""
+    __tablename__ = "versiones_tabla"
+
+    tabla = Column(String(50), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
 class HistorialExportacion(Base):
     """Registro de exportaciones de reportes"""
     __tablename__ = "historial_exportacion"
@@ -163,3 +208,64 @@ class HistorialExportacion(Base):
     parametros = Column(Text, nullable=True)  # JSON con filtros aplicados
     archivo_generado = Column(String(255), nullable=True)
     fecha_generacion = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class TrabajoExportacion(Base):
+    """
+    Cola de exportaciones en segundo plano. Los workers reclaman trabajos
+    pendientes con SELECT ... FOR UPDATE SKIP LOCKED.
+    """
+    __tablename__ = "trabajos_exportacion"
+
+    id = Column(Integer, primary_key=True, index=True)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False, index=True)
+    tipo_reporte = Column(String(50), nullable=False)  # global, hospital, gas
+    formato = Column(String(10), nullable=False)  # PDF, CSV, XLSX, ZIP
+    modo = Column(String(20), nullable=False, default="detalle")  # detalle, resumen, resumen_anexo (PDF)
+    parametros = Column(Text, nullable=True)  # JSON con filtros aplicados
+    estado = Column(String(20), nullable=False, default="pendiente", index=True)  # pendiente, procesando, completado, error
+    intentos = Column(Integer, nullable=False, default=0)
+    archivo = Column(String(255), nullable=True)  # Relativo a REPORTS_DIR
+    tamano = Column(BigInteger, nullable=True)  # Bytes
+    error = Column(Text, nullable=True)
+    progreso = Column(Integer, nullable=False, default=0)  # Partes terminadas (hospitales de un paquete)
+    progreso_total = Column(Integer, nullable=True)
+    progreso_at = Column(DateTime(timezone=True), nullable=True)  # Último avance registrado
+    historial_id = Column(Integer, ForeignKey("historial_exportacion.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    iniciado_at = Column(DateTime(timezone=True), nullable=True)
+    finalizado_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class CierrePeriodo(Base):
+    """
+    Cierre de un mes con todos sus consumos validados. Guarda los agregados
+    por hospital y gas y los archivos del reporte del mes (en
+    REPORTS_DIR/cierres/AAAA-MM), que se sirven en lugar de recalcularlos.
+    """
+    __tablename__ = "cierres_periodo"
+
+    id = Column(Integer, primary_key=True, index=True)
+    periodo = Column(Date, unique=True, nullable=False, index=True)  # Primer día del mes
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    registros = Column(Integer, nullable=False)
+    hospitales = Column(Integer, nullable=False)
+    directorio = Column(String(255), nullable=False)  # Relativo a REPORTS_DIR
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    agregados = relationship("AgregadoCierre", back_populates="cierre", cascade="all, delete-orphan")
+
+
+class AgregadoCierre(Base):
+    """Totales congelados de un hospital y gas en un periodo cerrado"""
+    __tablename__ = "agregados_cierre"
+    __table_args__ = (UniqueConstraint("cierre_id", "hospital_id", "gas_id", name="uq_agregado_cierre_hospital_gas"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    cierre_id = Column(Integer, ForeignKey("cierres_periodo.id", ondelete="CASCADE"), nullable=False, index=True)
+    hospital_id = Column(Integer, ForeignKey("hospitales.id"), nullable=False)
+    gas_id = Column(Integer, ForeignKey("gases.id"), nullable=False)
+    registros = Column(Integer, nullable=False)
+    cantidad = Column(Float, nullable=False)  # En Gas.unidad_base
+
+    cierre = relationship("CierrePeriodo", back_populates="agregados")
@@ -3,8 +3,8 @@ Schemas Pydantic para Validación
 Sistema de Gases Medicinales MSPBS
 """
 
-from pydantic import BaseModel, EmailStr, Field, validator
-from typing import Optional, List
+from pydantic import BaseModel, EmailStr, Field, confloat, validator
+from typing import Dict, Optional, List
 from datetime import datetime, date
 from enum import Enum
 
@@ -207,6 +207,7 @@ class ConsumoUpdate(BaseModel):
 
 class ConsumoResponse(ConsumoBase):
     id: int
+    cantidad_normalizada: Optional[float] = None
     usuario_id: int
     validado: bool
     validado_por: Optional[int]
@@ -232,6 +233,69 @@ class FiltroReporte(BaseModel):
     departamento: Optional[str] = None
 
 
+class PivotRequest(BaseModel):
+    filas: List[str] = Field(..., min_length=1)
+    columnas: List[str] = []
+    filtros: FiltroReporte = FiltroReporte()
+
+
+class ExportacionRequest(BaseModel):
+    tipo_reporte: str = Field("global", pattern="^(global|hospital|gas)$")
+    formato: str = Field("pdf", pattern="^(pdf|xlsx|csv)$")
+    modo: str = Field("detalle", pattern="^(detalle|resumen|resumen_anexo)$")  # solo pdf
+    filtros: FiltroReporte = FiltroReporte()
+
+
+class TrabajoExportacionResponse(BaseModel):
+    id: int
+    tipo_reporte: str
+    formato: str
+    modo: str = "detalle"
+    estado: str
+    intentos: int
+    tamano: Optional[int] = None
+    error: Optional[str] = None
+    progreso: int = 0
+    progreso_total: Optional[int] = None
+    historial_id: Optional[int] = None
+    created_at: datetime
+    iniciado_at: Optional[datetime] = None
+    finalizado_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class CierrePeriodoRequest(BaseModel):
+    periodo: str = Field(..., pattern=r"^\d{4}-(0[1-9]|1[0-2])$")  # AAAA-MM
+
+
+class AgregadoCierreResponse(BaseModel):
+    hospital_id: int
+    gas_id: int
+    registros: int
+    cantidad: float
+    
+    class Config:
+        from_attributes = True
+
+
+class CierrePeriodoResponse(BaseModel):
+    id: int
+    periodo: date
+    usuario_id: int
+    registros: int
+    hospitales: int
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+
+class CierrePeriodoDetalle(CierrePeriodoResponse):
+    agregados: List[AgregadoCierreResponse] = []
+
+
 class ReporteGlobalRequest(BaseModel):
     fecha_inicio: date
     fecha_fin: date
@@ -276,16 +340,57 @@ class DashboardStats(BaseModel):
 class AlertaResponse(BaseModel):
     id: int
     hospital_id: Optional[int]
+    gas_id: Optional[int] = None
+    periodo: Optional[date] = None
     tipo: str
     severidad: SeveridadAlertaEnum
     mensaje: str
     fecha_deteccion: datetime
     resuelta: bool
+    fecha_resolucion: Optional[datetime] = None
+    notas_resolucion: Optional[str] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class AlertaResolver(BaseModel):
+    notas_resolucion: Optional[str] = None
+
+
+# ============ PLANIFICACION ============
+class PronosticoResponse(BaseModel):
+    id: int
+    hospital_id: int
+    gas_id: int
+    periodo: date
+    cantidad: float
+    limite_inferior: float
+    limite_superior: float
+    modelo: str
+    error_medio: Optional[float]
+    generado_at: Optional[datetime]
     
     class Config:
         from_attributes = True
 
 
+class SimulacionOxigenoRequest(BaseModel):
+    gas_id: Optional[int] = None  # Por defecto oxígeno (código O2)
+    aumentos: Dict[str, confloat(ge=-100)] = {}  # region_sanitaria -> aumento en %
+    aumento_general: float = Field(0, ge=-100)  # Para las regiones no listadas
+    incertidumbre: float = Field(0.5, ge=0, le=5)  # Coef. de variación del shock
+    escenarios: int = Field(20000, ge=100)
+    percentiles: List[float] = [5, 25, 50, 75, 95]
+    semilla: Optional[int] = None
+    
+    @validator('percentiles')
+    def validate_percentiles(cls, v):
+        if not v or any(p < 0 or p > 100 for p in v):
+            raise ValueError('percentiles deben estar entre 0 y 100')
+        return v
+
+
 # ============ AUDITORIA ============
 class AuditoriaResponse(BaseModel):
     id: int
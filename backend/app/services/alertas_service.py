@@ -0,0 +1,311 @@
+"""
+Servicio de Detección de Alertas
+Sistema de Gases Medicinales MSPBS
+
+Construye la serie mensual de cada par hospital × gas (prorrateada por días) y
+compara el último mes completo con su propia historia usando un z-score
+robusto (mediana y MAD) calculado para todas las series a la vez.
+"""
+
+import json
+import numpy as np
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, insert, select, text, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.models import Alerta, Configuracion, Consumo, Gas, Hospital
+from app.services.prorrateo_service import cargar_intervalos, fechas_a_dias, prorratear
+from app.services.tareas_service import TareaPeriodica
+from app.services.versiones_service import incrementar_version
+
+
+CLAVE_ESTADO = "alertas_ultima_ejecucion"
+TIPOS_ALERTA = ("consumo_alto", "consumo_bajo", "sin_registro")
+
+# Clave arbitraria para pg_try_advisory_xact_lock: evita que dos workers
+# de uvicorn ejecuten el detector al mismo tiempo
+_LOCK_DETECTOR = 270270
+
+
+def sumar_meses(fecha: date, meses: int) -> date:
+    """Primer día del mes que está `meses` meses después de `fecha`"""
+    indice = fecha.year * 12 + fecha.month - 1 + meses
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def _leer_configuracion(db: Session, clave: str, defecto: float) -> float:
+    valor = db.query(Configuracion.valor).filter(Configuracion.clave == clave).scalar()
+    try:
+        return float(valor) if valor is not None else defecto
+    except ValueError:
+        return defecto
+
+
+def _leer_estado(db: Session) -> Optional[dict]:
+    valor = db.query(Configuracion.valor).filter(Configuracion.clave == CLAVE_ESTADO).scalar()
+    return json.loads(valor) if valor else None
+
+
+def _guardar_estado(db: Session, estado: dict):
+    config = db.query(Configuracion).filter(Configuracion.clave == CLAVE_ESTADO).first()
+    if not config:
+        config = Configuracion(
+            clave=CLAVE_ESTADO,
+            descripcion="Marca de la última ejecución del detector de alertas",
+            tipo="json",
+            valor=""
+        )
+        db.add(config)
+    config.valor = json.dumps(estado)
+
+
+def calcular_zscores_robustos(
+    historia: np.ndarray,
+    actual: np.ndarray,
+    min_meses: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Z-score robusto del valor actual de cada serie respecto de su historia.
+
+    `historia` tiene forma (n_series, n_meses) con NaN en los meses sin datos.
+    Retorna (z, mediana, meses_con_datos); z es NaN si la serie no tiene
+    al menos `min_meses` meses de historia.
+    """
+    meses_con_datos = np.sum(~np.isnan(historia), axis=1)
+    suficientes = meses_con_datos >= min_meses
+
+    z = np.full(len(actual), np.nan)
+    mediana = np.full(len(actual), np.nan)
+    if not suficientes.any():
+        return z, mediana, meses_con_datos
+
+    hist = historia[suficientes]
+    med = np.nanmedian(hist, axis=1)
+    mad = np.nanmedian(np.abs(hist - med[:, None]), axis=1)
+    # 1.4826 * MAD estima el desvío estándar; el piso evita dividir por cero
+    # en series casi constantes
+    escala = np.maximum(1.4826 * mad, 0.01 * np.abs(med))
+    escala[escala == 0] = 1.0
+
+    z[suficientes] = (actual[suficientes] - med) / escala
+    mediana[suficientes] = med
+    return z, mediana, meses_con_datos
+
+
+def _hospitales_a_procesar(
+    db: Session,
+    estado: Optional[dict],
+    periodo: date,
+    forzar: bool
+) -> Tuple[List[int], bool]:
+    """
+    Hospitales activos a evaluar. Es incremental (solo hospitales con consumos
+    creados o modificados desde la última ejecución) salvo que se fuerce o que
+    haya cambiado el mes evaluado.
+    """
+    activos = db.query(Hospital.id).filter(Hospital.estado == True)
+    if forzar or not estado or estado.get("periodo") != periodo.isoformat():
+        return [h[0] for h in activos.all()], False
+
+    marca = datetime.fromisoformat(estado["marca"])
+    modificados = select(Consumo.hospital_id).where(
+        func.coalesce(Consumo.updated_at, Consumo.created_at) > marca
+    ).distinct()
+    return [h[0] for h in activos.filter(Hospital.id.in_(modificados)).all()], True
+
+
+def detectar_alertas(db: Session, forzar: bool = False, hoy: Optional[date] = None) -> dict:
+    """
+    Evaluar el último mes completo y registrar alertas de consumo alto,
+    consumo bajo y falta de registro. Solo inserta alertas nuevas, actualiza
+    las que cambiaron y resuelve automáticamente las que ya no aplican.
+    """
+    if db.bind.dialect.name == "postgresql":
+        if not db.execute(text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": _LOCK_DETECTOR}).scalar():
+            return {"omitido": "Otra ejecución del detector está en curso"}
+
+    hoy = hoy or date.today()
+    periodo = sumar_meses(hoy, -1)
+    fin_periodo = sumar_meses(hoy, 0) - timedelta(days=1)
+    inicio_historia = sumar_meses(periodo, -settings.ALERTAS_MESES_HISTORIA)
+
+    marca = db.query(func.now()).scalar()
+    estado = _leer_estado(db)
+    hospital_ids, incremental = _hospitales_a_procesar(db, estado, periodo, forzar)
+
+    resumen = {
+        "periodo": periodo.isoformat(),
+        "incremental": incremental,
+        "hospitales_procesados": len(hospital_ids),
+        "series_evaluadas": 0,
+        "nuevas": 0,
+        "actualizadas": 0,
+        "resueltas": 0
+    }
+
+    if hospital_ids:
+        detectadas, n_series = _evaluar_series(db, hospital_ids, periodo, fin_periodo, inicio_historia, hoy)
+        resumen["series_evaluadas"] = n_series
+        resumen.update(_sincronizar_alertas(db, hospital_ids, periodo, detectadas))
+
+    _guardar_estado(db, {"marca": marca.isoformat(), "periodo": periodo.isoformat()})
+    db.commit()
+    return resumen
+
+
+def _evaluar_series(
+    db: Session,
+    hospital_ids: List[int],
+    periodo: date,
+    fin_periodo: date,
+    inicio_historia: date,
+    hoy: date
+) -> Tuple[Dict[tuple, dict], int]:
+    """Calcular las alertas de todas las series hospital × gas de los hospitales dados"""
+    query = db.query(
+        Consumo.fecha_inicio,
+        Consumo.fecha_fin,
+        Consumo.cantidad_normalizada,
+        Consumo.hospital_id,
+        Consumo.gas_id
+    ).join(Gas).filter(
+        Gas.estado == True,
+        Consumo.hospital_id.in_(hospital_ids),
+        Consumo.fecha_fin >= inicio_historia
+    )
+    inicios, fines, cantidades, hospitales, gases = cargar_intervalos(query)
+    if len(inicios) == 0:
+        return {}, 0
+
+    # Una serie por par (hospital, gas)
+    pares, claves = np.unique(np.stack([hospitales, gases], axis=1), axis=0, return_inverse=True)
+    claves = claves.ravel()
+    n_series = len(pares)
+
+    # Cantidad y días cubiertos por mes; la tasa diaria no penaliza meses
+    # reportados parcialmente
+    _, cantidad_mes = prorratear(
+        inicios, fines, cantidades, "mes", inicio_historia, fin_periodo, claves=claves, n_claves=n_series
+    )
+    _, dias_mes = prorratear(
+        inicios, fines, (fines - inicios + 1).astype(np.float64), "mes",
+        inicio_historia, fin_periodo, claves=claves, n_claves=n_series
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tasa = np.where(dias_mes > 0, cantidad_mes / dias_mes, np.nan)
+
+    z, mediana, meses_historia = calcular_zscores_robustos(
+        tasa[:, :-1], tasa[:, -1], settings.ALERTAS_MIN_MESES
+    )
+    actual = tasa[:, -1]
+
+    umbral_z = settings.ALERTAS_UMBRAL_Z
+    umbral_pct = _leer_configuracion(db, "alerta_consumo_alto_umbral", 150) / 100
+    dias_sin_registro = _leer_configuracion(db, "alerta_consumo_bajo_dias", 30)
+
+    # Último día reportado por serie
+    ultimo_fin = np.full(n_series, np.iinfo(np.int64).min)
+    np.maximum.at(ultimo_fin, claves, fines)
+    dias_desde_ultimo = fechas_a_dias([hoy])[0] - ultimo_fin
+
+    with np.errstate(invalid="ignore"):
+        alto = (z > umbral_z) & (actual > mediana * umbral_pct)
+        bajo = (z < -umbral_z) & (actual < mediana * (2 - umbral_pct))
+    sin_registro = (meses_historia >= settings.ALERTAS_MIN_MESES) & (dias_desde_ultimo > dias_sin_registro)
+
+    gases_info = {
+        g.id: g for g in db.query(Gas).filter(Gas.id.in_(np.unique(pares[:, 1]).tolist())).all()
+    }
+    etiqueta_periodo = periodo.strftime("%m/%Y")
+
+    detectadas = {}
+    for i in np.flatnonzero(alto | bajo | sin_registro):
+        hospital_id, gas_id = int(pares[i, 0]), int(pares[i, 1])
+        gas = gases_info[gas_id]
+        if sin_registro[i]:
+            tipo = "sin_registro"
+            severidad = "critical" if gas.es_critico else "warning"
+            mensaje = (
+                f"Sin registros de {gas.nombre} desde hace {int(dias_desde_ultimo[i])} días "
+                f"(último periodo informado hasta {np.datetime64(int(ultimo_fin[i]), 'D')})"
+            )
+        else:
+            tipo = "consumo_alto" if alto[i] else "consumo_bajo"
+            severidad = "critical" if abs(z[i]) > 2 * umbral_z or (bajo[i] and gas.es_critico) else "warning"
+            mensaje = (
+                f"Consumo {'alto' if alto[i] else 'bajo'} de {gas.nombre} en {etiqueta_periodo}: "
+                f"{actual[i]:.2f} {gas.unidad_base}/día frente a una mediana de "
+                f"{mediana[i]:.2f} {gas.unidad_base}/día (z={z[i]:.1f})"
+            )
+        detectadas[(hospital_id, gas_id, tipo)] = {"severidad": severidad, "mensaje": mensaje}
+
+    return detectadas, n_series
+
+
+def _sincronizar_alertas(
+    db: Session,
+    hospital_ids: List[int],
+    periodo: date,
+    detectadas: Dict[tuple, dict]
+) -> dict:
+    """Insertar, actualizar y resolver alertas del periodo en bloque"""
+    existentes = db.query(Alerta).filter(
+        Alerta.hospital_id.in_(hospital_ids),
+        Alerta.periodo == periodo,
+        Alerta.tipo.in_(TIPOS_ALERTA)
+    ).all()
+    por_clave = {(a.hospital_id, a.gas_id, a.tipo): a for a in existentes}
+    ahora = datetime.utcnow()
+
+    nuevas, actualizadas = [], []
+    for (hospital_id, gas_id, tipo), datos in detectadas.items():
+        alerta = por_clave.get((hospital_id, gas_id, tipo))
+        if alerta is None:
+            nuevas.append({
+                "hospital_id": hospital_id,
+                "gas_id": gas_id,
+                "periodo": periodo,
+                "tipo": tipo,
+                "severidad": datos["severidad"],
+                "mensaje": datos["mensaje"],
+                "fecha_deteccion": ahora,
+                "resuelta": False
+            })
+        elif not alerta.resuelta and (
+            alerta.severidad != datos["severidad"] or alerta.mensaje != datos["mensaje"]
+        ):
+            actualizadas.append({
+                "id": alerta.id,
+                "severidad": datos["severidad"],
+                "mensaje": datos["mensaje"],
+                "fecha_deteccion": ahora
+            })
+
+    resueltas = [
+        {
+            "id": a.id,
+            "resuelta": True,
+            "fecha_resolucion": ahora,
+            "notas_resolucion": "Resuelta automáticamente: la condición ya no se cumple"
+        }
+        for clave, a in por_clave.items()
+        if not a.resuelta and clave not in detectadas
+    ]
+
+    if nuevas:
+        db.execute(insert(Alerta), nuevas)
+    if actualizadas:
+        db.execute(update(Alerta), actualizadas)
+    if resueltas:
+        db.execute(update(Alerta), resueltas)
+    if nuevas or actualizadas or resueltas:
+        incrementar_version(db, "alertas")
+
+    return {"nuevas": len(nuevas), "actualizadas": len(actualizadas), "resueltas": len(resueltas)}
+
+
+# Instancia global
+detector_alertas = TareaPeriodica("detector_alertas", detectar_alertas, settings.ALERTAS_INTERVALO)
@@ -0,0 +1,242 @@
+"""
+Servicio de Archivos de Exportación (caché direccionado por contenido)
+Sistema de Gases Medicinales MSPBS
+
+Cada exportación generada se guarda en REPORTS_DIR con un nombre derivado
+de un hash de (tipo de reporte, formato, filtros normalizados, marca de
+datos). La marca de datos es el máximo updated_at (o created_at) y la
+cantidad de los consumos que coinciden con los filtros, más las versiones de
+hospitales y gases, así que un pedido idéntico se sirve desde el disco hasta
+que cambian sus datos. El directorio se poda por tamaño total, descartando
+primero los archivos usados hace más tiempo.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Iterable, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.procesos import obtener_pool
+from app.models.models import Consumo, Hospital, Usuario
+from app.schemas.schemas import FiltroReporte
+from app.services.consultas_service import aplicar_filtros, calcular_resumen_consumos
+from app.services.cierres_service import archivo_cierre, cierre_de_filtros
+from app.services.excel_service import generar_reporte_excel
+from app.services.exportacion_service import generar_csv_streaming
+from app.services.paquetes_service import generar_paquete_hospitales
+from app.services.pdf_service import (
+    consultar_filas_reporte,
+    generar_reporte_pdf,
+    generar_reporte_pdf_rapido,
+    generar_resumen_pdf
+)
+from app.services.versiones_service import obtener_versiones
+
+
+MEDIA_TYPES = {
+    "PDF": "application/pdf",
+    "XLSX": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "CSV": "text/csv",
+    "ZIP": "application/zip",
+    "JSON": "application/json",
+}
+# Variantes del PDF: detalle completo, solo resumen, o resumen con anexo de detalle
+MODOS_PDF = ("detalle", "resumen", "resumen_anexo")
+SUFIJO_TEMPORAL = ".parcial"
+# Segundos desde el último uso durante los que la poda no borra un archivo:
+# cubre a los recién generados o servidos por otros hilos
+GRACIA_PODA = 60
+
+_lock_poda = threading.Lock()
+
+
+def marca_datos(db: Session, filtros: FiltroReporte) -> str:
+    """Marca que cambia cuando cambian los datos de un reporte con estos filtros"""
+    stmt = select(
+        func.max(func.coalesce(Consumo.updated_at, Consumo.created_at)),
+        func.count(Consumo.id)
+    ).select_from(Consumo).join(Hospital, Consumo.hospital_id == Hospital.id)
+    ultima, cantidad = db.execute(aplicar_filtros(stmt, filtros)).one()
+    versiones = obtener_versiones(db, ["hospitales", "gases"])
+    return f"{ultima.isoformat() if ultima else '-'}|{cantidad}|{versiones['hospitales']}|{versiones['gases']}"
+
+
+def clave_exportacion(
+    tipo_reporte: str,
+    formato: str,
+    filtros: FiltroReporte,
+    marca: str,
+    usuario: Optional[Usuario] = None,
+    modo: str = "detalle"
+) -> str:
+    """
+    Hash de una exportación. El tipo de reporte, el modo y el usuario (que
+    figura como autor) solo cambian el contenido de los PDF (también los de
+    los paquetes ZIP).
+    """
+    con_pdf = formato in ("PDF", "ZIP")
+    partes = {
+        "tipo": tipo_reporte if con_pdf else "consumos",
+        "formato": formato,
+        "filtros": filtros.model_dump(mode="json", exclude_none=True),
+        "datos": marca,
+        "usuario": usuario.id if usuario is not None and con_pdf else None,
+    }
+    if formato == "PDF" and modo != "detalle":
+        # Las claves de los PDF de detalle no cambian respecto de antes
+        partes["modo"] = modo
+    return hashlib.sha256(json.dumps(partes, sort_keys=True).encode()).hexdigest()
+
+
+def generar_archivo(
+    db: Session,
+    tipo_reporte: str,
+    formato: str,
+    filtros: FiltroReporte,
+    usuario: Usuario,
+    ruta: str,
+    modo: str = "detalle",
+    progreso: Optional[Callable[[int, int], None]] = None,
+    liberar_sesion: Optional[Callable[[], None]] = None
+):
+    """
+    Escribir en `ruta` el reporte en el formato pedido. Para PDF las filas se
+    leen completas antes de renderizar y, si se pasa `liberar_sesion`, se
+    llama en ese momento para que quien llama devuelva la conexión mientras
+    dura el renderizado. ZIP es el paquete de PDF y XLSX por hospital, que
+    informa su avance a `progreso`.
+    """
+    if formato == "PDF":
+        if modo not in MODOS_PDF:
+            raise ValueError(f"Modo de reporte inválido: {modo}")
+        resumen = calcular_resumen_consumos(db, filtros) if modo != "detalle" else None
+        filas = consultar_filas_reporte(db, filtros) if modo != "resumen" else None
+        autor = f"{usuario.nombre} {usuario.apellido}"
+        if liberar_sesion:
+            liberar_sesion()
+        if resumen is not None:
+            renderizar_en_proceso(generar_resumen_pdf, resumen, tipo_reporte, filtros, autor, ruta, filas)
+        else:
+            renderizar_pdf_en_proceso(filas, tipo_reporte, filtros, autor, ruta)
+    elif formato == "XLSX":
+        generar_reporte_excel(db, filtros, ruta)
+    elif formato == "ZIP":
+        generar_paquete_hospitales(db, filtros, f"{usuario.nombre} {usuario.apellido}", ruta, progreso)
+    elif formato == "CSV":
+        with open(ruta, "wb") as archivo:
+            for bloque in generar_csv_streaming(filtros, db=db):
+                archivo.write(bloque)
+    else:
+        raise ValueError(f"Formato de exportación inválido: {formato}")
+
+
+def renderizar_pdf_en_proceso(filas: list, tipo_reporte: str, filtros: FiltroReporte, autor: str, ruta: str):
+    """
+    Renderizar el PDF en el pool de procesos. Se llama desde hilos de
+    trabajo (no desde el event loop), que esperan el resultado.
+    """
+    # Los reportes grandes se dibujan directo en el canvas
+    renderizador = generar_reporte_pdf_rapido if len(filas) > settings.PDF_FILAS_RAPIDO else generar_reporte_pdf
+    renderizar_en_proceso(renderizador, filas, tipo_reporte, filtros, autor, ruta)
+
+
+def renderizar_en_proceso(renderizador, *args):
+    """Ejecutar un renderizador de PDF en el pool y esperar a que termine"""
+    obtener_pool().submit(renderizador, *args).result()
+
+
+def obtener_o_generar(
+    db: Session,
+    tipo_reporte: str,
+    formato: str,
+    filtros: FiltroReporte,
+    usuario: Usuario,
+    modo: str = "detalle",
+    progreso: Optional[Callable[[int, int], None]] = None,
+    liberar_sesion: Optional[Callable[[], None]] = None
+) -> Tuple[str, bool]:
+    """
+    Ruta del archivo de la exportación, generándolo si no está en caché
+    (`progreso` y `liberar_sesion` se pasan a generar_archivo).
+    Retorna (nombre relativo a REPORTS_DIR, si se reutilizó). Un XLSX o un
+    PDF global de detalle pedido exactamente para un mes cerrado se sirve
+    desde los archivos del cierre (el PDF figura generado por quien cerró).
+    """
+    formato = formato.upper()
+    if formato == "XLSX" or (formato == "PDF" and tipo_reporte == "global" and modo == "detalle"):
+        cierre = cierre_de_filtros(db, filtros)
+        if cierre and os.path.exists(os.path.join(settings.REPORTS_DIR, archivo_cierre(cierre, formato))):
+            return archivo_cierre(cierre, formato), True
+
+    clave = clave_exportacion(tipo_reporte, formato, filtros, marca_datos(db, filtros), usuario, modo)
+    nombre = f"{clave}.{formato.lower()}"
+    ruta = os.path.join(settings.REPORTS_DIR, nombre)
+
+    try:
+        # Marcar como usado recientemente para la poda LRU. Se usa el atime
+        # para no cambiar el mtime, del que dependen ETag e If-Range.
+        os.utime(ruta, (time.time(), os.stat(ruta).st_mtime))
+        return nombre, True
+    except FileNotFoundError:
+        # No está en caché (o la poda lo acaba de borrar): se genera
+        pass
+
+    os.makedirs(settings.REPORTS_DIR, exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=settings.REPORTS_DIR, suffix=SUFIJO_TEMPORAL)
+    os.close(descriptor)
+    try:
+        generar_archivo(db, tipo_reporte, formato, filtros, usuario, temporal, modo, progreso, liberar_sesion)
+        # Atómico: otro proceso con la misma clave solo ve el archivo completo
+        os.replace(temporal, ruta)
+    except Exception:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+    podar_cache(protegidos={ruta})
+    return nombre, False
+
+
+def podar_cache(limite_bytes: Optional[int] = None, protegidos: Iterable[str] = ()) -> int:
+    """
+    Borrar los archivos usados hace más tiempo hasta que REPORTS_DIR quede
+    por debajo del límite. Nunca borra los de `protegidos` ni los usados en
+    los últimos GRACIA_PODA segundos, aunque el total siga sobre el límite
+    (un archivo más grande que el límite se sirve igual). Retorna la
+    cantidad de archivos borrados.
+    """
+    limite = limite_bytes if limite_bytes is not None else settings.EXPORTACION_CACHE_MAX_MB * 1024 * 1024
+    protegidos = {os.path.abspath(ruta) for ruta in protegidos}
+    reciente = time.time() - GRACIA_PODA
+    with _lock_poda:
+        archivos = []
+        try:
+            entradas = list(os.scandir(settings.REPORTS_DIR))
+        except FileNotFoundError:
+            return 0
+        for entrada in entradas:
+            if entrada.is_file() and not entrada.name.endswith(SUFIJO_TEMPORAL):
+                info = entrada.stat()
+                archivos.append((max(info.st_atime, info.st_mtime), info.st_size, entrada.path))
+
+        total = sum(tamano for _, tamano, _ in archivos)
+        borrados = 0
+        for usado, tamano, ruta in sorted(archivos):
+            if total <= limite or usado >= reciente:
+                break
+            if os.path.abspath(ruta) in protegidos:
+                continue
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            total -= tamano
+            borrados += 1
+        return borrados
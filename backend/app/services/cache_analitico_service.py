@@ -0,0 +1,344 @@
+"""
+Caché Analítico en Memoria
+Sistema de Gases Medicinales MSPBS
+
+Instantánea columnar de los consumos (arreglos NumPy de códigos, días y
+cantidades) más tablas de dimensiones de hospitales y gases. Se refresca en
+forma incremental a partir de updated_at/created_at y permite responder
+agrupaciones filtradas sin consultar la base de datos.
+"""
+
+import threading
+import time
+import numpy as np
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.models import Consumo, Gas, Hospital
+from app.services.prorrateo_service import fechas_a_dias
+
+
+DIMENSIONES = (
+    "hospital", "departamento", "region_sanitaria", "nivel_atencion",
+    "tipo", "gas", "modo_suministro", "mes"
+)
+
+# Atributos de hospital que se exponen como dimensión
+ATRIBUTOS_HOSPITAL = ("departamento", "region_sanitaria", "nivel_atencion", "tipo")
+
+# Margen para no perder filas confirmadas por transacciones largas con una
+# marca de tiempo anterior a la última vista; la fusión por id es idempotente
+MARGEN_REFRESCO = timedelta(minutes=5)
+
+
+def _codificar(valores: list, categorias: List[str], indice: Dict[str, int]) -> np.ndarray:
+    """Codificar strings como enteros, agregando categorías nuevas al vuelo"""
+    if not valores:
+        return np.zeros(0, dtype=np.int32)
+    unicos, inversa = np.unique(
+        np.array(["" if v is None else v for v in valores], dtype=object), return_inverse=True
+    )
+    for valor in unicos:
+        if valor not in indice:
+            indice[valor] = len(categorias)
+            categorias.append(valor)
+    mapa = np.array([indice[valor] for valor in unicos], dtype=np.int32)
+    return mapa[inversa.ravel()]
+
+
+class CacheAnalitico:
+    """
+    Instantánea columnar de consumos para agregaciones en memoria
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._datos: Optional[dict] = None
+        self._marca: Optional[datetime] = None
+        self._ultimo_refresco = 0.0
+        self._modos: List[str] = []
+        self._indice_modos: Dict[str, int] = {}
+
+    # ---------- Carga ----------
+
+    def _cargar_dimensiones(self, db: Session) -> dict:
+        hospitales = db.query(
+            Hospital.id, Hospital.nombre, Hospital.departamento,
+            Hospital.region_sanitaria, Hospital.nivel_atencion, Hospital.tipo
+        ).order_by(Hospital.id).all()
+        gases = db.query(Gas.id, Gas.nombre).order_by(Gas.id).all()
+
+        dimensiones = {
+            "hospital_ids": np.array([h.id for h in hospitales], dtype=np.int64),
+            "hospital_nombres": [h.nombre for h in hospitales],
+            "gas_ids": np.array([g.id for g in gases], dtype=np.int64),
+            "gas_nombres": [g.nombre for g in gases],
+        }
+        for atributo in ATRIBUTOS_HOSPITAL:
+            categorias, indice = [], {}
+            dimensiones[f"{atributo}_codigos"] = _codificar(
+                [getattr(h, atributo) for h in hospitales], categorias, indice
+            )
+            dimensiones[f"{atributo}_categorias"] = categorias
+        return dimensiones
+
+    def _leer_filas(self, db: Session, desde_marca: Optional[datetime]) -> dict:
+        marca_fila = func.coalesce(Consumo.updated_at, Consumo.created_at)
+        query = db.query(
+            Consumo.id, Consumo.hospital_id, Consumo.gas_id, Consumo.modo_suministro,
+            Consumo.fecha_inicio, Consumo.fecha_fin, Consumo.cantidad_normalizada, marca_fila
+        )
+        if desde_marca is not None:
+            query = query.filter(marca_fila >= desde_marca - MARGEN_REFRESCO)
+        filas = query.all()
+
+        if not filas:
+            return {"ids": np.zeros(0, dtype=np.int64), "marca": None}
+        ids, hospitales, gases, modos, inicios, fines, cantidades, marcas = zip(*filas)
+        return {
+            "ids": np.array(ids, dtype=np.int64),
+            "hospital_id": np.array(hospitales, dtype=np.int64),
+            "gas_id": np.array(gases, dtype=np.int64),
+            "modo": _codificar(modos, self._modos, self._indice_modos),
+            "inicio": fechas_a_dias(inicios),
+            "fin": fechas_a_dias(fines),
+            "cantidad": np.nan_to_num(np.array(cantidades, dtype=np.float64)),
+            "marca": max(m for m in marcas if m is not None) if any(marcas) else None,
+        }
+
+    @staticmethod
+    def _fusionar(actual: dict, nuevas: dict) -> dict:
+        """Reemplazar filas existentes por id y agregar las nuevas, manteniendo orden por id"""
+        columnas = ("hospital_id", "gas_id", "modo", "inicio", "fin", "cantidad")
+        posicion = np.searchsorted(actual["ids"], nuevas["ids"])
+        existe = (posicion < len(actual["ids"])) & (
+            actual["ids"][np.minimum(posicion, len(actual["ids"]) - 1)] == nuevas["ids"]
+        )
+
+        fusion = {c: actual[c].copy() for c in columnas}
+        for c in columnas:
+            fusion[c][posicion[existe]] = nuevas[c][existe]
+
+        ids = np.concatenate([actual["ids"], nuevas["ids"][~existe]])
+        for c in columnas:
+            fusion[c] = np.concatenate([fusion[c], nuevas[c][~existe]])
+        orden = np.argsort(ids, kind="stable")
+        fusion = {c: v[orden] for c, v in fusion.items()}
+        fusion["ids"] = ids[orden]
+        return fusion
+
+    def refrescar(self, db: Session, completo: bool = False) -> dict:
+        """
+        Refrescar la instantánea. Es incremental salvo la primera vez, si se
+        pide `completo` o si la cantidad o la suma de ids de las filas no
+        coincide con la base (por ejemplo, tras un borrado).
+        """
+        with self._lock:
+            inicio = time.perf_counter()
+            resumen = self._refrescar(db, completo)
+            resumen["segundos"] = round(time.perf_counter() - inicio, 4)
+            return resumen
+
+    def _refrescar(self, db: Session, completo: bool) -> dict:
+        incremental = self._datos is not None and not completo
+        nuevas = self._leer_filas(db, self._marca if incremental else None)
+
+        if incremental:
+            datos = self._fusionar(self._datos, nuevas) if len(nuevas["ids"]) else dict(self._datos)
+            # Firma (cantidad, suma de ids): como los ids nuevos son mayores
+            # que los existentes, un borrado combinado con una inserción
+            # cambia la suma aunque la cantidad coincida
+            cantidad, suma_ids = db.query(
+                func.count(Consumo.id), func.coalesce(func.sum(Consumo.id), 0)
+            ).one()
+            if len(datos["ids"]) != cantidad or int(datos["ids"].sum()) != int(suma_ids):
+                # Hubo borrados: recargar todo
+                return self._refrescar(db, completo=True)
+        elif len(nuevas["ids"]):
+            orden = np.argsort(nuevas["ids"], kind="stable")
+            datos = {c: v[orden] for c, v in nuevas.items() if c != "marca"}
+        else:
+            datos = {
+                "ids": np.zeros(0, dtype=np.int64),
+                "hospital_id": np.zeros(0, dtype=np.int64),
+                "gas_id": np.zeros(0, dtype=np.int64),
+                "modo": np.zeros(0, dtype=np.int32),
+                "inicio": np.zeros(0, dtype=np.int64),
+                "fin": np.zeros(0, dtype=np.int64),
+                "cantidad": np.zeros(0, dtype=np.float64),
+            }
+
+        # Dimensiones completas (tablas chicas) y posición de cada fila en ellas
+        dimensiones = self._cargar_dimensiones(db)
+        datos["hospital_pos"] = np.searchsorted(dimensiones["hospital_ids"], datos["hospital_id"])
+        datos["gas_pos"] = np.searchsorted(dimensiones["gas_ids"], datos["gas_id"])
+        datos["modo_categorias"] = list(self._modos)
+        datos.update(dimensiones)
+
+        if nuevas["marca"] is not None:
+            self._marca = max(self._marca, nuevas["marca"]) if incremental and self._marca else nuevas["marca"]
+        self._datos = datos
+        self._ultimo_refresco = time.monotonic()
+
+        return {
+            "incremental": incremental,
+            "filas_leidas": int(len(nuevas["ids"])),
+            "filas_en_cache": int(len(datos["ids"]))
+        }
+
+    def obtener(self, db: Session) -> dict:
+        """Instantánea vigente, refrescándola si venció el intervalo"""
+        if self._datos is None or time.monotonic() - self._ultimo_refresco > settings.ANALITICA_REFRESCO_SEGUNDOS:
+            self.refrescar(db)
+        return self._datos
+
+    # ---------- Agregación ----------
+
+    def agregar(
+        self,
+        db: Session,
+        agrupar: List[str],
+        desde: Optional[date] = None,
+        hasta: Optional[date] = None,
+        filtros: Optional[Dict[str, object]] = None
+    ) -> List[dict]:
+        """
+        Sumar cantidades agrupando por las dimensiones pedidas.
+
+        La ventana [desde, hasta] selecciona los consumos que se superponen con
+        ella y prorratea su cantidad por días, de modo que solo se suma la parte
+        que cae dentro de la ventana. `filtros` admite hospital_id, gas_id,
+        modo_suministro y los atributos de hospital (igualdad).
+        """
+        invalidas = [d for d in agrupar if d not in DIMENSIONES]
+        if invalidas:
+            raise ValueError(f"Dimensiones inválidas: {', '.join(invalidas)}")
+
+        datos = self.obtener(db)
+        filtros = filtros or {}
+
+        # Códigos por fila de los atributos de hospital
+        codigos_fila = {
+            "hospital": datos["hospital_pos"],
+            "gas": datos["gas_pos"],
+            "modo_suministro": datos["modo"],
+        }
+        for atributo in ATRIBUTOS_HOSPITAL:
+            codigos_fila[atributo] = datos[f"{atributo}_codigos"][datos["hospital_pos"]]
+
+        # Filtros
+        mascara = np.ones(len(datos["ids"]), dtype=bool)
+        if desde is not None:
+            mascara &= datos["fin"] >= fechas_a_dias([desde])[0]
+        if hasta is not None:
+            mascara &= datos["inicio"] <= fechas_a_dias([hasta])[0]
+        if filtros.get("hospital_id") is not None:
+            mascara &= datos["hospital_id"] == filtros["hospital_id"]
+        if filtros.get("gas_id") is not None:
+            mascara &= datos["gas_id"] == filtros["gas_id"]
+        for dimension in ("modo_suministro",) + ATRIBUTOS_HOSPITAL:
+            valor = filtros.get(dimension)
+            if valor is None:
+                continue
+            categorias = datos["modo_categorias"] if dimension == "modo_suministro" else datos[f"{dimension}_categorias"]
+            codigo = categorias.index(valor) if valor in categorias else -1
+            mascara &= codigos_fila[dimension] == codigo
+
+        indices = np.flatnonzero(mascara)
+        inicios, fines = datos["inicio"][indices], datos["fin"][indices]
+        duracion = np.maximum(fines - inicios + 1, 1)
+        desde_dia = fechas_a_dias([desde])[0] if desde is not None else None
+        hasta_dia = fechas_a_dias([hasta])[0] if hasta is not None else None
+        recorte_inicio = np.maximum(inicios, desde_dia) if desde_dia is not None else inicios
+        recorte_fin = np.minimum(fines, hasta_dia) if hasta_dia is not None else fines
+
+        meses = None
+        if "mes" in agrupar:
+            # Partir cada consumo en los meses que cubre
+            mes_inicio = recorte_inicio.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+            mes_fin = recorte_fin.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+            largos = mes_fin - mes_inicio + 1
+            desplazamiento = np.arange(largos.sum()) - np.repeat(np.cumsum(largos) - largos, largos)
+            meses_pieza = np.repeat(mes_inicio, largos) + desplazamiento
+            dia_mes = meses_pieza.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+            dia_mes_siguiente = (meses_pieza + 1).astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+            pieza_inicio = np.maximum(np.repeat(recorte_inicio, largos), dia_mes)
+            pieza_fin = np.minimum(np.repeat(recorte_fin, largos), dia_mes_siguiente - 1)
+            fraccion = (pieza_fin - pieza_inicio + 1) / np.repeat(duracion, largos)
+            indices = np.repeat(indices, largos)
+            meses, codigos_fila["mes"] = np.unique(meses_pieza, return_inverse=True)
+            codigos_fila["mes"] = codigos_fila["mes"].ravel()
+        else:
+            fraccion = (recorte_fin - recorte_inicio + 1) / duracion
+
+        cantidades = datos["cantidad"][indices] * fraccion
+
+        # Clave combinada de las dimensiones
+        tamanos = []
+        codigos = []
+        for dimension in agrupar:
+            if dimension == "mes":
+                codigos.append(codigos_fila["mes"])
+                tamanos.append(len(meses))
+            else:
+                codigos.append(codigos_fila[dimension][indices])
+                tamanos.append(self._cardinalidad(datos, dimension))
+
+        if not agrupar:
+            return [{"total": round(float(cantidades.sum()), 4), "registros": int(len(np.unique(indices)))}]
+        if len(cantidades) == 0:
+            return []
+
+        clave = np.ravel_multi_index(codigos, tamanos)
+        totales = np.bincount(clave, weights=cantidades, minlength=0)
+        registros = np.bincount(clave)
+        presentes = np.flatnonzero(registros)
+        orden = presentes[np.argsort(-totales[presentes], kind="stable")]
+        desempaquetado = np.unravel_index(orden, tamanos)
+
+        filas = []
+        for posicion, clave_fila in enumerate(orden):
+            fila = {}
+            for dimension, codigos_dim in zip(agrupar, desempaquetado):
+                fila.update(self._etiqueta(datos, dimension, int(codigos_dim[posicion]), meses))
+            fila["total"] = round(float(totales[clave_fila]), 4)
+            fila["registros"] = int(registros[clave_fila])
+            filas.append(fila)
+        return filas
+
+    @staticmethod
+    def _cardinalidad(datos: dict, dimension: str) -> int:
+        if dimension == "hospital":
+            return len(datos["hospital_ids"])
+        if dimension == "gas":
+            return len(datos["gas_ids"])
+        if dimension == "modo_suministro":
+            return len(datos["modo_categorias"])
+        return len(datos[f"{dimension}_categorias"])
+
+    @staticmethod
+    def _etiqueta(datos: dict, dimension: str, codigo: int, meses: Optional[np.ndarray]) -> dict:
+        if dimension == "hospital":
+            return {"hospital_id": int(datos["hospital_ids"][codigo]), "hospital": datos["hospital_nombres"][codigo]}
+        if dimension == "gas":
+            return {"gas_id": int(datos["gas_ids"][codigo]), "gas": datos["gas_nombres"][codigo]}
+        if dimension == "mes":
+            return {"mes": str(meses[codigo].astype("datetime64[M]"))}
+        if dimension == "modo_suministro":
+            return {"modo_suministro": datos["modo_categorias"][codigo]}
+        return {dimension: datos[f"{dimension}_categorias"][codigo] or None}
+
+    def estado(self) -> dict:
+        datos = self._datos
+        return {
+            "filas_en_cache": int(len(datos["ids"])) if datos is not None else 0,
+            "marca": self._marca.isoformat() if self._marca else None
+        }
+
+
+# Instancia global
+cache_analitico = CacheAnalitico()
@@ -0,0 +1,208 @@
+"""
+Servicio de Cierre de Periodos
+Sistema de Gases Medicinales MSPBS
+
+Un mes cuyos consumos están todos validados se puede cerrar: se congelan
+los totales por hospital y gas (agregados_cierre) y se generan una sola vez
+el resumen JSON, el PDF global y el XLSX del mes en REPORTS_DIR/cierres.
+Los reportes pedidos exactamente para ese mes se sirven desde esos archivos,
+y los consumos del mes ya no se pueden crear, modificar ni eliminar.
+
+En PostgreSQL el cierre toma un bloqueo asesor exclusivo del mes durante
+toda su transacción y cada escritura de consumos uno compartido: las
+escrituras en curso terminan antes de verificar el mes y las que llegan
+mientras se cierra se rechazan.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.models import AgregadoCierre, CierrePeriodo, Consumo, Hospital, Usuario
+from app.schemas.schemas import FiltroReporte
+from app.services.alertas_service import sumar_meses
+from app.services.consultas_service import aplicar_filtros, calcular_resumen_consumos
+
+
+DIRECTORIO_CIERRES = "cierres"
+# Archivo de cada formato dentro del directorio de un cierre
+ARCHIVOS_CIERRE = {
+    "JSON": "resumen.json",
+    "PDF": "reporte.pdf",
+    "XLSX": "reporte.xlsx",
+}
+
+
+# Primera clave de pg_advisory_xact_lock(int, int) para los periodos; la
+# segunda es el mes como AAAAMM
+_LOCK_PERIODOS = 480480
+
+
+class PeriodoNoCerrable(ValueError):
+    """El mes no cumple las condiciones para cerrarse"""
+
+
+def rango_periodo(periodo: date) -> Tuple[date, date]:
+    """Primer y último día del mes de `periodo`"""
+    inicio = periodo.replace(day=1)
+    return inicio, sumar_meses(inicio, 1) - timedelta(days=1)
+
+
+def filtros_periodo(periodo: date) -> FiltroReporte:
+    """Filtros de los consumos de un mes (los que empiezan y terminan en él)"""
+    inicio, fin = rango_periodo(periodo)
+    return FiltroReporte(fecha_inicio=inicio, fecha_fin=fin)
+
+
+def cierre_de_filtros(db: Session, filtros: FiltroReporte) -> Optional[CierrePeriodo]:
+    """
+    Cierre cuyos archivos corresponden a estos filtros: solo aplica cuando
+    los filtros son exactamente un mes cerrado, sin otras restricciones
+    """
+    if not filtros.fecha_inicio or filtros_periodo(filtros.fecha_inicio) != filtros:
+        return None
+    return db.query(CierrePeriodo).filter(CierrePeriodo.periodo == filtros.fecha_inicio).first()
+
+
+def archivo_cierre(cierre: CierrePeriodo, formato: str) -> str:
+    """Nombre relativo a REPORTS_DIR del archivo de un cierre"""
+    return os.path.join(cierre.directorio, ARCHIVOS_CIERRE[formato])
+
+
+def periodo_de_consumo(fecha_inicio: date, fecha_fin: date) -> Optional[date]:
+    """
+    Primer día del mes en que entra un consumo con estas fechas, o None si
+    abarca más de un mes (no entra en ningún cierre)
+    """
+    inicio, fin = rango_periodo(fecha_inicio)
+    return inicio if fecha_fin <= fin else None
+
+
+def periodo_cerrado(db: Session, fecha_inicio: date, fecha_fin: date) -> Optional[CierrePeriodo]:
+    """Cierre que incluye a un consumo con estas fechas, si lo hay"""
+    inicio = periodo_de_consumo(fecha_inicio, fecha_fin)
+    if inicio is None:
+        return None
+    return db.query(CierrePeriodo).filter(CierrePeriodo.periodo == inicio).first()
+
+
+def bloquear_periodo(db: Session, periodo: date, exclusivo: bool = False) -> bool:
+    """
+    Tomar el bloqueo asesor del mes de `periodo` hasta el fin de la
+    transacción. El exclusivo (cierre) espera a las escrituras en curso; el
+    compartido (escrituras) no espera y retorna False si el mes se está
+    cerrando. Fuera de PostgreSQL no bloquea.
+    """
+    if db.bind.dialect.name != "postgresql":
+        return True
+    parametros = {"n": _LOCK_PERIODOS, "k": periodo.year * 100 + periodo.month}
+    if exclusivo:
+        db.execute(text("SELECT pg_advisory_xact_lock(:n, :k)"), parametros)
+        return True
+    return db.execute(text("SELECT pg_try_advisory_xact_lock_shared(:n, :k)"), parametros).scalar()
+
+
+def verificar_periodo_cerrable(db: Session, periodo: date) -> int:
+    """
+    Verificar que el mes terminó, tiene consumos y están todos validados.
+    Retorna la cantidad de consumos; lanza PeriodoNoCerrable si no.
+    """
+    inicio, fin = rango_periodo(periodo)
+    if fin >= date.today():
+        raise PeriodoNoCerrable("Solo se pueden cerrar meses terminados")
+
+    stmt = select(
+        func.count(Consumo.id),
+        func.count(Consumo.id).filter(Consumo.validado.isnot(True))
+    ).select_from(Consumo).join(Hospital, Consumo.hospital_id == Hospital.id)
+    registros, sin_validar = db.execute(aplicar_filtros(stmt, filtros_periodo(periodo))).one()
+    if not registros:
+        raise PeriodoNoCerrable("El periodo no tiene consumos registrados")
+    if sin_validar:
+        raise PeriodoNoCerrable(f"El periodo tiene {sin_validar} consumos sin validar")
+    return registros
+
+
+def cerrar_periodo(db: Session, periodo: date, usuario: Usuario) -> CierrePeriodo:
+    """
+    Cerrar un mes: agregados por hospital y gas más resumen JSON, PDF global
+    y XLSX en REPORTS_DIR/cierres/AAAA-MM. Todo se calcula en la misma
+    transacción que registra el cierre, con el mes bloqueado para las
+    escrituras. Hace commit.
+    """
+    # Import diferido: archivos_exportacion_service consulta los cierres
+    from app.services.archivos_exportacion_service import generar_archivo
+
+    inicio, _ = rango_periodo(periodo)
+    bloquear_periodo(db, inicio, exclusivo=True)
+    if db.query(CierrePeriodo).filter(CierrePeriodo.periodo == inicio).first():
+        raise PeriodoNoCerrable("El periodo ya está cerrado")
+    registros = verificar_periodo_cerrable(db, inicio)
+    filtros = filtros_periodo(inicio)
+
+    stmt = select(
+        Consumo.hospital_id,
+        Consumo.gas_id,
+        func.count(Consumo.id),
+        func.sum(Consumo.cantidad_normalizada)
+    ).select_from(Consumo).join(Hospital, Consumo.hospital_id == Hospital.id)
+    agregados = db.execute(
+        aplicar_filtros(stmt, filtros).group_by(Consumo.hospital_id, Consumo.gas_id)
+    ).all()
+    resumen = calcular_resumen_consumos(db, filtros)
+
+    # Los archivos se escriben en un directorio temporal y se publican juntos
+    relativo = os.path.join(DIRECTORIO_CIERRES, inicio.strftime("%Y-%m"))
+    destino = os.path.join(settings.REPORTS_DIR, relativo)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    temporal = tempfile.mkdtemp(dir=os.path.dirname(destino), prefix=f".{inicio:%Y-%m}-")
+    try:
+        with open(os.path.join(temporal, ARCHIVOS_CIERRE["JSON"]), "w", encoding="utf-8") as archivo:
+            json.dump({"periodo": inicio.isoformat(), **resumen}, archivo, ensure_ascii=False)
+        generar_archivo(db, "consumos", "XLSX", filtros, usuario, os.path.join(temporal, ARCHIVOS_CIERRE["XLSX"]))
+        generar_archivo(db, "global", "PDF", filtros, usuario, os.path.join(temporal, ARCHIVOS_CIERRE["PDF"]))
+    except Exception:
+        shutil.rmtree(temporal, ignore_errors=True)
+        raise
+    try:
+        # Falla si otro proceso publicó el mismo cierre mientras tanto
+        os.rename(temporal, destino)
+    except OSError:
+        shutil.rmtree(temporal, ignore_errors=True)
+        raise PeriodoNoCerrable("Ya existen archivos de cierre del periodo (¿cierre en curso en otro proceso?)")
+
+    cierre = CierrePeriodo(
+        periodo=inicio,
+        usuario_id=usuario.id,
+        registros=registros,
+        hospitales=len({hospital_id for hospital_id, _, _, _ in agregados}),
+        directorio=relativo,
+        agregados=[
+            AgregadoCierre(hospital_id=hospital_id, gas_id=gas_id, registros=cantidad_registros, cantidad=cantidad or 0)
+            for hospital_id, gas_id, cantidad_registros, cantidad in agregados
+        ]
+    )
+    db.add(cierre)
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+        shutil.rmtree(destino, ignore_errors=True)
+        raise
+    db.refresh(cierre)
+    return cierre
+
+
+def reabrir_periodo(db: Session, cierre: CierrePeriodo):
+    """Eliminar un cierre y sus archivos (hace commit)"""
+    destino = os.path.join(settings.REPORTS_DIR, cierre.directorio)
+    db.delete(cierre)
+    db.commit()
+    shutil.rmtree(destino, ignore_errors=True)
@@ -0,0 +1,191 @@
+"""
+Servicio de Cola de Exportaciones
+Sistema de Gases Medicinales MSPBS
+
+Las exportaciones pesadas se encolan en la tabla trabajos_exportacion y las
+procesan workers (el worker interno de la API o los procesos de
+scripts/worker_exportaciones.py). Cada worker reclama un trabajo pendiente
+con SELECT ... FOR UPDATE SKIP LOCKED, de modo que varios procesos pueden
+consumir la cola sin bloquearse ni tomar el mismo trabajo. El archivo se
+obtiene del caché de exportaciones de REPORTS_DIR (o se genera allí) y cada
+trabajo completado queda registrado en HistorialExportacion.
+"""
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.models import HistorialExportacion, TrabajoExportacion, Usuario
+from app.schemas.schemas import FiltroReporte
+from app.services.archivos_exportacion_service import obtener_o_generar
+from app.services.tareas_service import TareaPeriodica
+
+
+def ruta_trabajo(trabajo: TrabajoExportacion) -> str:
+    """Ruta absoluta del archivo de un trabajo dentro de REPORTS_DIR"""
+    return os.path.join(settings.REPORTS_DIR, trabajo.archivo)
+
+
+def encolar_trabajo(
+    db: Session,
+    usuario: Usuario,
+    tipo_reporte: str,
+    formato: str,
+    filtros: FiltroReporte,
+    modo: str = "detalle"
+) -> TrabajoExportacion:
+    """Registrar un trabajo pendiente (sin commit)"""
+    trabajo = TrabajoExportacion(
+        usuario_id=usuario.id,
+        tipo_reporte=tipo_reporte,
+        formato=formato.upper(),
+        modo=modo,
+        parametros=filtros.model_dump_json(exclude_none=True),
+        estado="pendiente"
+    )
+    db.add(trabajo)
+    db.flush()
+    return trabajo
+
+
+def reclamar_trabajo(db: Session) -> Optional[TrabajoExportacion]:
+    """
+    Tomar el trabajo pendiente más antiguo y marcarlo como procesando.
+    SKIP LOCKED salta las filas que otro worker ya bloqueó.
+    """
+    trabajo = db.query(TrabajoExportacion).filter(
+        TrabajoExportacion.estado == "pendiente"
+    ).order_by(TrabajoExportacion.id).with_for_update(skip_locked=True).first()
+
+    if not trabajo:
+        db.rollback()
+        return None
+
+    trabajo.estado = "procesando"
+    trabajo.intentos += 1
+    trabajo.iniciado_at = func.now()
+    trabajo.progreso = 0
+    trabajo.progreso_total = None
+    trabajo.progreso_at = None
+    db.commit()
+    return trabajo
+
+
+def reencolar_vencidos(db: Session) -> int:
+    """
+    Devolver a la cola los trabajos cuyo worker murió a mitad de proceso
+    (procesando por más de EXPORTACION_TIMEOUT), o marcarlos con error si
+    agotaron los intentos
+    """
+    limite = datetime.now(timezone.utc) - timedelta(seconds=settings.EXPORTACION_TIMEOUT)
+    # Los trabajos que informan avance (paquetes) se consideran vivos
+    # mientras sigan avanzando
+    vencidos = db.query(TrabajoExportacion).filter(
+        TrabajoExportacion.estado == "procesando",
+        func.coalesce(TrabajoExportacion.progreso_at, TrabajoExportacion.iniciado_at) < limite
+    ).with_for_update(skip_locked=True).all()
+
+    for trabajo in vencidos:
+        if trabajo.intentos >= settings.EXPORTACION_MAX_INTENTOS:
+            trabajo.estado = "error"
+            trabajo.error = "Tiempo de procesamiento agotado"
+            trabajo.finalizado_at = func.now()
+        else:
+            trabajo.estado = "pendiente"
+    db.commit()
+    return len(vencidos)
+
+
+def registrar_progreso(trabajo_id: int):
+    """
+    Función de avance para un trabajo. Usa su propia sesión porque la del
+    worker tiene abierto el cursor de la consulta del reporte.
+    """
+    def progreso(hechos: int, total: int):
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(TrabajoExportacion).where(TrabajoExportacion.id == trabajo_id).values(
+                    progreso=hechos, progreso_total=total, progreso_at=func.now()
+                )
+            )
+            db.commit()
+        finally:
+            db.close()
+    return progreso
+
+
+def procesar_trabajo(db: Session, trabajo: TrabajoExportacion) -> TrabajoExportacion:
+    """
+    Generar el archivo de un trabajo reclamado y registrar el resultado.
+    Los errores quedan en el trabajo en lugar de propagarse.
+    """
+    trabajo_id = trabajo.id
+    try:
+        filtros = FiltroReporte(**json.loads(trabajo.parametros or "{}"))
+        usuario = db.query(Usuario).filter(Usuario.id == trabajo.usuario_id).first()
+        nombre, _ = obtener_o_generar(
+            db, trabajo.tipo_reporte, trabajo.formato, filtros, usuario, trabajo.modo,
+            registrar_progreso(trabajo_id)
+        )
+        # El avance se registra desde otra sesión: se relee el trabajo
+        trabajo = db.get(TrabajoExportacion, trabajo_id, populate_existing=True)
+    except Exception as e:
+        db.rollback()
+        trabajo = db.get(TrabajoExportacion, trabajo_id)
+        trabajo.estado = "error"
+        trabajo.error = str(e)[:1000]
+        trabajo.finalizado_at = func.now()
+        db.commit()
+        return trabajo
+
+    historial = HistorialExportacion(
+        usuario_id=trabajo.usuario_id,
+        tipo_reporte=trabajo.tipo_reporte,
+        formato=trabajo.formato,
+        parametros=trabajo.parametros,
+        archivo_generado=nombre
+    )
+    db.add(historial)
+    db.flush()
+
+    trabajo.estado = "completado"
+    trabajo.archivo = nombre
+    trabajo.tamano = os.path.getsize(ruta_trabajo(trabajo))
+    trabajo.error = None
+    if trabajo.progreso_total is not None:
+        trabajo.progreso = trabajo.progreso_total
+    trabajo.historial_id = historial.id
+    trabajo.finalizado_at = func.now()
+    db.commit()
+    return trabajo
+
+
+def procesar_pendientes(db: Session, maximo: Optional[int] = None) -> int:
+    """
+    Procesar trabajos de la cola hasta vaciarla (o hasta `maximo`).
+    Retorna la cantidad de trabajos procesados.
+    """
+    reencolar_vencidos(db)
+    procesados = 0
+    while maximo is None or procesados < maximo:
+        trabajo = reclamar_trabajo(db)
+        if not trabajo:
+            break
+        procesar_trabajo(db, trabajo)
+        procesados += 1
+    return procesados
+
+
+# Worker interno de la API
+worker_exportaciones = TareaPeriodica(
+    "exportaciones",
+    procesar_pendientes,
+    settings.EXPORTACION_SONDEO
+)
@@ -0,0 +1,98 @@
+"""
+Servicio de Exportación Columnar (Parquet / Arrow IPC)
+Sistema de Gases Medicinales MSPBS
+
+Lee el detalle de consumos con un cursor del lado del servidor y escribe cada
+lote como un RecordBatch tipado y comprimido, de modo que la memoria usada
+depende del tamaño de lote y no de la cantidad total de filas.
+"""
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy.orm import Session
+
+from app.schemas.schemas import FiltroReporte
+from app.services.consultas_service import select_consumos_detalle
+
+
+FORMATOS_COLUMNARES = {
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "arrow": ("arrow", "application/vnd.apache.arrow.file"),
+}
+
+ESQUEMA_CONSUMOS = pa.schema([
+    ("id", pa.int64()),
+    ("hospital_id", pa.int32()),
+    ("hospital_codigo", pa.string()),
+    ("hospital_nombre", pa.string()),
+    ("hospital_tipo", pa.string()),
+    ("departamento", pa.string()),
+    ("ciudad", pa.string()),
+    ("region_sanitaria", pa.string()),
+    ("nivel_atencion", pa.string()),
+    ("gas_id", pa.int32()),
+    ("gas_codigo", pa.string()),
+    ("gas_nombre", pa.string()),
+    ("unidad_base", pa.string()),
+    ("fecha_inicio", pa.date32()),
+    ("fecha_fin", pa.date32()),
+    ("modo_suministro", pa.string()),
+    ("cantidad", pa.float64()),
+    ("cantidad_normalizada", pa.float64()),
+    ("unidad_medida", pa.string()),
+    ("observaciones", pa.string()),
+    ("validado", pa.bool_()),
+    ("created_at", pa.timestamp("us", tz="UTC")),
+    ("updated_at", pa.timestamp("us", tz="UTC")),
+])
+
+TAMANO_LOTE = 50_000
+
+
+def _lote_a_batch(filas: list) -> pa.RecordBatch:
+    """Convertir una lista de tuplas a un RecordBatch con el esquema fijo"""
+    columnas = list(zip(*filas))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(valores, type=campo.type) for valores, campo in zip(columnas, ESQUEMA_CONSUMOS)],
+        schema=ESQUEMA_CONSUMOS
+    )
+
+
+def exportar_consumos_columnar(
+    db: Session,
+    filtros: FiltroReporte,
+    ruta: str,
+    formato: str = "parquet",
+    tamano_lote: int = TAMANO_LOTE
+) -> int:
+    """
+    Escribir los consumos filtrados en `ruta` como Parquet o Arrow IPC (zstd).
+    Retorna la cantidad de filas exportadas.
+    """
+    if formato not in FORMATOS_COLUMNARES:
+        raise ValueError(f"Formato columnar inválido: {formato}")
+
+    stmt = select_consumos_detalle(filtros).execution_options(yield_per=tamano_lote)
+
+    if formato == "parquet":
+        escritor = pq.ParquetWriter(ruta, ESQUEMA_CONSUMOS, compression="zstd")
+    else:
+        escritor = pa.ipc.new_file(
+            ruta, ESQUEMA_CONSUMOS, options=pa.ipc.IpcWriteOptions(compression="zstd")
+        )
+
+    total = 0
+    try:
+        resultado = db.execute(stmt)
+        for lote in resultado.partitions():
+            batch = _lote_a_batch(lote)
+            if formato == "parquet":
+                escritor.write_batch(batch)
+            else:
+                escritor.write(batch)
+            total += batch.num_rows
+        resultado.close()
+    finally:
+        escritor.close()
+
+    return total
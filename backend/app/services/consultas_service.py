@@ -0,0 +1,258 @@
+"""
+Consultas Compartidas de Consumos
+Sistema de Gases Medicinales MSPBS
+
+Selects de SQLAlchemy Core para el detalle de consumos unido con hospital y
+gas, usados por las exportaciones y los listados. Al trabajar con tuplas en
+lugar de objetos ORM se evita hidratar relaciones fila por fila.
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import func, literal_column, select, tuple_
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from app.models.models import Consumo, Gas, Hospital
+from app.schemas.schemas import ConsumoResponse, FiltroReporte, GasResponse, HospitalResponse
+
+
+# (nombre de columna exportada, expresión) en el orden de exportación
+COLUMNAS_DETALLE = [
+    ("id", Consumo.id),
+    ("hospital_id", Consumo.hospital_id),
+    ("hospital_codigo", Hospital.codigo),
+    ("hospital_nombre", Hospital.nombre),
+    ("hospital_tipo", Hospital.tipo),
+    ("departamento", Hospital.departamento),
+    ("ciudad", Hospital.ciudad),
+    ("region_sanitaria", Hospital.region_sanitaria),
+    ("nivel_atencion", Hospital.nivel_atencion),
+    ("gas_id", Consumo.gas_id),
+    ("gas_codigo", Gas.codigo),
+    ("gas_nombre", Gas.nombre),
+    ("unidad_base", Gas.unidad_base),
+    ("fecha_inicio", Consumo.fecha_inicio),
+    ("fecha_fin", Consumo.fecha_fin),
+    ("modo_suministro", Consumo.modo_suministro),
+    ("cantidad", Consumo.cantidad),
+    ("cantidad_normalizada", Consumo.cantidad_normalizada),
+    ("unidad_medida", Consumo.unidad_medida),
+    ("observaciones", Consumo.observaciones),
+    ("validado", Consumo.validado),
+    ("created_at", Consumo.created_at),
+    ("updated_at", Consumo.updated_at),
+]
+
+
+def aplicar_filtros(stmt: Select, filtros: FiltroReporte) -> Select:
+    """
+    Aplicar un FiltroReporte a un select que ya incluye Consumo y Hospital
+    """
+    if filtros.hospital_id:
+        stmt = stmt.where(Consumo.hospital_id == filtros.hospital_id)
+    if filtros.gas_id:
+        stmt = stmt.where(Consumo.gas_id == filtros.gas_id)
+    if filtros.fecha_inicio:
+        stmt = stmt.where(Consumo.fecha_inicio >= filtros.fecha_inicio)
+    if filtros.fecha_fin:
+        stmt = stmt.where(Consumo.fecha_fin <= filtros.fecha_fin)
+    if filtros.modo_suministro:
+        stmt = stmt.where(Consumo.modo_suministro == filtros.modo_suministro)
+    if filtros.departamento:
+        stmt = stmt.where(Hospital.departamento == filtros.departamento)
+    return stmt
+
+
+def select_consumos_detalle(filtros: FiltroReporte, columnas=None) -> Select:
+    """
+    Select de consumos unidos con hospital y gas, filtrado y ordenado por id.
+    `columnas` permite restringir la lista (por defecto COLUMNAS_DETALLE).
+    """
+    columnas = columnas or COLUMNAS_DETALLE
+    stmt = select(*[expresion.label(nombre) for nombre, expresion in columnas]).select_from(
+        Consumo
+    ).join(Hospital, Consumo.hospital_id == Hospital.id).join(Gas, Consumo.gas_id == Gas.id)
+    return aplicar_filtros(stmt, filtros).order_by(Consumo.id)
+
+
+# Campos de ConsumoResponse y de sus objetos anidados, en el orden del select
+CAMPOS_CONSUMO = [c for c in ConsumoResponse.model_fields if c not in ("hospital", "gas")]
+CAMPOS_ANIDADOS = {
+    "hospital": (Hospital, list(HospitalResponse.model_fields)),
+    "gas": (Gas, list(GasResponse.model_fields)),
+}
+
+
+def resolver_campos(fields: Optional[str] = None, embed: Optional[str] = None) -> Dict[str, List[str]]:
+    """
+    Traducir los parámetros `fields` y `embed` a los campos a seleccionar.
+
+    `fields` es una lista separada por comas de campos de consumo y de campos
+    anidados con punto (p. ej. `id,cantidad,hospital.codigo`); sin `fields`
+    se devuelven todos los campos del consumo. `embed` lista los objetos
+    anidados completos a incluir (`hospital`, `gas`). Sin `fields` ni `embed`
+    se incluyen ambos; con `fields` solo se incluyen los que `embed` nombra,
+    y `embed=` no incluye ninguno. Lanza ValueError con los nombres inválidos.
+    """
+    campos: Dict[str, List[str]] = {"consumo": []}
+    invalidos = []
+
+    pedidos = [f.strip() for f in fields.split(",") if f.strip()] if fields else []
+    for pedido in pedidos:
+        anidado, _, campo = pedido.rpartition(".")
+        if not anidado:
+            if campo in CAMPOS_CONSUMO:
+                campos["consumo"].append(campo)
+            else:
+                invalidos.append(pedido)
+        elif anidado in CAMPOS_ANIDADOS and campo in CAMPOS_ANIDADOS[anidado][1]:
+            campos.setdefault(anidado, []).append(campo)
+        else:
+            invalidos.append(pedido)
+    if not pedidos:
+        campos["consumo"] = list(CAMPOS_CONSUMO)
+
+    if embed is None:
+        embebidos = [] if pedidos else list(CAMPOS_ANIDADOS)
+    else:
+        embebidos = [e.strip() for e in embed.split(",") if e.strip()]
+    for nombre in embebidos:
+        if nombre in CAMPOS_ANIDADOS:
+            campos[nombre] = list(CAMPOS_ANIDADOS[nombre][1])
+        else:
+            invalidos.append(nombre)
+
+    if invalidos:
+        raise ValueError(f"Campos inválidos: {', '.join(invalidos)}")
+
+    # Quitar repetidos conservando el orden
+    return {nombre: list(dict.fromkeys(lista)) for nombre, lista in campos.items()}
+
+
+def select_consumos_respuesta(campos: Optional[Dict[str, List[str]]] = None) -> Select:
+    """
+    Select con los campos pedidos de ConsumoResponse (por defecto todos, con
+    hospital y gas anidados). Solo se unen las tablas de los objetos
+    anidados que se piden.
+    """
+    campos = campos or resolver_campos()
+    columnas = [getattr(Consumo, c) for c in campos["consumo"]]
+    for nombre, (modelo, _) in CAMPOS_ANIDADOS.items():
+        columnas += [getattr(modelo, c) for c in campos.get(nombre, [])]
+
+    stmt = select(*columnas).select_from(Consumo)
+    if campos.get("hospital"):
+        stmt = stmt.join(Hospital, Consumo.hospital_id == Hospital.id)
+    if campos.get("gas"):
+        stmt = stmt.join(Gas, Consumo.gas_id == Gas.id)
+    return stmt
+
+
+def serializar_consumos(filas: Sequence[tuple], campos: Optional[Dict[str, List[str]]] = None) -> List[dict]:
+    """
+    Convertir tuplas de `select_consumos_respuesta` a dicts con la forma de
+    ConsumoResponse, sin pasar por objetos ORM ni por validación Pydantic
+    """
+    campos = campos or resolver_campos()
+    # (clave anidada o None, nombres, inicio, fin) de cada tramo de la tupla
+    tramos = []
+    inicio = 0
+    for nombre in ["consumo"] + [n for n in CAMPOS_ANIDADOS if campos.get(n)]:
+        nombres = campos[nombre]
+        tramos.append((None if nombre == "consumo" else nombre, nombres, inicio, inicio + len(nombres)))
+        inicio += len(nombres)
+
+    resultado = []
+    for fila in filas:
+        consumo = {}
+        for clave, nombres, desde, hasta in tramos:
+            valores = dict(zip(nombres, fila[desde:hasta]))
+            if clave is None:
+                consumo.update(valores)
+            else:
+                consumo[clave] = valores
+        resultado.append(consumo)
+    return resultado
+
+
+def select_resumen_consumos(filtros: FiltroReporte) -> Select:
+    """
+    Totales de consumo por gas, hospital y modo de suministro en una sola
+    consulta GROUPING SETS: (gas), (hospital, gas), (hospital), (modo, gas),
+    (modo) y (). Las cantidades se suman por gas porque cada gas tiene su
+    propia unidad base.
+    """
+    hospital, gas, modo = Consumo.hospital_id, Consumo.gas_id, Consumo.modo_suministro
+    conjuntos = [(gas,), (hospital, gas), (hospital,), (modo, gas), (modo,)]
+    stmt = select(
+        hospital, gas, modo,
+        func.grouping(hospital).label("g_hospital"),
+        func.grouping(gas).label("g_gas"),
+        func.grouping(modo).label("g_modo"),
+        func.sum(Consumo.cantidad_normalizada).label("cantidad"),
+        func.count().label("registros")
+    ).select_from(Consumo).join(Hospital, Consumo.hospital_id == Hospital.id)
+    return aplicar_filtros(stmt, filtros).group_by(
+        func.grouping_sets(*[tuple_(*c) for c in conjuntos], literal_column("()"))
+    )
+
+
+def armar_resumen(filas: Sequence, gases: Dict[int, tuple], hospitales: Dict[int, tuple]) -> dict:
+    """
+    Resumen a partir de las filas de select_resumen_consumos. `gases` mapea
+    id -> (nombre, unidad_base) y `hospitales` id -> (codigo, nombre).
+    """
+    resumen = {"total_registros": 0, "gases": [], "hospitales": [], "modos": []}
+    por_gas: Dict[int, dict] = {}
+    por_hospital: Dict[int, dict] = {}
+    por_modo: Dict[str, dict] = {}
+
+    for hospital_id, gas_id, modo, g_hospital, g_gas, g_modo, cantidad, registros in filas:
+        cantidad = round(float(cantidad or 0), 4)
+        if g_hospital and g_gas and g_modo:
+            resumen["total_registros"] = registros
+        elif not g_hospital:
+            fila = por_hospital.setdefault(hospital_id, {"registros": 0, "por_gas": {}})
+            if g_gas:
+                fila["registros"] = registros
+            else:
+                fila["por_gas"][gas_id] = cantidad
+        elif not g_modo:
+            fila = por_modo.setdefault(modo, {"registros": 0, "por_gas": {}})
+            if g_gas:
+                fila["registros"] = registros
+            else:
+                fila["por_gas"][gas_id] = cantidad
+        else:
+            por_gas[gas_id] = {"cantidad": cantidad, "registros": registros}
+
+    for gas_id, valores in sorted(por_gas.items(), key=lambda g: gases.get(g[0], ("",))[0]):
+        nombre, unidad = gases.get(gas_id, (str(gas_id), ""))
+        resumen["gases"].append({"gas_id": gas_id, "nombre": nombre, "unidad": unidad, **valores})
+    for hospital_id, valores in sorted(por_hospital.items(), key=lambda h: hospitales.get(h[0], ("",))[0]):
+        codigo, nombre = hospitales.get(hospital_id, (str(hospital_id), ""))
+        resumen["hospitales"].append({"hospital_id": hospital_id, "codigo": codigo, "nombre": nombre, **valores})
+    for modo, valores in sorted(por_modo.items()):
+        resumen["modos"].append({"modo_suministro": modo, **valores})
+    return resumen
+
+
+def calcular_resumen_consumos(db: Session, filtros: FiltroReporte) -> dict:
+    """
+    Resumen de los consumos filtrados: total de registros, totales por gas y
+    tablas hospital × gas y modo de suministro × gas (cantidades en la
+    unidad base de cada gas). Solo contiene tipos simples.
+    """
+    filas = db.execute(select_resumen_consumos(filtros)).all()
+    gas_ids = {f[1] for f in filas if f[1] is not None}
+    hospital_ids = {f[0] for f in filas if f[0] is not None}
+    gases = {
+        g.id: (g.nombre, g.unidad_base)
+        for g in db.execute(select(Gas.id, Gas.nombre, Gas.unidad_base).where(Gas.id.in_(gas_ids)))
+    }
+    hospitales = {
+        h.id: (h.codigo, h.nombre)
+        for h in db.execute(select(Hospital.id, Hospital.codigo, Hospital.nombre).where(Hospital.id.in_(hospital_ids)))
+    }
+    return armar_resumen(filas, gases, hospitales)
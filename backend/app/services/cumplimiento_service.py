@@ -0,0 +1,213 @@
+"""
+Servicio de Cumplimiento de Registro
+Sistema de Gases Medicinales MSPBS
+
+Mantiene el índice `cumplimiento_registro`: por hospital, gas y año, un
+bitset de 12 bits con los meses cubiertos por al menos un consumo. El índice
+se actualiza en cada escritura de consumos y permite responder qué hospitales
+no reportaron qué meses sin recorrer la tabla de consumos.
+"""
+
+import numpy as np
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.models.models import Consumo, CumplimientoRegistro, Hospital
+
+
+MESES_ANIO = 12
+
+
+def _indice_mes(fecha: date) -> int:
+    return fecha.year * MESES_ANIO + fecha.month - 1
+
+
+def meses_cubiertos(inicio: date, fin: date) -> Dict[int, int]:
+    """Bitsets por año de los meses que toca el intervalo [inicio, fin]"""
+    mascaras = defaultdict(int)
+    for indice in range(_indice_mes(inicio), _indice_mes(fin) + 1):
+        mascaras[indice // MESES_ANIO] |= 1 << (indice % MESES_ANIO)
+    return dict(mascaras)
+
+
+def actualizar_cumplimiento(
+    db: Session,
+    intervalos: Iterable[Tuple[int, int, date, date]]
+):
+    """
+    Recalcular el índice para los (hospital_id, gas_id, fecha_inicio, fecha_fin)
+    afectados por una escritura. Se recalcula desde los consumos (no con OR
+    incremental) para que ediciones y borrados también queden reflejados.
+    Debe llamarse después de `db.flush()` y antes del commit.
+
+    En PostgreSQL cada serie (hospital, gas) se bloquea hasta el commit antes
+    de recalcularla: dos escrituras concurrentes de la misma serie se
+    serializan y la segunda ve los consumos de la primera en lugar de pisar
+    su máscara.
+    """
+    anios_por_serie = defaultdict(set)
+    for hospital_id, gas_id, inicio, fin in intervalos:
+        anios_por_serie[(hospital_id, gas_id)].update(range(inicio.year, fin.year + 1))
+
+    bloquear = db.bind.dialect.name == "postgresql"
+    valores = []
+    # Orden fijo de bloqueo para que dos lotes no se bloqueen mutuamente
+    for (hospital_id, gas_id), anios in sorted(anios_por_serie.items()):
+        if bloquear:
+            db.execute(
+                text("SELECT pg_advisory_xact_lock(:hospital_id, :gas_id)"),
+                {"hospital_id": hospital_id, "gas_id": gas_id}
+            )
+        desde = date(min(anios), 1, 1)
+        hasta = date(max(anios), 12, 31)
+        filas = db.query(Consumo.fecha_inicio, Consumo.fecha_fin).filter(
+            Consumo.hospital_id == hospital_id,
+            Consumo.gas_id == gas_id,
+            Consumo.fecha_inicio <= hasta,
+            Consumo.fecha_fin >= desde
+        ).all()
+
+        mascaras = {anio: 0 for anio in anios}
+        for inicio, fin in filas:
+            for anio, mascara in meses_cubiertos(inicio, fin).items():
+                if anio in mascaras:
+                    mascaras[anio] |= mascara
+
+        valores.extend(
+            {"hospital_id": hospital_id, "gas_id": gas_id, "anio": anio, "meses": mascara}
+            for anio, mascara in mascaras.items()
+        )
+
+    _guardar_mascaras(db, valores)
+
+
+def _guardar_mascaras(db: Session, valores: List[dict]):
+    """Upsert de bitsets por (hospital_id, gas_id, anio)"""
+    if not valores:
+        return
+    stmt = pg_insert(CumplimientoRegistro).values(valores)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["hospital_id", "gas_id", "anio"],
+        set_={"meses": stmt.excluded.meses, "updated_at": func.now()}
+    )
+    db.execute(stmt)
+
+
+def reconstruir_cumplimiento(db: Session) -> int:
+    """
+    Reconstruir el índice completo desde la tabla de consumos.
+    Retorna la cantidad de filas (hospital, gas, año) escritas.
+    """
+    filas = db.query(
+        Consumo.hospital_id, Consumo.gas_id, Consumo.fecha_inicio, Consumo.fecha_fin
+    ).all()
+    db.query(CumplimientoRegistro).delete()
+    if not filas:
+        db.commit()
+        return 0
+
+    hospitales, gases, inicios, fines = (np.array(c) for c in zip(*filas))
+    mes_inicio = np.array([_indice_mes(f) for f in inicios], dtype=np.int64)
+    mes_fin = np.array([_indice_mes(f) for f in fines], dtype=np.int64)
+
+    # Expandir cada consumo a los meses que cubre
+    largos = np.maximum(mes_fin - mes_inicio + 1, 1)
+    desplazamiento = np.arange(largos.sum()) - np.repeat(np.cumsum(largos) - largos, largos)
+    meses = np.repeat(mes_inicio, largos) + desplazamiento
+    hospitales = np.repeat(hospitales.astype(np.int64), largos)
+    gases = np.repeat(gases.astype(np.int64), largos)
+
+    # Agrupar por (hospital, gas, año) combinando los bits con OR
+    claves = np.stack([hospitales, gases, meses // MESES_ANIO], axis=1)
+    unicas, indice = np.unique(claves, axis=0, return_inverse=True)
+    mascaras = np.zeros(len(unicas), dtype=np.int64)
+    np.bitwise_or.at(mascaras, indice.ravel(), np.left_shift(1, meses % MESES_ANIO))
+
+    valores = [
+        {"hospital_id": int(h), "gas_id": int(g), "anio": int(a), "meses": int(m)}
+        for (h, g, a), m in zip(unicas, mascaras)
+    ]
+    for i in range(0, len(valores), 5000):
+        _guardar_mascaras(db, valores[i:i + 5000])
+    db.commit()
+    return len(valores)
+
+
+def _meses_ventana(desde: date, hasta: date) -> List[Tuple[int, int]]:
+    return [
+        (indice // MESES_ANIO, indice % MESES_ANIO + 1)
+        for indice in range(_indice_mes(desde), _indice_mes(hasta) + 1)
+    ]
+
+
+def calcular_faltantes(
+    db: Session,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    gas_id: Optional[int] = None
+) -> Tuple[List[str], list, np.ndarray]:
+    """
+    Matriz de meses faltantes de todos los hospitales activos en la ventana.
+
+    Sin `gas_id` un mes cuenta como cubierto si se reportó cualquier gas.
+    Retorna (etiquetas de meses, filas (id, nombre, codigo) de hospitales,
+    faltantes) con `faltantes` de forma (n_hospitales, n_meses) booleana.
+    """
+    hasta = hasta or date.today()
+    if desde is None:
+        primer_anio = db.query(func.min(CumplimientoRegistro.anio)).scalar()
+        desde = date(primer_anio or hasta.year, 1, 1)
+
+    meses = _meses_ventana(desde, hasta)
+    etiquetas = [f"{anio}-{mes:02d}" for anio, mes in meses]
+    hospitales = db.query(Hospital.id, Hospital.nombre, Hospital.codigo).filter(
+        Hospital.estado == True
+    ).order_by(Hospital.id).all()
+    if not hospitales or not meses:
+        return etiquetas, hospitales, np.zeros((len(hospitales), len(meses)), dtype=bool)
+
+    primer_anio, ultimo_anio = desde.year, hasta.year
+    query = db.query(
+        CumplimientoRegistro.hospital_id,
+        CumplimientoRegistro.anio,
+        CumplimientoRegistro.meses
+    ).filter(
+        CumplimientoRegistro.anio >= primer_anio,
+        CumplimientoRegistro.anio <= ultimo_anio
+    )
+    if gas_id:
+        query = query.filter(CumplimientoRegistro.gas_id == gas_id)
+    filas = query.all()
+
+    ids = np.array([h.id for h in hospitales], dtype=np.int64)
+    cubiertos = np.zeros((len(ids), ultimo_anio - primer_anio + 1), dtype=np.int64)
+    if filas:
+        hosp, anios, mascaras = (np.array(c, dtype=np.int64) for c in zip(*filas))
+        posicion = np.searchsorted(ids, hosp)
+        activos = (posicion < len(ids)) & (ids[np.minimum(posicion, len(ids) - 1)] == hosp)
+        # Sin gas_id se combinan todos los gases del hospital
+        np.bitwise_or.at(cubiertos, (posicion[activos], anios[activos] - primer_anio), mascaras[activos])
+
+    # Decodificar bits: (hospital, año, mes) y recortar a la ventana
+    bits = (cubiertos[:, :, None] >> np.arange(MESES_ANIO)) & 1
+    bits = bits.reshape(len(ids), -1)
+    inicio = desde.month - 1
+    faltantes = bits[:, inicio:inicio + len(meses)] == 0
+    return etiquetas, hospitales, faltantes
+
+
+def hospitales_sin_registro(
+    db: Session,
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None
+) -> List[str]:
+    """Nombres de hospitales activos sin ningún mes cubierto en la ventana"""
+    _, hospitales, faltantes = calcular_faltantes(db, desde, hasta)
+    if faltantes.shape[1] == 0:
+        return [h.nombre for h in hospitales]
+    return [h.nombre for h, sin_datos in zip(hospitales, faltantes.all(axis=1)) if sin_datos]
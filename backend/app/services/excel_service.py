@@ -1,139 +1,100 @@
 """
-Servicio de Generación de Excel/CSV
+Servicio de Generación de Excel
 Sistema de Gases Medicinales MSPBS
+
+El XLSX se escribe con xlsxwriter en modo `constant_memory`: cada fila se
+vuelca al disco apenas se escribe, alimentada por lotes desde un cursor del
+servidor, de modo que la memoria no depende de la cantidad de filas. Los
+anchos de columna salen de una consulta de longitudes máximas en SQL.
 """
 
-import pandas as pd
-from typing import List
-from io import BytesIO
+from typing import Iterable, List
+
+import xlsxwriter
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.models.models import Consumo, Hospital, Gas
+from app.schemas.schemas import FiltroReporte
+from app.services.consultas_service import aplicar_filtros
+from app.services.exportacion_service import (
+    COLUMNAS_REPORTE,
+    ENCABEZADOS,
+    TAMANO_LOTE,
+    iterar_filas_reporte
+)
+
+
+ANCHO_MAXIMO = 50
+# Ancho de las columnas que no son texto (fechas, números, Sí/No)
+ANCHOS_FIJOS = {
+    "ID": 8,
+    "Fecha Inicio": 12,
+    "Fecha Fin": 12,
+    "Cantidad": 12,
+    "Cantidad Normalizada": 22,
+    "Validado": 10,
+    "Fecha Registro": 20,
+}
 
-from app.models.models import Consumo
 
+def calcular_anchos(db: Session, filtros: FiltroReporte) -> List[int]:
+    """
+    Ancho de cada columna según la longitud máxima de sus valores, calculada
+    con una sola consulta agregada sobre las columnas de texto
+    """
+    textos = [
+        (encabezado, expresion) for encabezado, expresion in COLUMNAS_REPORTE
+        if encabezado not in ANCHOS_FIJOS
+    ]
+    stmt = select(
+        *[func.max(func.length(expresion)) for _, expresion in textos]
+    ).select_from(Consumo).join(
+        Hospital, Consumo.hospital_id == Hospital.id
+    ).join(Gas, Consumo.gas_id == Gas.id)
+    maximos = dict(zip([e for e, _ in textos], db.execute(aplicar_filtros(stmt, filtros)).one()))
+
+    anchos = []
+    for encabezado in ENCABEZADOS:
+        largo = ANCHOS_FIJOS.get(encabezado) or maximos.get(encabezado) or 0
+        anchos.append(min(max(largo, len(encabezado)) + 2, ANCHO_MAXIMO))
+    return anchos
 
-def generar_reporte_excel(consumos: List[Consumo], formato: str = "xlsx") -> bytes:
+
+def escribir_xlsx(ruta: str, lotes: Iterable[list], anchos: List[int], hoja: str = "Consumos") -> int:
     """
-    Generar reporte en Excel o CSV
+    Escribir en `ruta` un libro con los encabezados del reporte y las filas
+    de `lotes` (listas de filas formateadas). Retorna la cantidad de filas.
     """
-    # Preparar datos
-    data = []
-    for consumo in consumos:
-        data.append({
-            "ID": consumo.id,
-            "Hospital": consumo.hospital.nombre,
-            "Código Hospital": consumo.hospital.codigo,
-            "Departamento": consumo.hospital.departamento,
-            "Ciudad": consumo.hospital.ciudad,
-            "Gas": consumo.gas.nombre,
-            "Código Gas": consumo.gas.codigo,
-            "Fecha Inicio": consumo.fecha_inicio.strftime("%Y-%m-%d"),
-            "Fecha Fin": consumo.fecha_fin.strftime("%Y-%m-%d"),
-            "Modo Suministro": consumo.modo_suministro,
-            "Cantidad": consumo.cantidad,
-            "Unidad": consumo.unidad_medida,
-            "Observaciones": consumo.observaciones or "",
-            "Validado": "Sí" if consumo.validado else "No",
-            "Fecha Registro": consumo.created_at.strftime("%Y-%m-%d %H:%M:%S")
+    libro = xlsxwriter.Workbook(ruta, {"constant_memory": True})
+    try:
+        hoja_xlsx = libro.add_worksheet(hoja)
+        formato_encabezado = libro.add_format({
+            "bold": True,
+            "font_color": "#FFFFFF",
+            "bg_color": "#003366",
+            "align": "center",
+            "valign": "vcenter"
         })
-    
-    # Crear DataFrame
-    df = pd.DataFrame(data)
-    
-    # Generar archivo
-    buffer = BytesIO()
-    
-    if formato == "xlsx":
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Consumos', index=False)
-            
-            # Obtener workbook y worksheet
-            workbook = writer.book
-            worksheet = writer.sheets['Consumos']
-            
-            # Ajustar anchos de columna
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(cell.value)
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column_letter].width = adjusted_width
-            
-            # Formato de encabezado
-            from openpyxl.styles import Font, PatternFill, Alignment
-            
-            header_fill = PatternFill(start_color="003366", end_color="003366", fill_type="solid")
-            header_font = Font(color="FFFFFF", bold=True)
-            
-            for cell in worksheet[1]:
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = Alignment(horizontal='center', vertical='center')
-    else:
-        # CSV
-        df.to_csv(buffer, index=False, encoding='utf-8-sig')
-    
-    buffer.seek(0)
-    return buffer.getvalue()
+        # En modo constant_memory los anchos deben fijarse antes de escribir filas
+        for columna, ancho in enumerate(anchos):
+            hoja_xlsx.set_column(columna, columna, ancho)
+        hoja_xlsx.write_row(0, 0, ENCABEZADOS, formato_encabezado)
+
+        fila = 0
+        for lote in lotes:
+            for valores in lote:
+                fila += 1
+                hoja_xlsx.write_row(fila, 0, valores)
+        return fila
+    finally:
+        libro.close()
 
 
-def generar_resumen_consumos(consumos: List[Consumo]) -> dict:
+def generar_reporte_excel(db: Session, filtros: FiltroReporte, ruta: str, tamano_lote: int = TAMANO_LOTE) -> int:
     """
-    Generar resumen estadístico de consumos
+    Generar el reporte de consumos filtrados en `ruta` como XLSX.
+    Retorna la cantidad de filas exportadas.
     """
-    if not consumos:
-        return {
-            "total_registros": 0,
-            "total_consumo": 0,
-            "por_gas": {},
-            "por_hospital": {},
-            "por_modo_suministro": {}
-        }
-    
-    # Agrupar por gas
-    por_gas = {}
-    for consumo in consumos:
-        gas_nombre = consumo.gas.nombre
-        if gas_nombre not in por_gas:
-            por_gas[gas_nombre] = {
-                "cantidad": 0,
-                "unidad": consumo.gas.unidad_base,
-                "registros": 0
-            }
-        por_gas[gas_nombre]["cantidad"] += consumo.cantidad
-        por_gas[gas_nombre]["registros"] += 1
-    
-    # Agrupar por hospital
-    por_hospital = {}
-    for consumo in consumos:
-        hospital_nombre = consumo.hospital.nombre
-        if hospital_nombre not in por_hospital:
-            por_hospital[hospital_nombre] = {
-                "cantidad": 0,
-                "registros": 0
-            }
-        por_hospital[hospital_nombre]["cantidad"] += consumo.cantidad
-        por_hospital[hospital_nombre]["registros"] += 1
-    
-    # Agrupar por modo de suministro
-    por_modo = {}
-    for consumo in consumos:
-        modo = consumo.modo_suministro
-        if modo not in por_modo:
-            por_modo[modo] = {
-                "cantidad": 0,
-                "registros": 0
-            }
-        por_modo[modo]["cantidad"] += consumo.cantidad
-        por_modo[modo]["registros"] += 1
-    
-    return {
-        "total_registros": len(consumos),
-        "total_consumo": sum([c.cantidad for c in consumos]),
-        "por_gas": por_gas,
-        "por_hospital": por_hospital,
-        "por_modo_suministro": por_modo
-    }
+    anchos = calcular_anchos(db, filtros)
+    return escribir_xlsx(ruta, iterar_filas_reporte(db, filtros, tamano_lote), anchos)
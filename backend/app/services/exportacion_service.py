@@ -0,0 +1,122 @@
+"""
+Servicio de Exportación de Consumos (CSV)
+Sistema de Gases Medicinales MSPBS
+
+Genera el CSV de consumos por streaming: la consulta Core unida con hospital
+y gas se lee con un cursor del lado del servidor (yield_per) y cada lote se
+escribe como un bloque de bytes, opcionalmente comprimido con gzip. La
+memoria usada depende del tamaño de lote y el encabezado se envía antes de
+ejecutar la consulta.
+"""
+
+import csv
+import io
+import zlib
+from typing import Iterator, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.database import SessionLocal
+from app.models.models import Consumo, Gas, Hospital
+from app.schemas.schemas import FiltroReporte
+from app.services.consultas_service import select_consumos_detalle
+
+
+# (encabezado, expresión) en el orden del reporte de consumos
+COLUMNAS_REPORTE = [
+    ("ID", Consumo.id),
+    ("Hospital", Hospital.nombre),
+    ("Código Hospital", Hospital.codigo),
+    ("Departamento", Hospital.departamento),
+    ("Ciudad", Hospital.ciudad),
+    ("Gas", Gas.nombre),
+    ("Código Gas", Gas.codigo),
+    ("Fecha Inicio", Consumo.fecha_inicio),
+    ("Fecha Fin", Consumo.fecha_fin),
+    ("Modo Suministro", Consumo.modo_suministro),
+    ("Cantidad", Consumo.cantidad),
+    ("Unidad", Consumo.unidad_medida),
+    ("Cantidad Normalizada", Consumo.cantidad_normalizada),  # En Gas.unidad_base
+    ("Observaciones", Consumo.observaciones),
+    ("Validado", Consumo.validado),
+    ("Fecha Registro", Consumo.created_at),
+]
+ENCABEZADOS = [encabezado for encabezado, _ in COLUMNAS_REPORTE]
+
+TAMANO_LOTE = 10_000
+
+
+def select_reporte_consumos(filtros: FiltroReporte, tamano_lote: int = TAMANO_LOTE):
+    """Select del reporte de consumos leído por lotes con un cursor del servidor"""
+    columnas = [(f"c{i}", expresion) for i, (_, expresion) in enumerate(COLUMNAS_REPORTE)]
+    return select_consumos_detalle(filtros, columnas).execution_options(yield_per=tamano_lote)
+
+
+def formatear_fila(fila: tuple) -> list:
+    """Valores de una fila del reporte tal como se muestran en los archivos"""
+    (id_, hospital, codigo_hospital, departamento, ciudad, gas, codigo_gas,
+     fecha_inicio, fecha_fin, modo, cantidad, unidad, cantidad_normalizada,
+     observaciones, validado, creado) = fila
+    return [
+        id_, hospital, codigo_hospital, departamento, ciudad, gas, codigo_gas,
+        fecha_inicio.strftime("%Y-%m-%d"),
+        fecha_fin.strftime("%Y-%m-%d"),
+        modo, cantidad, unidad,
+        cantidad_normalizada if cantidad_normalizada is not None else "",
+        observaciones or "",
+        "Sí" if validado else "No",
+        creado.strftime("%Y-%m-%d %H:%M:%S") if creado else ""
+    ]
+
+
+def iterar_filas_reporte(db: Session, filtros: FiltroReporte, tamano_lote: int = TAMANO_LOTE) -> Iterator[list]:
+    """Lotes de filas formateadas del reporte, leídos por streaming"""
+    resultado = db.execute(select_reporte_consumos(filtros, tamano_lote))
+    try:
+        for lote in resultado.partitions():
+            yield [formatear_fila(fila) for fila in lote]
+    finally:
+        resultado.close()
+
+
+def generar_csv_streaming(
+    filtros: FiltroReporte,
+    comprimir: bool = False,
+    tamano_lote: int = TAMANO_LOTE,
+    db: Optional[Session] = None
+) -> Iterator[bytes]:
+    """
+    Generador de bloques del CSV (UTF-8 con BOM, para Excel). Si no se pasa
+    `db` abre su propia sesión, ya que el generador se consume después de
+    que el endpoint retorna.
+    """
+    propia = db is None
+    db = db or SessionLocal()
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None  # wbits=31: formato gzip
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, lineterminator="\n")
+
+    def vaciar() -> bytes:
+        datos = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return compresor.compress(datos) if compresor else datos
+
+    try:
+        buffer.write("\ufeff")
+        escritor.writerow(ENCABEZADOS)
+        # Con gzip el encabezado puede quedar en el buffer del compresor;
+        # se fuerza un bloque para que el primer byte salga de inmediato
+        yield vaciar() + (compresor.flush(zlib.Z_SYNC_FLUSH) if compresor else b"")
+
+        for filas in iterar_filas_reporte(db, filtros, tamano_lote):
+            escritor.writerows(filas)
+            bloque = vaciar()
+            if bloque:
+                yield bloque
+
+        if compresor:
+            yield compresor.flush()
+    finally:
+        if propia:
+            db.close()
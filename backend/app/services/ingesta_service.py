@@ -0,0 +1,375 @@
+"""
+Servicio de Ingesta de Consumos por Lotes
+Sistema de Gases Medicinales MSPBS
+
+Valida e inserta muchos consumos en una sola transacción, desde un arreglo
+JSON, un CSV o un libro .xlsx leído por streaming. Los campos se
+validan con un solo TypeAdapter de pydantic para todo el lote; hospitales,
+gases y periodos cerrados se resuelven con una consulta por tabla para el
+lote entero, y los permisos y conversiones de unidad se verifican en
+memoria. Las filas válidas se insertan con COPY en PostgreSQL (executemany
+en otros motores) y las inválidas se informan con su número de fila.
+"""
+
+import csv
+import io
+import unicodedata
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from openpyxl import load_workbook
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from app.models.models import CierrePeriodo, Consumo, Gas, Hospital, Usuario
+from app.schemas.schemas import ConsumoCreate
+from app.services.cierres_service import bloquear_periodo, periodo_de_consumo
+from app.services.cumplimiento_service import actualizar_cumplimiento
+from app.services.unidades_service import UnidadNoConvertible, factor_conversion
+from app.services.versiones_service import incrementar_version
+
+
+# Columnas escritas por la ingesta, en el orden del COPY
+COLUMNAS_INGESTA = [
+    "hospital_id", "gas_id", "fecha_inicio", "fecha_fin", "modo_suministro",
+    "unidad_medida", "cantidad", "cantidad_normalizada", "observaciones",
+    "usuario_id", "validado",
+]
+
+_adaptador_lote = TypeAdapter(List[ConsumoCreate])
+
+# Filas de un libro .xlsx validadas e insertadas juntas
+TAMANO_LOTE_IMPORTACION = 1000
+MAX_ERRORES_INFORMADOS = 1000
+
+# Encabezados aceptados en un libro .xlsx (normalizados) -> campo. Los
+# códigos de hospital y gas se resuelven a ids; coinciden con las columnas
+# del reporte de consumos exportado. "Cantidad Normalizada" no se mapea a
+# propósito: se recalcula desde cantidad y unidad al insertar.
+ALIAS_COLUMNAS = {
+    "hospital_id": "hospital_id",
+    "id_hospital": "hospital_id",
+    "codigo_hospital": "hospital_codigo",
+    "hospital_codigo": "hospital_codigo",
+    "gas_id": "gas_id",
+    "id_gas": "gas_id",
+    "codigo_gas": "gas_codigo",
+    "gas_codigo": "gas_codigo",
+    "fecha_inicio": "fecha_inicio",
+    "desde": "fecha_inicio",
+    "fecha_fin": "fecha_fin",
+    "hasta": "fecha_fin",
+    "modo_suministro": "modo_suministro",
+    "modo": "modo_suministro",
+    "cantidad": "cantidad",
+    "unidad_medida": "unidad_medida",
+    "unidad": "unidad_medida",
+    "observaciones": "observaciones",
+}
+
+
+def _mensaje_error(error: dict) -> str:
+    """Texto de un error de pydantic con el campo que lo produjo"""
+    campo = ".".join(str(parte) for parte in error["loc"][1:])
+    return f"{campo}: {error['msg']}" if campo else error["msg"]
+
+
+def validar_campos(registros: List[dict]) -> Tuple[List[Tuple[int, ConsumoCreate]], Dict[int, List[str]]]:
+    """
+    Validar los campos de todo el lote con una sola llamada al validador.
+    Retorna ([(índice, consumo)], {índice: [errores]}).
+    """
+    errores: Dict[int, List[str]] = {}
+    try:
+        return list(enumerate(_adaptador_lote.validate_python(registros))), errores
+    except ValidationError as e:
+        for error in e.errors():
+            errores.setdefault(error["loc"][0], []).append(_mensaje_error(error))
+
+    # Revalidar solo las filas sin errores (no pueden fallar)
+    indices = [i for i in range(len(registros)) if i not in errores]
+    consumos = _adaptador_lote.validate_python([registros[i] for i in indices])
+    return list(zip(indices, consumos)), errores
+
+
+def validar_lote(
+    db: Session,
+    registros: List[dict],
+    usuario: Usuario,
+    primera_fila: int = 1,
+    numeros_fila: Optional[Sequence[int]] = None
+) -> Tuple[List[dict], List[dict]]:
+    """
+    Validar un lote de consumos. Retorna (filas listas para insertar,
+    errores [{"fila": n, "errores": [...]}]) donde n es la posición en el
+    lote contando desde `primera_fila`, o `numeros_fila[posición]` si se da.
+    Los meses del lote quedan bloqueados contra un cierre hasta el commit.
+    """
+    consumos, errores = validar_campos(registros)
+
+    hospital_ids = {c.hospital_id for _, c in consumos}
+    gas_ids = {c.gas_id for _, c in consumos}
+    hospitales = set(db.execute(select(Hospital.id).where(Hospital.id.in_(hospital_ids))).scalars())
+    gases = {
+        g.id: (g.unidad_base, g.codigo)
+        for g in db.execute(select(Gas.id, Gas.unidad_base, Gas.codigo).where(Gas.id.in_(gas_ids)))
+    }
+    # Los meses se bloquean antes de leer los cierres, que así incluyen a
+    # uno que termine mientras tanto
+    periodos = {
+        indice: periodo_de_consumo(consumo.fecha_inicio, consumo.fecha_fin)
+        for indice, consumo in consumos
+    }
+    en_cierre = {
+        periodo for periodo in set(periodos.values()) - {None}
+        if not bloquear_periodo(db, periodo)
+    }
+    cerrados = set(db.execute(select(CierrePeriodo.periodo)).scalars())
+
+    # Factor de conversión (o el error) por (gas, unidad), calculado una vez
+    factores: Dict[Tuple[int, str], Optional[float]] = {}
+    sin_conversion: Dict[Tuple[int, str], str] = {}
+    filas = []
+    for indice, consumo in consumos:
+        problemas = []
+        if usuario.rol == "HOSPITAL_USER" and consumo.hospital_id != usuario.hospital_id:
+            problemas.append("Solo puede crear consumos para su hospital")
+        elif consumo.hospital_id not in hospitales:
+            problemas.append("Hospital no encontrado")
+        if consumo.gas_id not in gases:
+            problemas.append("Gas no encontrado")
+        else:
+            clave = (consumo.gas_id, consumo.unidad_medida)
+            if clave not in factores:
+                unidad_base, codigo = gases[consumo.gas_id]
+                try:
+                    factores[clave] = factor_conversion(consumo.unidad_medida, unidad_base, codigo)
+                except UnidadNoConvertible as e:
+                    factores[clave] = None
+                    sin_conversion[clave] = str(e)
+            if clave in sin_conversion:
+                problemas.append(sin_conversion[clave])
+        periodo = periodos[indice]
+        if periodo in cerrados:
+            problemas.append(f"El periodo {periodo.strftime('%Y-%m')} está cerrado")
+        elif periodo in en_cierre:
+            problemas.append(f"El periodo {periodo.strftime('%Y-%m')} se está cerrando")
+
+        if problemas:
+            errores.setdefault(indice, []).extend(problemas)
+            continue
+        filas.append({
+            **consumo.model_dump(),
+            "modo_suministro": consumo.modo_suministro.value,
+            "cantidad_normalizada": consumo.cantidad * factores[(consumo.gas_id, consumo.unidad_medida)],
+            "observaciones": consumo.observaciones or None,
+            "usuario_id": usuario.id,
+            "validado": False,
+        })
+
+    return filas, [
+        {"fila": numeros_fila[indice] if numeros_fila else indice + primera_fila, "errores": mensajes}
+        for indice, mensajes in sorted(errores.items())
+    ]
+
+
+def _copiar_postgres(db: Session, filas: List[dict]):
+    """COPY ... FROM STDIN en la conexión (y transacción) de la sesión"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for fila in filas:
+        # En CSV de COPY un campo vacío sin comillas es NULL
+        escritor.writerow(["" if fila[c] is None else fila[c] for c in COLUMNAS_INGESTA])
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY consumos ({', '.join(COLUMNAS_INGESTA)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def insertar_consumos(db: Session, filas: List[dict]) -> int:
+    """
+    Insertar filas validadas por validar_lote y mantener el índice de
+    cumplimiento y la versión de consumos. No hace commit.
+    """
+    if not filas:
+        return 0
+    if db.get_bind().dialect.name == "postgresql":
+        _copiar_postgres(db, filas)
+    else:
+        db.execute(insert(Consumo), [{c: fila[c] for c in COLUMNAS_INGESTA} for fila in filas])
+
+    actualizar_cumplimiento(db, {
+        (fila["hospital_id"], fila["gas_id"], fila["fecha_inicio"], fila["fecha_fin"]) for fila in filas
+    })
+    incrementar_version(db, "consumos")
+    return len(filas)
+
+
+def leer_csv_consumos(texto: str) -> List[dict]:
+    """Registros de un CSV con encabezados con los nombres de ConsumoCreate"""
+    lector = csv.DictReader(io.StringIO(texto.lstrip("\ufeff")))
+    return [
+        {campo.strip(): (valor.strip() or None) for campo, valor in fila.items() if campo and valor is not None}
+        for fila in lector
+    ]
+
+
+def _normalizar_encabezado(texto) -> str:
+    """Encabezado en minúsculas, sin tildes y con guiones bajos"""
+    limpio = unicodedata.normalize("NFKD", str(texto or ""))
+    limpio = "".join(c for c in limpio if not unicodedata.combining(c))
+    return "_".join(limpio.lower().replace("-", " ").split())
+
+
+def _valor_celda(valor):
+    """Valor de una celda como lo espera ConsumoCreate"""
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, str):
+        return valor.strip() or None
+    return valor
+
+
+def _codigo(valor) -> str:
+    """Código leído de una celda (los numéricos llegan como float)"""
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor).strip()
+
+
+def leer_xlsx_consumos(ruta: str, hoja: Optional[str] = None) -> Iterator[Tuple[List[int], List[dict]]]:
+    """
+    Lotes de (números de fila, registros) de un libro .xlsx, leído en modo
+    read_only: openpyxl no carga la hoja entera. La primera fila no vacía
+    es el encabezado. Lanza ValueError si el libro, la hoja o las columnas
+    no sirven.
+    """
+    try:
+        libro = load_workbook(ruta, read_only=True, data_only=True)
+    except Exception:
+        raise ValueError("El archivo no es un libro .xlsx válido")
+    try:
+        if hoja is not None and hoja not in libro.sheetnames:
+            raise ValueError(f"El libro no tiene la hoja '{hoja}'")
+        filas = libro[hoja].iter_rows(values_only=True) if hoja else libro.worksheets[0].iter_rows(values_only=True)
+
+        columnas: Dict[int, str] = {}
+        numero = 0
+        for numero, valores in enumerate(filas, start=1):
+            if any(v is not None for v in valores):
+                columnas = {
+                    posicion: ALIAS_COLUMNAS[_normalizar_encabezado(valor)]
+                    for posicion, valor in enumerate(valores)
+                    if _normalizar_encabezado(valor) in ALIAS_COLUMNAS
+                }
+                break
+        presentes = set(columnas.values())
+        faltantes = [
+            campo for campo in ("fecha_inicio", "fecha_fin", "modo_suministro", "cantidad", "unidad_medida")
+            if campo not in presentes
+        ]
+        if not presentes & {"hospital_id", "hospital_codigo"}:
+            faltantes.append("hospital_id o codigo_hospital")
+        if not presentes & {"gas_id", "gas_codigo"}:
+            faltantes.append("gas_id o codigo_gas")
+        if faltantes:
+            raise ValueError(f"Faltan columnas: {', '.join(faltantes)}")
+
+        numeros: List[int] = []
+        registros: List[dict] = []
+        for numero, valores in enumerate(filas, start=numero + 1):
+            if not any(v is not None for v in valores):
+                continue
+            numeros.append(numero)
+            registros.append({
+                campo: _valor_celda(valores[posicion])
+                for posicion, campo in columnas.items() if posicion < len(valores)
+            })
+            if len(registros) == TAMANO_LOTE_IMPORTACION:
+                yield numeros, registros
+                numeros, registros = [], []
+        if registros:
+            yield numeros, registros
+    finally:
+        libro.close()
+
+
+def resolver_codigos(db: Session, registros: List[dict]):
+    """
+    Completar hospital_id y gas_id a partir de hospital_codigo y gas_codigo
+    con una consulta por tabla para el lote. Los códigos desconocidos quedan
+    con id 0, que validar_lote informa como no encontrado.
+    """
+    for campo_id, campo_codigo, modelo in (
+        ("hospital_id", "hospital_codigo", Hospital),
+        ("gas_id", "gas_codigo", Gas),
+    ):
+        codigos = {
+            _codigo(r[campo_codigo]) for r in registros
+            if r.get(campo_id) is None and r.get(campo_codigo) is not None
+        }
+        if not codigos:
+            continue
+        ids = dict(db.execute(select(modelo.codigo, modelo.id).where(modelo.codigo.in_(codigos))).all())
+        for registro in registros:
+            codigo = registro.pop(campo_codigo, None)
+            if registro.get(campo_id) is None and codigo is not None:
+                registro[campo_id] = ids.get(_codigo(codigo), 0)
+
+
+def importar_lote(
+    db: Session,
+    registros: List[dict],
+    usuario: Usuario,
+    primera_fila: int = 1,
+    todo_o_nada: bool = False
+) -> dict:
+    """
+    Validar e insertar un lote de consumos ya leído, sin commit. Con
+    `todo_o_nada` no se inserta nada si alguna fila tiene errores.
+    """
+    filas, errores = validar_lote(db, registros, usuario, primera_fila=primera_fila)
+    insertados = 0 if errores and todo_o_nada else insertar_consumos(db, filas)
+    return {
+        "recibidos": len(registros),
+        "insertados": insertados,
+        "errores": errores,
+    }
+
+
+def importar_xlsx(
+    db: Session,
+    ruta: str,
+    usuario: Usuario,
+    hoja: Optional[str] = None,
+    todo_o_nada: bool = False
+) -> dict:
+    """
+    Validar e insertar por lotes los consumos de un libro .xlsx, sin commit.
+    Con `todo_o_nada` se deja de insertar al primer error (se siguen
+    validando las filas para informarlos todos).
+    """
+    recibidos = insertados = 0
+    errores: List[dict] = []
+    errores_total = 0
+    for numeros, registros in leer_xlsx_consumos(ruta, hoja):
+        resolver_codigos(db, registros)
+        filas, errores_lote = validar_lote(db, registros, usuario, numeros_fila=numeros)
+        recibidos += len(registros)
+        errores_total += len(errores_lote)
+        errores.extend(errores_lote[:MAX_ERRORES_INFORMADOS - len(errores)])
+        if not (todo_o_nada and errores_total):
+            insertados += insertar_consumos(db, filas)
+
+    return {
+        "recibidos": recibidos,
+        "insertados": insertados,
+        "errores_total": errores_total,
+        "errores": errores,
+    }
@@ -0,0 +1,138 @@
+"""
+Servicio de Paquetes de Reportes por Hospital
+Sistema de Gases Medicinales MSPBS
+
+Genera en un solo trabajo el PDF y el XLSX de cada hospital. Las filas de
+todos los hospitales se leen en una sola pasada, ordenadas por hospital_id
+y con un cursor del servidor; cada hospital se envía al pool de procesos
+apenas se completan sus filas. A lo sumo PAQUETE_HOSPITALES_EN_CURSO
+hospitales se renderizan (y retienen sus filas en memoria) a la vez, y cada
+par de archivos se agrega al zip en disco en cuanto termina.
+"""
+
+import itertools
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+from operator import itemgetter
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.procesos import obtener_pool
+from app.models.models import Consumo, Hospital
+from app.schemas.schemas import FiltroReporte
+from app.services.consultas_service import aplicar_filtros, select_consumos_detalle
+from app.services.excel_service import calcular_anchos, escribir_xlsx
+from app.services.exportacion_service import COLUMNAS_REPORTE, TAMANO_LOTE, formatear_fila
+from app.services.pdf_service import generar_reporte_pdf, generar_reporte_pdf_rapido
+
+
+# Columnas del reporte de consumos más el hospital_id de la partición
+COLUMNAS_PAQUETE = [(f"c{i}", expresion) for i, (_, expresion) in enumerate(COLUMNAS_REPORTE)] + [
+    ("hospital_id", Consumo.hospital_id),
+]
+_columnas_reporte = slice(0, len(COLUMNAS_REPORTE))
+# Posiciones de las columnas de pdf_service.COLUMNAS_PDF dentro de una fila del paquete
+_columnas_pdf = itemgetter(2, 1, 5, 7, 8, 9, 10, 11, 12)
+_hospital_id = itemgetter(len(COLUMNAS_REPORTE))
+
+
+def nombre_archivo_hospital(codigo: str) -> str:
+    """Nombre de archivo seguro a partir del código del hospital"""
+    return re.sub(r"[^\w.-]", "_", codigo) or "hospital"
+
+
+def renderizar_hospital(
+    filas: List[tuple],
+    filtros: FiltroReporte,
+    autor: str,
+    anchos: List[int],
+    directorio: str
+) -> List[Tuple[str, str]]:
+    """
+    Escribir en `directorio` el PDF y el XLSX de un hospital a partir de sus
+    filas del paquete. Se ejecuta en el pool de procesos. Retorna los pares
+    (ruta, nombre dentro del zip).
+    """
+    base = nombre_archivo_hospital(filas[0][2])
+    filas_pdf = [_columnas_pdf(fila) for fila in filas]
+    renderizador = generar_reporte_pdf_rapido if len(filas_pdf) > settings.PDF_FILAS_RAPIDO else generar_reporte_pdf
+    ruta_pdf = os.path.join(directorio, f"{base}.pdf")
+    renderizador(filas_pdf, "hospital", filtros, autor, ruta_pdf)
+
+    ruta_xlsx = os.path.join(directorio, f"{base}.xlsx")
+    escribir_xlsx(ruta_xlsx, [[formatear_fila(fila[_columnas_reporte]) for fila in filas]], anchos)
+    return [(ruta_pdf, f"{base}/{base}.pdf"), (ruta_xlsx, f"{base}/{base}.xlsx")]
+
+
+def contar_hospitales(db: Session, filtros: FiltroReporte) -> int:
+    """Cantidad de hospitales con consumos que coinciden con los filtros"""
+    stmt = select(func.count(func.distinct(Consumo.hospital_id))).select_from(Consumo).join(
+        Hospital, Consumo.hospital_id == Hospital.id
+    )
+    return db.execute(aplicar_filtros(stmt, filtros)).scalar() or 0
+
+
+def generar_paquete_hospitales(
+    db: Session,
+    filtros: FiltroReporte,
+    autor: str,
+    ruta: str,
+    progreso: Optional[Callable[[int, int], None]] = None
+) -> int:
+    """
+    Escribir en `ruta` un zip con una carpeta por hospital con su PDF y su
+    XLSX. `progreso(hechos, total)` se llama al inicio y después de agregar
+    cada hospital. Retorna la cantidad de hospitales incluidos.
+    """
+    total = contar_hospitales(db, filtros)
+    anchos = calcular_anchos(db, filtros)
+    if progreso:
+        progreso(0, total)
+
+    stmt = select_consumos_detalle(filtros, COLUMNAS_PAQUETE).order_by(None).order_by(
+        Consumo.hospital_id, Consumo.id
+    ).execution_options(yield_per=TAMANO_LOTE)
+
+    pool = obtener_pool()
+    en_curso = set()
+    hechos = 0
+    directorio = tempfile.mkdtemp(dir=os.path.dirname(ruta) or None)
+    resultado = db.execute(stmt)
+    # PDF y XLSX ya vienen comprimidos: se guardan sin volver a comprimir
+    try:
+        with zipfile.ZipFile(ruta, "w", zipfile.ZIP_STORED) as paquete:
+
+            def agregar_terminados(bloquear: bool):
+                nonlocal en_curso, hechos
+                listos, en_curso = wait(en_curso, timeout=None if bloquear else 0, return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    for archivo, nombre in futuro.result():
+                        paquete.write(archivo, nombre)
+                        os.remove(archivo)
+                    hechos += 1
+                    if progreso:
+                        progreso(hechos, total)
+
+            for _, grupo in itertools.groupby(resultado, key=_hospital_id):
+                filas = [tuple(fila) for fila in grupo]
+                while len(en_curso) >= settings.PAQUETE_HOSPITALES_EN_CURSO:
+                    agregar_terminados(bloquear=True)
+                en_curso.add(pool.submit(renderizar_hospital, filas, filtros, autor, anchos, directorio))
+                agregar_terminados(bloquear=False)
+
+            while en_curso:
+                agregar_terminados(bloquear=True)
+    finally:
+        resultado.close()
+        for futuro in en_curso:
+            futuro.cancel()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    return hechos
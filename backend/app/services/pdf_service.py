@@ -4,47 +4,60 @@ Sistema de Gases Medicinales MSPBS
 """
 
 from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
+from reportlab.lib.pagesizes import letter, A4, landscape
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image, PageBreak
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 from reportlab.pdfgen import canvas
 from io import BytesIO
 from datetime import datetime
-from typing import List
+from typing import BinaryIO, Iterable, List, Optional, Union
+import itertools
 import os
 
-from app.models.models import Consumo, Usuario
+from sqlalchemy.orm import Session
+
+from app.models.models import Consumo, Gas, Hospital
 from app.schemas.schemas import FiltroReporte
+from app.services.consultas_service import select_consumos_detalle
 from app.core.config import settings
 
 
-def generar_reporte_pdf(
-    consumos: List[Consumo],
-    tipo_reporte: str,
-    filtros: FiltroReporte,
-    usuario: Usuario
-) -> bytes:
+# Columnas del detalle del PDF, en el orden de las tuplas de consultar_filas_reporte
+COLUMNAS_PDF = [
+    ("hospital_codigo", Hospital.codigo),
+    ("hospital_nombre", Hospital.nombre),
+    ("gas_nombre", Gas.nombre),
+    ("fecha_inicio", Consumo.fecha_inicio),
+    ("fecha_fin", Consumo.fecha_fin),
+    ("modo_suministro", Consumo.modo_suministro),
+    ("cantidad", Consumo.cantidad),
+    ("unidad_medida", Consumo.unidad_medida),
+    ("cantidad_normalizada", Consumo.cantidad_normalizada),
+]
+
+
+def consultar_filas_reporte(db: Session, filtros: FiltroReporte) -> List[tuple]:
     """
-    Generar reporte PDF de consumos
+    Filas del reporte PDF como tuplas simples, para poder cerrar la sesión y
+    enviarlas a otro proceso antes de renderizar
     """
-    buffer = BytesIO()
-    
-    # Crear documento
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=A4,
-        rightMargin=72,
-        leftMargin=72,
-        topMargin=72,
-        bottomMargin=18,
-    )
-    
-    # Contenedor de elementos
-    elements = []
-    
-    # Estilos
+    stmt = select_consumos_detalle(filtros, COLUMNAS_PDF)
+    return [tuple(fila) for fila in db.execute(stmt)]
+
+
+def titulo_reporte(tipo_reporte: str, hospital_nombre: Optional[str] = None) -> str:
+    """Título del reporte según su tipo"""
+    if tipo_reporte == "global":
+        return "REPORTE GLOBAL DE CONSUMO DE GASES MEDICINALES"
+    if tipo_reporte == "hospital":
+        return f"REPORTE DE CONSUMO - {hospital_nombre or 'N/A'}"
+    return "REPORTE DE CONSUMO DE GASES MEDICINALES"
+
+
+def _estilos() -> dict:
+    """Estilos de párrafo de los reportes"""
     styles = getSampleStyleSheet()
     
     # Estilo personalizado para título
@@ -73,6 +86,13 @@ def generar_reporte_pdf(
     normal_style = styles['Normal']
     normal_style.fontSize = 9
     
+    return {'titulo': titulo_style, 'subtitulo': subtitulo_style, 'normal': normal_style}
+
+
+def _encabezado(estilos: dict, titulo: str, filtros: FiltroReporte, autor: str) -> list:
+    """Logo, títulos y datos de generación al inicio de un reporte"""
+    elements = []
+    
     # Header con logo (si existe)
     if os.path.exists(settings.LOGO_PATH):
         try:
@@ -86,30 +106,22 @@ def generar_reporte_pdf(
     # Título principal
     elements.append(Paragraph(
         f"{settings.ORGANIZACION}",
-        titulo_style
+        estilos['titulo']
     ))
     elements.append(Paragraph(
         f"Ministerio de Salud y Bienestar Social - {settings.PAIS}",
-        normal_style
+        estilos['normal']
     ))
     elements.append(Spacer(1, 12))
     
     # Título del reporte
-    if tipo_reporte == "global":
-        titulo_reporte = "REPORTE GLOBAL DE CONSUMO DE GASES MEDICINALES"
-    elif tipo_reporte == "hospital":
-        hospital_nombre = consumos[0].hospital.nombre if consumos else "N/A"
-        titulo_reporte = f"REPORTE DE CONSUMO - {hospital_nombre}"
-    else:
-        titulo_reporte = "REPORTE DE CONSUMO DE GASES MEDICINALES"
-    
-    elements.append(Paragraph(titulo_reporte, subtitulo_style))
+    elements.append(Paragraph(titulo, estilos['subtitulo']))
     elements.append(Spacer(1, 12))
     
     # Información del reporte
     info_data = [
         ["Fecha de generación:", datetime.now().strftime("%d/%m/%Y %H:%M")],
-        ["Generado por:", f"{usuario.nombre} {usuario.apellido}"],
+        ["Generado por:", autor],
     ]
     
     if filtros.fecha_inicio:
@@ -126,47 +138,86 @@ def generar_reporte_pdf(
     elements.append(info_table)
     elements.append(Spacer(1, 20))
     
-    # Tabla de consumos
-    if consumos:
-        # Encabezados
-        headers = ["Hospital", "Gas", "Periodo", "Modo", "Cantidad", "Unidad"]
+    return elements
+
+
+def _tabla_detalle(filas: List[tuple]) -> Table:
+    """Tabla de detalle de consumos (tuplas de consultar_filas_reporte)"""
+    # Encabezados
+    headers = ["Hospital", "Gas", "Periodo", "Modo", "Cantidad", "Unidad"]
+    
+    # Datos
+    data = [headers]
+    for codigo, _, gas, fecha_inicio, fecha_fin, modo, cantidad, unidad, _ in filas:
+        data.append([
+            codigo,
+            gas,
+            f"{fecha_inicio.strftime('%d/%m/%y')} - {fecha_fin.strftime('%d/%m/%y')}",
+            modo.replace('_', ' ').title(),
+            f"{cantidad:.2f}",
+            unidad
+        ])
+    
+    # Crear tabla
+    table = Table(data, colWidths=[1.2*inch, 1.2*inch, 1.3*inch, 1.2*inch, 0.8*inch, 0.6*inch], repeatRows=1)
+    table.setStyle(TableStyle([
+        # Encabezado
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#003366')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 9),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
         
         # Datos
-        data = [headers]
-        for consumo in consumos:
-            data.append([
-                consumo.hospital.codigo,
-                consumo.gas.nombre,
-                f"{consumo.fecha_inicio.strftime('%d/%m/%y')} - {consumo.fecha_fin.strftime('%d/%m/%y')}",
-                consumo.modo_suministro.replace('_', ' ').title(),
-                f"{consumo.cantidad:.2f}",
-                consumo.unidad_medida
-            ])
-        
-        # Crear tabla
-        table = Table(data, colWidths=[1.2*inch, 1.2*inch, 1.3*inch, 1.2*inch, 0.8*inch, 0.6*inch])
-        table.setStyle(TableStyle([
-            # Encabezado
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#003366')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 9),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            
-            # Datos
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ('ALIGN', (4, 1), (5, -1), 'RIGHT'),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f0f0f0')]),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ]))
-        
+        ('FONTSIZE', (0, 1), (-1, -1), 8),
+        ('ALIGN', (4, 1), (5, -1), 'RIGHT'),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f0f0f0')]),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ]))
+    return table
+
+
+def generar_reporte_pdf(
+    filas: List[tuple],
+    tipo_reporte: str,
+    filtros: FiltroReporte,
+    autor: str,
+    destino: Union[str, BinaryIO, None] = None
+) -> Optional[bytes]:
+    """
+    Generar reporte PDF de consumos a partir de las tuplas de
+    consultar_filas_reporte. Solo recibe datos serializables, así que puede
+    ejecutarse en el pool de procesos. Con `destino` (ruta o archivo
+    abierto) el PDF se escribe directamente allí; si no, se retornan los bytes.
+    """
+    buffer = BytesIO() if destino is None else destino
+    
+    # Crear documento
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        rightMargin=72,
+        leftMargin=72,
+        topMargin=72,
+        bottomMargin=18,
+    )
+    
+    estilos = _estilos()
+    normal_style = estilos['normal']
+    elements = _encabezado(
+        estilos, titulo_reporte(tipo_reporte, filas[0][1] if filas else None), filtros, autor
+    )
+    
+    # Tabla de consumos
+    if filas:
+        table = _tabla_detalle(filas)
         elements.append(table)
         elements.append(Spacer(1, 20))
         
         # Resumen
-        total_registros = len(consumos)
-        total_consumo = sum([c.cantidad for c in consumos])
+        total_registros = len(filas)
+        total_consumo = sum([fila[8] or 0 for fila in filas])
         
         resumen_data = [
             ["RESUMEN"],
@@ -200,8 +251,312 @@ def generar_reporte_pdf(
     # Construir PDF
     doc.build(elements)
     
+    if destino is not None:
+        return None
+    
     # Obtener bytes
     pdf_bytes = buffer.getvalue()
     buffer.close()
     
     return pdf_bytes
+
+
+# ============ REPORTE RESUMIDO ============
+FILAS_POR_TABLA_ANEXO = 500
+ESTILO_PIVOT = [
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#003366')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 7),
+    ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f0f0f0')]),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+]
+
+
+def _tabla_pivot(encabezados: list, filas: list) -> Table:
+    """Tabla compacta con encabezado repetido en cada página"""
+    table = Table([encabezados] + filas, repeatRows=1, hAlign='LEFT')
+    table.setStyle(TableStyle(ESTILO_PIVOT))
+    return table
+
+
+def _celdas_por_gas(por_gas: dict, gases: list) -> list:
+    """Cantidades de una fila pivot en el orden de `gases` ("-" si no hay)"""
+    celdas = []
+    for gas in gases:
+        cantidad = por_gas.get(gas["gas_id"])
+        celdas.append(f"{cantidad:,.2f}" if cantidad is not None else "-")
+    return celdas
+
+
+def generar_resumen_pdf(
+    resumen: dict,
+    tipo_reporte: str,
+    filtros: FiltroReporte,
+    autor: str,
+    destino: Union[str, BinaryIO, None] = None,
+    filas_detalle: Optional[List[tuple]] = None
+) -> Optional[bytes]:
+    """
+    Reporte PDF resumido a partir de consultas_service.calcular_resumen_consumos:
+    totales por gas y tablas hospital × gas y modo de suministro × gas. Con
+    `filas_detalle` (tuplas de consultar_filas_reporte) se agrega el detalle
+    como anexo. Como generar_reporte_pdf, solo recibe datos serializables.
+    """
+    buffer = BytesIO() if destino is None else destino
+    gases = resumen["gases"]
+    # Las tablas pivot llevan una columna por gas
+    pagesize = landscape(A4) if len(gases) > 4 else A4
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=pagesize,
+        rightMargin=36,
+        leftMargin=36,
+        topMargin=54,
+        bottomMargin=18,
+    )
+    
+    hospitales = resumen["hospitales"]
+    hospital_nombre = hospitales[0]["nombre"] if len(hospitales) == 1 else None
+    estilos = _estilos()
+    elements = _encabezado(
+        estilos, f"{titulo_reporte(tipo_reporte, hospital_nombre)} (RESUMEN)", filtros, autor
+    )
+    
+    if not resumen["total_registros"]:
+        elements.append(Paragraph("No hay datos para mostrar con los filtros seleccionados.", estilos['normal']))
+    else:
+        encabezados_gas = [f"{gas['nombre']} ({gas['unidad']})" for gas in gases]
+        
+        # Totales por gas
+        elements.append(Paragraph("Totales por gas", estilos['subtitulo']))
+        elements.append(_tabla_pivot(
+            ["Gas", "Unidad", "Registros", "Cantidad"],
+            [[gas["nombre"], gas["unidad"], str(gas["registros"]), f"{gas['cantidad']:,.2f}"] for gas in gases]
+            + [["TOTAL", "", str(resumen["total_registros"]), ""]]
+        ))
+        elements.append(Spacer(1, 16))
+        
+        # Hospital × gas
+        elements.append(Paragraph("Consumo por hospital", estilos['subtitulo']))
+        elements.append(_tabla_pivot(
+            ["Hospital", "Registros"] + encabezados_gas,
+            [
+                [f"{h['codigo']} - {h['nombre']}"[:45], str(h["registros"])] + _celdas_por_gas(h["por_gas"], gases)
+                for h in hospitales
+            ]
+        ))
+        elements.append(Spacer(1, 16))
+        
+        # Modo de suministro × gas
+        elements.append(Paragraph("Consumo por modo de suministro", estilos['subtitulo']))
+        elements.append(_tabla_pivot(
+            ["Modo", "Registros"] + encabezados_gas,
+            [
+                [m["modo_suministro"].replace('_', ' ').title(), str(m["registros"])]
+                + _celdas_por_gas(m["por_gas"], gases)
+                for m in resumen["modos"]
+            ]
+        ))
+    
+    # Anexo de detalle, en tablas parciales para no medir miles de filas juntas
+    if filas_detalle:
+        elements.append(PageBreak())
+        elements.append(Paragraph("ANEXO - Detalle de consumos", estilos['subtitulo']))
+        for inicio in range(0, len(filas_detalle), FILAS_POR_TABLA_ANEXO):
+            elements.append(_tabla_detalle(filas_detalle[inicio:inicio + FILAS_POR_TABLA_ANEXO]))
+    
+    # Pie de página
+    elements.append(Spacer(1, 30))
+    elements.append(Paragraph(
+        f"Documento generado automáticamente por {settings.APP_NAME} v{settings.APP_VERSION}",
+        ParagraphStyle('Footer', fontSize=7, textColor=colors.grey, alignment=TA_CENTER)
+    ))
+    
+    doc.build(elements)
+    
+    if destino is not None:
+        return None
+    
+    pdf_bytes = buffer.getvalue()
+    buffer.close()
+    
+    return pdf_bytes
+
+
+# ============ RENDERIZADOR RÁPIDO ============
+# Para reportes grandes la tabla de platypus se mide y divide una y otra vez
+# (tiempo y memoria superlineales). Este renderizador dibuja filas de alto
+# fijo directamente en el canvas: la geometría se calcula una vez, el
+# encabezado y el pie de cada página son un form XObject dibujado por
+# referencia, y las filas se consumen de un iterador página por página.
+
+MARGEN = 36
+ALTO_FILA = 11
+TAMANO_FUENTE = 7
+ANCHO_CARACTER = 0.52  # Ancho medio de un carácter de Helvetica (en em)
+COLOR_PRIMARIO = colors.HexColor('#003366')
+COLOR_CEBRA = colors.HexColor('#f0f0f0')
+
+# (encabezado, ancho relativo, alineación)
+COLUMNAS_RAPIDO = [
+    ("Hospital", 1.2, "izquierda"),
+    ("Gas", 1.2, "izquierda"),
+    ("Periodo", 1.3, "izquierda"),
+    ("Modo", 1.2, "izquierda"),
+    ("Cantidad", 0.9, "derecha"),
+    ("Unidad", 0.6, "izquierda"),
+]
+
+
+def _geometria_columnas(ancho_util: float) -> List[tuple]:
+    """(x de inicio, x de fin, alineación, caracteres máximos) de cada columna"""
+    total = sum(relativo for _, relativo, _ in COLUMNAS_RAPIDO)
+    geometria = []
+    x = MARGEN
+    for _, relativo, alineacion in COLUMNAS_RAPIDO:
+        ancho = ancho_util * relativo / total
+        caracteres = int((ancho - 6) / (TAMANO_FUENTE * ANCHO_CARACTER))
+        geometria.append((x + 3, x + ancho - 3, alineacion, caracteres))
+        x += ancho
+    return geometria
+
+
+def _celdas_fila(fila: tuple) -> tuple:
+    """Textos de una fila de consultar_filas_reporte en el orden de COLUMNAS_RAPIDO"""
+    codigo, _, gas, fecha_inicio, fecha_fin, modo, cantidad, unidad, _ = fila
+    return (
+        codigo,
+        gas,
+        f"{fecha_inicio.strftime('%d/%m/%y')} - {fecha_fin.strftime('%d/%m/%y')}",
+        modo.replace('_', ' ').title(),
+        f"{cantidad:.2f}",
+        unidad
+    )
+
+
+def generar_reporte_pdf_rapido(
+    filas: Iterable[tuple],
+    tipo_reporte: str,
+    filtros: FiltroReporte,
+    autor: str,
+    destino: Union[str, BinaryIO, None] = None,
+    hospital_nombre: Optional[str] = None
+) -> Optional[bytes]:
+    """
+    Reporte PDF de consumos dibujado directamente en el canvas, con el mismo
+    contenido que generar_reporte_pdf. `filas` puede ser cualquier iterador
+    de tuplas de consultar_filas_reporte; para reportes por hospital se usa
+    `hospital_nombre` o el de la primera fila.
+    """
+    buffer = BytesIO() if destino is None else destino
+    ancho_pagina, alto_pagina = A4
+    ancho_util = ancho_pagina - 2 * MARGEN
+    geometria = _geometria_columnas(ancho_util)
+
+    filas = iter(filas)
+    primera = next(filas, None)
+    if tipo_reporte == "hospital" and not hospital_nombre and primera:
+        hospital_nombre = primera[1]
+
+    c = canvas.Canvas(buffer, pagesize=A4, pageCompression=1)
+    c.setTitle(titulo_reporte(tipo_reporte, hospital_nombre))
+    c.setAuthor(autor)
+
+    # Encabezado y pie comunes a todas las páginas, dibujados una sola vez
+    y_titulo = alto_pagina - MARGEN
+    y_columnas = y_titulo - 34
+    c.beginForm("marco")
+    c.setFillColor(COLOR_PRIMARIO)
+    c.setFont('Helvetica-Bold', 10)
+    c.drawString(MARGEN, y_titulo - 10, settings.ORGANIZACION)
+    c.setFont('Helvetica-Bold', 9)
+    c.drawString(MARGEN, y_titulo - 22, titulo_reporte(tipo_reporte, hospital_nombre))
+    c.rect(MARGEN, y_columnas - ALTO_FILA, ancho_util, ALTO_FILA + 2, stroke=0, fill=1)
+    c.setFillColor(colors.whitesmoke)
+    c.setFont('Helvetica-Bold', TAMANO_FUENTE + 0.5)
+    for (encabezado, _, _), (x0, x1, alineacion, _) in zip(COLUMNAS_RAPIDO, geometria):
+        if alineacion == "derecha":
+            c.drawRightString(x1, y_columnas - ALTO_FILA + 3, encabezado)
+        else:
+            c.drawString(x0, y_columnas - ALTO_FILA + 3, encabezado)
+    c.setStrokeColor(colors.grey)
+    c.setLineWidth(0.5)
+    c.line(MARGEN, MARGEN, ancho_pagina - MARGEN, MARGEN)
+    c.setFillColor(colors.grey)
+    c.setFont('Helvetica', 6)
+    c.drawString(
+        MARGEN, MARGEN - 9,
+        f"Documento generado automáticamente por {settings.APP_NAME} v{settings.APP_VERSION}"
+        f" - {datetime.now().strftime('%d/%m/%Y %H:%M')} - {autor}"
+    )
+    c.endForm()
+
+    y_inicio = y_columnas - ALTO_FILA - 1
+    filas_por_pagina = int((y_inicio - MARGEN - 4) / ALTO_FILA)
+    pagina = 0
+    total_registros = 0
+    total_consumo = 0.0
+
+    def abrir_pagina():
+        nonlocal pagina
+        pagina += 1
+        c.doForm("marco")
+        c.setFillColor(colors.grey)
+        c.setFont('Helvetica', 6)
+        c.drawRightString(ancho_pagina - MARGEN, MARGEN - 9, f"Página {pagina}")
+
+    abrir_pagina()
+    if primera is None:
+        c.setFillColor(colors.black)
+        c.setFont('Helvetica', 9)
+        c.drawString(MARGEN, y_inicio - 16, "No hay datos para mostrar con los filtros seleccionados.")
+        c.showPage()
+        c.save()
+        return None if destino is not None else buffer.getvalue()
+
+    en_pagina = 0
+    for fila in itertools.chain([primera], filas):
+        if en_pagina == filas_por_pagina:
+            c.showPage()
+            abrir_pagina()
+            en_pagina = 0
+        y = y_inicio - en_pagina * ALTO_FILA
+        if en_pagina % 2:
+            c.setFillColor(COLOR_CEBRA)
+            c.rect(MARGEN, y - ALTO_FILA, ancho_util, ALTO_FILA, stroke=0, fill=1)
+        c.setFillColor(colors.black)
+        c.setFont('Helvetica', TAMANO_FUENTE)
+        for texto, (x0, x1, alineacion, caracteres) in zip(_celdas_fila(fila), geometria):
+            texto = texto if len(texto) <= caracteres else texto[:caracteres - 1] + "…"
+            if alineacion == "derecha":
+                c.drawRightString(x1, y - ALTO_FILA + 3, texto)
+            else:
+                c.drawString(x0, y - ALTO_FILA + 3, texto)
+        en_pagina += 1
+        total_registros += 1
+        total_consumo += fila[8] or 0
+
+    # Resumen al pie de la última página (o en una nueva si no entra)
+    if en_pagina + 4 > filas_por_pagina:
+        c.showPage()
+        abrir_pagina()
+        en_pagina = 0
+    y = y_inicio - (en_pagina + 1) * ALTO_FILA - 6
+    c.setFillColor(COLOR_PRIMARIO)
+    c.setFont('Helvetica-Bold', 9)
+    c.drawString(MARGEN, y, "RESUMEN")
+    c.setFillColor(colors.black)
+    c.setFont('Helvetica', 8)
+    c.drawString(MARGEN, y - 12, f"Total de registros: {total_registros}")
+    c.drawString(MARGEN, y - 24, f"Consumo total: {total_consumo:.2f}")
+    periodo = " - ".join(
+        f.strftime("%d/%m/%Y") for f in (filtros.fecha_inicio, filtros.fecha_fin) if f
+    )
+    if periodo:
+        c.drawString(MARGEN + 200, y - 12, f"Periodo: {periodo}")
+    c.showPage()
+    c.save()
+
+    return None if destino is not None else buffer.getvalue()
@@ -0,0 +1,147 @@
+"""
+Servicio de Tablas Dinámicas (Pivot)
+Sistema de Gases Medicinales MSPBS
+
+Calcula una tabla dinámica de consumo con dimensiones de filas y columnas en
+una sola consulta `GROUP BY GROUPING SETS`, que devuelve a la vez las celdas,
+los subtotales por fila y por columna y el total general.
+"""
+
+from typing import Dict, List, Tuple
+
+from sqlalchemy import Date, Float, cast, func, literal_column, select, true, tuple_
+from sqlalchemy.orm import Session
+
+from app.core.cache import CacheTTL, clave_cache
+from app.core.config import settings
+from app.models.models import Consumo, Gas, Hospital
+from app.schemas.schemas import FiltroReporte
+from app.services.consultas_service import aplicar_filtros
+
+
+DIMENSIONES_PIVOT = ("hospital", "departamento", "region_sanitaria", "gas", "modo_suministro", "mes")
+
+cache_pivot = CacheTTL(ttl=settings.PIVOT_CACHE_TTL)
+
+
+def _expresiones(dimensiones: List[str], meses) -> Dict[str, object]:
+    """Expresión SQL de cada dimensión pedida"""
+    disponibles = {
+        "hospital": Hospital.codigo,
+        "departamento": Hospital.departamento,
+        "region_sanitaria": Hospital.region_sanitaria,
+        "gas": Gas.nombre,
+        "modo_suministro": Consumo.modo_suministro,
+    }
+    if meses is not None:
+        disponibles["mes"] = func.to_char(meses.c.mes, "YYYY-MM")
+    return {d: disponibles[d] for d in dimensiones}
+
+
+def construir_consulta_pivot(filas: List[str], columnas: List[str], filtros: FiltroReporte):
+    """
+    Select con GROUPING SETS ((filas + columnas), (filas), (columnas), ()).
+    Con la dimensión `mes` cada consumo se reparte entre los meses que cubre,
+    en proporción a los días de cada mes.
+    """
+    dimensiones = filas + columnas
+    cantidad = Consumo.cantidad_normalizada
+    meses = None
+    if "mes" in dimensiones:
+        meses = func.generate_series(
+            func.date_trunc("month", Consumo.fecha_inicio),
+            func.date_trunc("month", Consumo.fecha_fin),
+            literal_column("interval '1 month'")
+        ).table_valued("mes").lateral("meses")
+        inicio_mes = cast(meses.c.mes, Date)
+        fin_mes = cast(meses.c.mes + literal_column("interval '1 month'"), Date) - 1
+        dias_en_mes = func.least(Consumo.fecha_fin, fin_mes) - func.greatest(Consumo.fecha_inicio, inicio_mes) + 1
+        duracion = Consumo.fecha_fin - Consumo.fecha_inicio + 1
+        cantidad = Consumo.cantidad_normalizada * cast(dias_en_mes, Float) / cast(duracion, Float)
+
+    expresiones = _expresiones(dimensiones, meses)
+    grupo = lambda nombres: tuple(expresiones[n] for n in nombres)
+    # Celdas, subtotales de fila, subtotales de columna y total (sin repetir)
+    conjuntos = list(dict.fromkeys([grupo(dimensiones), grupo(filas), grupo(columnas), ()]))
+
+    stmt = select(
+        *[expresion.label(nombre) for nombre, expresion in expresiones.items()],
+        *[func.grouping(expresion).label(f"g_{nombre}") for nombre, expresion in expresiones.items()],
+        func.sum(cantidad).label("total"),
+        func.count().label("registros")
+    ).select_from(Consumo).join(Hospital, Consumo.hospital_id == Hospital.id).join(
+        Gas, Consumo.gas_id == Gas.id
+    )
+    if meses is not None:
+        stmt = stmt.join(meses, true())
+    stmt = aplicar_filtros(stmt, filtros)
+    stmt = stmt.group_by(
+        func.grouping_sets(*[tuple_(*c) if c else literal_column("()") for c in conjuntos])
+    )
+    return stmt
+
+
+def calcular_pivot(
+    db: Session,
+    filas: List[str],
+    columnas: List[str],
+    filtros: FiltroReporte
+) -> dict:
+    """
+    Tabla dinámica de consumo. Resultado cacheado por parámetros durante
+    PIVOT_CACHE_TTL segundos.
+    """
+    clave = clave_cache("pivot", filas, columnas, filtros)
+    resultado = cache_pivot.obtener(clave)
+    if resultado is not None:
+        return resultado
+
+    stmt = construir_consulta_pivot(filas, columnas, filtros)
+    dimensiones = filas + columnas
+
+    celdas: Dict[Tuple, Dict[Tuple, dict]] = {}
+    subtotales_fila: Dict[Tuple, dict] = {}
+    subtotales_columna: Dict[Tuple, dict] = {}
+    total_general = {"total": 0.0, "registros": 0}
+
+    for registro in db.execute(stmt).mappings():
+        agrupado = {d: bool(registro[f"g_{d}"]) for d in dimensiones}
+        valor = {"total": round(float(registro["total"] or 0), 4), "registros": registro["registros"]}
+        clave_fila = tuple(registro[d] for d in filas)
+        clave_columna = tuple(registro[d] for d in columnas)
+        filas_agrupadas = all(agrupado[d] for d in filas)
+        columnas_agrupadas = all(agrupado[d] for d in columnas)
+
+        if filas_agrupadas and columnas_agrupadas:
+            total_general = valor
+        elif columnas_agrupadas:
+            subtotales_fila[clave_fila] = valor
+        elif filas_agrupadas:
+            subtotales_columna[clave_columna] = valor
+        else:
+            celdas.setdefault(clave_fila, {})[clave_columna] = valor
+
+    claves_columna = sorted(subtotales_columna, key=lambda c: tuple("" if v is None else str(v) for v in c))
+    claves_fila = sorted(subtotales_fila, key=lambda c: tuple("" if v is None else str(v) for v in c))
+
+    resultado = {
+        "dimensiones_filas": filas,
+        "dimensiones_columnas": columnas,
+        "columnas": [dict(zip(columnas, c)) for c in claves_columna],
+        "filas": [
+            {
+                "clave": dict(zip(filas, f)),
+                "valores": [
+                    celdas.get(f, {}).get(c, {}).get("total") for c in claves_columna
+                ] if columnas else [],
+                "subtotal": subtotales_fila[f]["total"],
+                "registros": subtotales_fila[f]["registros"]
+            }
+            for f in claves_fila
+        ],
+        "totales_columna": [subtotales_columna[c]["total"] for c in claves_columna],
+        "total_general": total_general["total"],
+        "registros": total_general["registros"]
+    }
+    cache_pivot.guardar(clave, resultado)
+    return resultado
@@ -0,0 +1,202 @@
+"""
+Servicio de Pronóstico de Demanda
+Sistema de Gases Medicinales MSPBS
+
+Arma una matriz (series × meses) con el consumo mensual de cada par
+hospital × gas y ajusta a todas las series a la vez dos modelos:
+suavizado exponencial simple (con alfa elegido por serie en una grilla) y
+estacional ingenuo (mismo mes del año anterior). Para cada serie se usa el
+modelo con menor error absoluto medio dentro de la muestra.
+"""
+
+from datetime import date, timedelta
+from typing import Optional, Tuple
+
+import numpy as np
+from sqlalchemy import delete, insert, text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.models import Consumo, Gas, Hospital, PronosticoConsumo
+from app.services.alertas_service import sumar_meses
+from app.services.prorrateo_service import cargar_intervalos, prorratear
+from app.services.tareas_service import TareaPeriodica
+
+
+ALFAS = np.linspace(0.05, 0.95, 19)
+TEMPORADA = 12
+Z_INTERVALO = 1.96  # Intervalo de ~95 % asumiendo errores normales
+
+# Clave arbitraria para pg_try_advisory_xact_lock: la tarea periódica y el
+# endpoint manual no reemplazan la tabla al mismo tiempo
+_LOCK_PRONOSTICOS = 340340
+
+
+def construir_matriz_mensual(
+    db: Session,
+    desde: date,
+    hasta: date
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Consumo mensual de cada par (hospital, gas) activo entre `desde` y `hasta`.
+
+    Retorna (pares, periodos, matriz): `pares` de forma (n_series, 2),
+    `periodos` datetime64[D] y `matriz` (n_series, n_meses) con NaN en los
+    meses sin registro. Los meses reportados parcialmente se escalan al mes
+    completo.
+    """
+    query = db.query(
+        Consumo.fecha_inicio, Consumo.fecha_fin, Consumo.cantidad_normalizada,
+        Consumo.hospital_id, Consumo.gas_id
+    ).join(Hospital, Consumo.hospital_id == Hospital.id).join(Gas, Consumo.gas_id == Gas.id).filter(
+        Hospital.estado == True,
+        Gas.estado == True,
+        Consumo.fecha_inicio <= hasta,
+        Consumo.fecha_fin >= desde
+    )
+    inicios, fines, cantidades, hospitales, gases = cargar_intervalos(query)
+    if len(inicios) == 0:
+        return np.zeros((0, 2), dtype=np.int64), np.array([], dtype="datetime64[D]"), np.zeros((0, 0))
+
+    pares, claves = np.unique(np.stack([hospitales, gases], axis=1), axis=0, return_inverse=True)
+    claves = claves.ravel()
+    periodos, cantidad_mes = prorratear(
+        inicios, fines, cantidades, "mes", desde, hasta, claves=claves, n_claves=len(pares)
+    )
+    _, dias_cubiertos = prorratear(
+        inicios, fines, (fines - inicios + 1).astype(np.float64), "mes",
+        desde, hasta, claves=claves, n_claves=len(pares)
+    )
+    meses = periodos.astype("datetime64[M]")
+    dias_mes = ((meses + 1).astype("datetime64[D]") - periodos).astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        matriz = np.where(dias_cubiertos > 0, cantidad_mes * dias_mes / dias_cubiertos, np.nan)
+    return pares, periodos, matriz
+
+
+def suavizado_exponencial(matriz: np.ndarray, alfas: np.ndarray = ALFAS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Suavizado exponencial simple para todas las series y todos los alfas a la
+    vez; los meses sin dato (NaN) mantienen el nivel. Retorna (nivel final,
+    MAE del pronóstico a un paso) con el mejor alfa de cada serie.
+    """
+    n_series, n_meses = matriz.shape
+    nivel = np.full((len(alfas), n_series), np.nan)
+    suma_errores = np.zeros((len(alfas), n_series))
+    n_errores = np.zeros(n_series)
+    alfas = alfas[:, None]
+
+    for t in range(n_meses):
+        valor = matriz[:, t]
+        observado = ~np.isnan(valor)
+        con_nivel = observado & ~np.isnan(nivel[0])
+        suma_errores[:, con_nivel] += np.abs(valor[con_nivel] - nivel[:, con_nivel])
+        n_errores += con_nivel
+        # El primer dato observado inicializa el nivel
+        nivel = np.where(
+            observado,
+            np.where(np.isnan(nivel), valor, alfas * valor + (1 - alfas) * nivel),
+            nivel
+        )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mae = suma_errores / n_errores
+    mejor = np.argmin(np.where(np.isnan(mae), np.inf, mae), axis=0)
+    columnas = np.arange(n_series)
+    return nivel[mejor, columnas], mae[mejor, columnas]
+
+
+def estacional_ingenuo(matriz: np.ndarray, horizonte: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pronóstico igual al mismo mes del año anterior. Retorna (pronósticos de
+    forma (n_series, horizonte) con NaN si falta el mes de referencia, MAE
+    dentro de la muestra o NaN si no hay dos temporadas).
+    """
+    n_series, n_meses = matriz.shape
+    pronostico = np.full((n_series, horizonte), np.nan)
+    mae = np.full(n_series, np.nan)
+    if n_meses < TEMPORADA:
+        return pronostico, mae
+
+    for h in range(horizonte):
+        indice = n_meses - TEMPORADA + (h % TEMPORADA)
+        pronostico[:, h] = matriz[:, indice]
+
+    if n_meses > TEMPORADA:
+        errores = np.abs(matriz[:, TEMPORADA:] - matriz[:, :-TEMPORADA])
+        n_errores = np.sum(~np.isnan(errores), axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mae = np.where(n_errores > 0, np.nansum(errores, axis=1) / n_errores, np.nan)
+    return pronostico, mae
+
+
+def generar_pronosticos(db: Session, hoy: Optional[date] = None) -> dict:
+    """
+    Recalcular los pronósticos de todas las series desde el último mes
+    completo y reemplazar la tabla en una sola transacción. Si otra
+    ejecución está en curso no hace nada.
+    """
+    if db.bind.dialect.name == "postgresql":
+        if not db.execute(text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": _LOCK_PRONOSTICOS}).scalar():
+            return {"omitido": "Otra generación de pronósticos está en curso"}
+
+    hoy = hoy or date.today()
+    horizonte = settings.PRONOSTICO_HORIZONTE
+    inicio_pronostico = sumar_meses(hoy, 0)
+    hasta = inicio_pronostico - timedelta(days=1)
+    desde = sumar_meses(inicio_pronostico, -settings.PRONOSTICO_MESES_HISTORIA)
+
+    pares, periodos, matriz = construir_matriz_mensual(db, desde, hasta)
+
+    filas = []
+    usados = {"suavizado_exponencial": 0, "estacional_ingenuo": 0}
+    if len(pares):
+        nivel, mae_ses = suavizado_exponencial(matriz)
+        estacional, mae_est = estacional_ingenuo(matriz, horizonte)
+
+        # Estacional solo si tiene error medido, menor, y todos los meses de referencia
+        usar_estacional = (
+            ~np.isnan(mae_est)
+            & (np.isnan(mae_ses) | (mae_est < mae_ses))
+            & ~np.isnan(estacional).any(axis=1)
+        )
+        pronostico = np.where(usar_estacional[:, None], estacional, nivel[:, None])
+        mae = np.where(usar_estacional, mae_est, mae_ses)
+        # 1.25 * MAE estima el desvío estándar; sin errores medidos (un solo
+        # mes de datos) el margen se basa en el propio nivel
+        margen = Z_INTERVALO * 1.25 * np.where(np.isnan(mae), np.abs(pronostico[:, 0]), mae)
+
+        # Se omiten series sin datos en el último año
+        validas = ~np.isnan(pronostico).any(axis=1) & ~np.isnan(matriz[:, -TEMPORADA:]).all(axis=1)
+        for i in np.flatnonzero(validas):
+            modelo = "estacional_ingenuo" if usar_estacional[i] else "suavizado_exponencial"
+            usados[modelo] += 1
+            for h in range(horizonte):
+                valor = max(float(pronostico[i, h]), 0.0)
+                filas.append({
+                    "hospital_id": int(pares[i, 0]),
+                    "gas_id": int(pares[i, 1]),
+                    "periodo": sumar_meses(inicio_pronostico, h),
+                    "cantidad": valor,
+                    "limite_inferior": max(valor - float(margen[i]), 0.0),
+                    "limite_superior": valor + float(margen[i]),
+                    "modelo": modelo,
+                    "error_medio": None if np.isnan(mae[i]) else float(mae[i])
+                })
+
+    db.execute(delete(PronosticoConsumo))
+    if filas:
+        db.execute(insert(PronosticoConsumo), filas)
+    db.commit()
+
+    return {
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "series": int(len(pares)),
+        "pronosticos": len(filas),
+        "modelos": usados
+    }
+
+
+# Instancia global
+tarea_pronosticos = TareaPeriodica("pronosticos", generar_pronosticos, settings.PRONOSTICO_INTERVALO)
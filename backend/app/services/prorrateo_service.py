@@ -0,0 +1,145 @@
+"""
+Servicio de Prorrateo de Consumos por Periodo
+Sistema de Gases Medicinales MSPBS
+
+Un consumo cubre el intervalo [fecha_inicio, fecha_fin]; su cantidad se reparte
+en partes iguales entre los días cubiertos y luego se agrega por día, semana
+(ISO, inicio lunes) o mes. Todo el cálculo se hace con NumPy sobre arreglos de
+días, sin bucles por registro.
+"""
+
+import numpy as np
+from datetime import date
+from typing import Iterable, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Query
+
+
+GRANULARIDADES = ("dia", "semana", "mes")
+
+
+def fechas_a_dias(fechas: Sequence[date]) -> np.ndarray:
+    """Convertir una secuencia de fechas a días desde 1970-01-01 (int64)"""
+    return np.array(fechas, dtype="datetime64[D]").astype(np.int64)
+
+
+def dias_a_periodo(dias: np.ndarray, granularidad: str) -> np.ndarray:
+    """
+    Convertir días (int64) al día de inicio de su periodo (int64)
+    """
+    if granularidad == "dia":
+        return dias
+    if granularidad == "semana":
+        # 1970-01-01 fue jueves: desplazar 3 días para que la semana empiece en lunes
+        return dias - (dias + 3) % 7
+    if granularidad == "mes":
+        meses = dias.astype("datetime64[D]").astype("datetime64[M]")
+        return meses.astype("datetime64[D]").astype(np.int64)
+    raise ValueError(f"Granularidad inválida: {granularidad}")
+
+
+def prorratear(
+    inicios: np.ndarray,
+    fines: np.ndarray,
+    cantidades: np.ndarray,
+    granularidad: str = "mes",
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+    claves: Optional[np.ndarray] = None,
+    n_claves: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Repartir cada cantidad entre los días de su intervalo y agregar por periodo.
+
+    `inicios` y `fines` son días (int64, ver `fechas_a_dias`), ambos inclusive.
+    Si se pasan `claves` (enteros 0..n_claves-1) el resultado se separa por
+    clave, p. ej. una serie por gas u hospital.
+
+    Retorna (periodos, totales): `periodos` es un arreglo datetime64[D] con el
+    inicio de cada periodo y `totales` tiene forma (n_periodos,) sin claves o
+    (n_claves, n_periodos) con claves.
+    """
+    if granularidad not in GRANULARIDADES:
+        raise ValueError(f"Granularidad inválida: {granularidad}")
+
+    con_claves = claves is not None
+    inicios = np.asarray(inicios, dtype=np.int64)
+    fines = np.asarray(fines, dtype=np.int64)
+    cantidades = np.asarray(cantidades, dtype=np.float64)
+    if con_claves:
+        claves = np.asarray(claves, dtype=np.int64)
+        n_series = int(n_claves) if n_claves is not None else int(claves.max(initial=-1)) + 1
+    else:
+        claves = np.zeros(len(inicios), dtype=np.int64)
+        n_series = 1
+
+    # Cantidad diaria calculada sobre el intervalo completo, antes de recortar
+    duracion = np.maximum(fines - inicios + 1, 1)
+    por_dia = cantidades / duracion
+
+    # Recortar a la ventana solicitada
+    if desde is not None:
+        inicios = np.maximum(inicios, fechas_a_dias([desde])[0])
+    if hasta is not None:
+        fines = np.minimum(fines, fechas_a_dias([hasta])[0])
+    validos = fines >= inicios
+    inicios, fines, por_dia, claves = inicios[validos], fines[validos], por_dia[validos], claves[validos]
+
+    # Rango de días: la ventana si está completa, si no el de los datos
+    if (desde is None or hasta is None) and len(inicios) == 0:
+        n_dias = 0
+    else:
+        dia_min = fechas_a_dias([desde])[0] if desde is not None else inicios.min()
+        dia_max = fechas_a_dias([hasta])[0] if hasta is not None else fines.max()
+        n_dias = int(dia_max - dia_min + 1)
+
+    if n_dias <= 0:
+        periodos = np.array([], dtype="datetime64[D]")
+        return periodos, np.zeros((n_series, 0)) if con_claves else np.zeros(0)
+
+    # Arreglo de diferencias: +tasa al inicio, -tasa al día siguiente al fin
+    ancho = n_dias + 1
+    diferencias = np.bincount(
+        np.concatenate([claves * ancho + (inicios - dia_min), claves * ancho + (fines + 1 - dia_min)]),
+        weights=np.concatenate([por_dia, -por_dia]),
+        minlength=n_series * ancho
+    ).reshape(n_series, ancho)
+    diarios = np.cumsum(diferencias[:, :n_dias], axis=1)
+
+    # Agregar días consecutivos del mismo periodo
+    inicio_periodo = dias_a_periodo(np.arange(dia_min, dia_max + 1, dtype=np.int64), granularidad)
+    cortes = np.flatnonzero(np.r_[True, np.diff(inicio_periodo) != 0])
+    totales = np.add.reduceat(diarios, cortes, axis=1)
+
+    # Eliminar el ruido de punto flotante acumulado por cumsum
+    totales[np.abs(totales) < 1e-9] = 0.0
+
+    periodos = inicio_periodo[cortes].astype("datetime64[D]")
+    return periodos, totales if con_claves else totales[0]
+
+
+def cargar_intervalos(query: Query) -> Tuple[np.ndarray, ...]:
+    """
+    Ejecutar una query que retorna (fecha_inicio, fecha_fin, cantidad, *extras)
+    y convertir cada columna a un arreglo para `prorratear`.
+    Las columnas extra (p. ej. ids para usar como claves) se retornan como int64.
+    Las cantidades nulas (consumos sin unidad convertible) cuentan como 0.
+    """
+    filas = query.all()
+    n_extras = len(query.column_descriptions) - 3
+    if not filas:
+        vacio = np.zeros(0, dtype=np.int64)
+        return (vacio, vacio, np.zeros(0)) + tuple(vacio for _ in range(n_extras))
+    columnas = list(zip(*filas))
+    return (
+        fechas_a_dias(columnas[0]),
+        fechas_a_dias(columnas[1]),
+        np.nan_to_num(np.array(columnas[2], dtype=np.float64))
+    ) + tuple(np.array(c, dtype=np.int64) for c in columnas[3:])
+
+
+def formatear_periodos(periodos: Iterable[np.datetime64], granularidad: str) -> list:
+    """Etiquetas ISO para los periodos (YYYY-MM para meses, YYYY-MM-DD en otro caso)"""
+    if granularidad == "mes":
+        return [str(p)[:7] for p in periodos]
+    return [str(p) for p in periodos]
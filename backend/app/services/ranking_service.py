@@ -0,0 +1,155 @@
+"""
+Servicio de Ranking entre Pares
+Sistema de Gases Medicinales MSPBS
+
+Ubica a cada hospital entre sus pares (mismo nivel de atención, tipo y región
+sanitaria) para cada gas: posición, percentil y distancia a la mediana del
+grupo. Los totales del periodo se prorratean por días y el ranking de todos
+los grupos se calcula en una sola pasada vectorizada con NumPy.
+"""
+
+from datetime import date
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.core.cache import CacheTTL, clave_cache
+from app.core.config import settings
+from app.models.models import Consumo, Gas, Hospital
+from app.services.prorrateo_service import cargar_intervalos, prorratear
+
+
+cache_ranking = CacheTTL(ttl=settings.RANKING_CACHE_TTL)
+
+
+def rankear_grupos(grupos: np.ndarray, totales: np.ndarray) -> dict:
+    """
+    Ranking dentro de cada grupo (enteros 0..n-1), de mayor a menor total.
+
+    Retorna arreglos alineados con la entrada: `posicion` (1 = mayor consumo,
+    empates comparten posición), `pares` (tamaño del grupo), `percentil`
+    (porcentaje de pares con consumo estrictamente menor, NaN en grupos de un
+    solo hospital) y `mediana` del grupo.
+    """
+    n = len(totales)
+    orden = np.lexsort((-totales, grupos))
+    grupos_ord = grupos[orden]
+    totales_ord = totales[orden]
+    indices = np.arange(n)
+
+    nuevo_grupo = np.r_[True, grupos_ord[1:] != grupos_ord[:-1]]
+    inicio_grupo = np.maximum.accumulate(np.where(nuevo_grupo, indices, 0))
+    tamanos = np.bincount(grupos_ord, minlength=grupos.max(initial=-1) + 1)
+    pares = tamanos[grupos_ord]
+
+    # Primer y último índice de cada bloque de empates
+    nuevo_valor = nuevo_grupo | np.r_[True, totales_ord[1:] != totales_ord[:-1]]
+    primer_empate = np.maximum.accumulate(np.where(nuevo_valor, indices, 0))
+    fin_valor = np.r_[nuevo_valor[1:], True]
+    ultimo_empate = np.minimum.accumulate(np.where(fin_valor, indices, n)[::-1])[::-1]
+
+    posicion = primer_empate - inicio_grupo + 1
+    menores = inicio_grupo + pares - 1 - ultimo_empate
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percentil = np.where(pares > 1, 100.0 * menores / (pares - 1), np.nan)
+
+    # Mediana: promedio de los elementos centrales del grupo ordenado
+    centro_bajo = totales_ord[inicio_grupo + (pares - 1) // 2]
+    centro_alto = totales_ord[inicio_grupo + pares // 2]
+    mediana = (centro_bajo + centro_alto) / 2
+
+    resultado = {}
+    for nombre, valores in (
+        ("posicion", posicion), ("pares", pares), ("percentil", percentil), ("mediana", mediana)
+    ):
+        alineado = np.empty_like(valores)
+        alineado[orden] = valores
+        resultado[nombre] = alineado
+    return resultado
+
+
+def calcular_ranking_pares(
+    db: Session,
+    desde: date,
+    hasta: date,
+    gas_id: Optional[int] = None
+) -> List[dict]:
+    """
+    Ranking de todos los hospitales activos con consumo en el periodo, por gas
+    y grupo de pares. Cacheado por (periodo, gas) durante RANKING_CACHE_TTL.
+    """
+    clave = clave_cache("ranking_pares", desde, hasta, gas_id)
+    resultado = cache_ranking.obtener(clave)
+    if resultado is not None:
+        return resultado
+
+    query = db.query(
+        Consumo.fecha_inicio, Consumo.fecha_fin, Consumo.cantidad_normalizada,
+        Consumo.hospital_id, Consumo.gas_id
+    ).join(Hospital, Consumo.hospital_id == Hospital.id).filter(
+        Hospital.estado == True,
+        Consumo.fecha_inicio <= hasta,
+        Consumo.fecha_fin >= desde
+    )
+    if gas_id:
+        query = query.filter(Consumo.gas_id == gas_id)
+    inicios, fines, cantidades, hospitales_ids, gases_ids = cargar_intervalos(query)
+    if len(cantidades) == 0:
+        cache_ranking.guardar(clave, [])
+        return []
+
+    # Total del periodo por par (hospital, gas)
+    pares_hg, claves = np.unique(np.stack([hospitales_ids, gases_ids], axis=1), axis=0, return_inverse=True)
+    claves = claves.reshape(-1)
+    _, por_mes = prorratear(inicios, fines, cantidades, "mes", desde, hasta, claves, len(pares_hg))
+    totales = por_mes.sum(axis=1)
+    con_consumo = totales > 0
+    pares_hg, totales = pares_hg[con_consumo], totales[con_consumo]
+
+    # Grupo de pares: gas + (nivel_atencion, tipo, region_sanitaria)
+    hospitales = {
+        h.id: h for h in db.query(
+            Hospital.id, Hospital.nombre, Hospital.codigo,
+            Hospital.nivel_atencion, Hospital.tipo, Hospital.region_sanitaria
+        ).filter(Hospital.id.in_(np.unique(pares_hg[:, 0]).tolist()))
+    }
+    gases = dict(db.query(Gas.id, Gas.nombre).all())
+    perfiles = {}
+    perfil_por_hospital = {
+        h.id: perfiles.setdefault((h.nivel_atencion, h.tipo, h.region_sanitaria), len(perfiles))
+        for h in hospitales.values()
+    }
+    perfil = np.array([perfil_por_hospital[int(h)] for h in pares_hg[:, 0]], dtype=np.int64)
+    _, grupos = np.unique(np.stack([pares_hg[:, 1], perfil], axis=1), axis=0, return_inverse=True)
+
+    ranking = rankear_grupos(grupos.reshape(-1), totales)
+
+    resultado = []
+    for i, (hospital_id, gas) in enumerate(pares_hg.tolist()):
+        hospital = hospitales[hospital_id]
+        mediana = float(ranking["mediana"][i])
+        distancia = float(totales[i]) - mediana
+        percentil = float(ranking["percentil"][i])
+        resultado.append({
+            "hospital_id": hospital_id,
+            "hospital_nombre": hospital.nombre,
+            "hospital_codigo": hospital.codigo,
+            "nivel_atencion": hospital.nivel_atencion,
+            "tipo": hospital.tipo,
+            "region_sanitaria": hospital.region_sanitaria,
+            "gas_id": gas,
+            "gas_nombre": gases.get(gas),
+            "total": round(float(totales[i]), 4),
+            "posicion": int(ranking["posicion"][i]),
+            "pares": int(ranking["pares"][i]),
+            "percentil": None if np.isnan(percentil) else round(percentil, 2),
+            "mediana_pares": round(mediana, 4),
+            "distancia_mediana": round(distancia, 4),
+            "distancia_mediana_pct": round(100.0 * distancia / mediana, 2) if mediana > 0 else None
+        })
+
+    resultado.sort(key=lambda r: (r["gas_id"], r["nivel_atencion"] or "", r["tipo"],
+                                  r["region_sanitaria"] or "", r["posicion"]))
+    cache_ranking.guardar(clave, resultado)
+    return resultado
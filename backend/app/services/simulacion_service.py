@@ -0,0 +1,154 @@
+"""
+Servicio de Simulación de Demanda de Oxígeno
+Sistema de Gases Medicinales MSPBS
+
+Simulación Monte Carlo de un aumento de demanda (p. ej. un brote
+respiratorio) por región sanitaria. La línea base de cada hospital sale de su
+historia mensual; cada escenario combina un shock regional común a los
+hospitales de la región con la variabilidad propia de cada hospital. Todos
+los escenarios se calculan como matrices NumPy, por bloques para acotar la
+memoria, y la simulación corre en el pool de procesos.
+"""
+
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.models.models import Gas, Hospital
+from app.services.alertas_service import sumar_meses
+from app.services.pronostico_service import TEMPORADA, construir_matriz_mensual
+
+
+SIN_REGION = "Sin región"
+TAMANO_BLOQUE = 5_000  # Escenarios por bloque
+
+
+def cargar_linea_base(db: Session, gas_id: int, hoy: Optional[date] = None) -> dict:
+    """
+    Consumo mensual base y variabilidad de cada hospital para un gas, a partir
+    de los últimos 12 meses completos. Retorna solo tipos simples y arreglos
+    para poder enviarlos a otro proceso.
+    """
+    hoy = hoy or date.today()
+    inicio_mes = sumar_meses(hoy, 0)
+    pares, _, matriz = construir_matriz_mensual(
+        db, sumar_meses(inicio_mes, -TEMPORADA), inicio_mes - timedelta(days=1)
+    )
+    del_gas = pares[:, 1] == gas_id if len(pares) else np.zeros(0, dtype=bool)
+    hospital_ids, matriz = pares[del_gas, 0], matriz[del_gas]
+
+    meses_con_datos = np.sum(~np.isnan(matriz), axis=1)
+    hospital_ids, matriz = hospital_ids[meses_con_datos > 0], matriz[meses_con_datos > 0]
+    base = np.nanmean(matriz, axis=1)
+    # Coeficiente de variación mensual (0 con un solo mes de datos)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cv = np.where(base > 0, np.nanstd(matriz, axis=1) / base, 0.0)
+
+    regiones_hospital = dict(
+        db.query(Hospital.id, Hospital.region_sanitaria).filter(Hospital.id.in_(hospital_ids.tolist())).all()
+    )
+    etiquetas = [regiones_hospital.get(int(h)) or SIN_REGION for h in hospital_ids]
+    regiones = sorted(set(etiquetas))
+    indice_region = {r: i for i, r in enumerate(regiones)}
+
+    return {
+        "hospital_ids": hospital_ids,
+        "base": base,
+        "cv": cv,
+        "region": np.array([indice_region[e] for e in etiquetas], dtype=np.int64),
+        "regiones": regiones
+    }
+
+
+def simular_demanda(
+    base: np.ndarray,
+    cv: np.ndarray,
+    region: np.ndarray,
+    aumentos_region: np.ndarray,
+    incertidumbre: float,
+    escenarios: int,
+    percentiles: List[float],
+    semilla: Optional[int] = None
+) -> dict:
+    """
+    Simular la demanda mensual total por región en `escenarios` escenarios.
+
+    Demanda de un hospital = base × max(1 + aumento × I, 0) × R, donde I es la
+    intensidad del shock de su región (lognormal de media 1 y coeficiente de
+    variación `incertidumbre`, común a la región en cada escenario) y R es el
+    ruido propio del hospital (lognormal de media 1 y coeficiente de variación
+    igual al histórico). Retorna percentiles (n_regiones, n_percentiles) y
+    media por región, y los mismos valores para el total nacional.
+    """
+    rng = np.random.default_rng(semilla)
+    n_regiones = len(aumentos_region)
+    n_hospitales = len(base)
+
+    # Matriz de pertenencia hospital -> región para sumar por región con un producto
+    pertenencia = np.zeros((n_hospitales, n_regiones))
+    pertenencia[np.arange(n_hospitales), region] = 1.0
+
+    sigma_region = np.sqrt(np.log1p(incertidumbre ** 2))
+    sigma_hospital = np.sqrt(np.log1p(cv ** 2))
+
+    totales_region = np.empty((escenarios, n_regiones))
+    for inicio in range(0, escenarios, TAMANO_BLOQUE):
+        n = min(TAMANO_BLOQUE, escenarios - inicio)
+        intensidad = rng.lognormal(-sigma_region ** 2 / 2, sigma_region, size=(n, n_regiones))
+        # Una reducción amplificada por el shock no baja la demanda de cero
+        factor_region = np.maximum(1.0 + aumentos_region * intensidad, 0.0)
+        ruido = rng.lognormal(-sigma_hospital ** 2 / 2, sigma_hospital, size=(n, n_hospitales))
+        demanda = base * factor_region[:, region] * ruido
+        totales_region[inicio:inicio + n] = demanda @ pertenencia
+
+    total_nacional = totales_region.sum(axis=1)
+    return {
+        "percentiles_region": np.percentile(totales_region, percentiles, axis=0).T,
+        "media_region": totales_region.mean(axis=0),
+        "percentiles_total": np.percentile(total_nacional, percentiles),
+        "media_total": float(total_nacional.mean())
+    }
+
+
+def armar_resultado(
+    linea_base: dict,
+    simulacion: dict,
+    aumentos: Dict[str, float],
+    aumento_general: float,
+    percentiles: List[float],
+    gas: Gas,
+    escenarios: int
+) -> dict:
+    """Respuesta de la API a partir de la línea base y la simulación"""
+    etiquetas = [f"p{p:g}" for p in percentiles]
+    base_region = np.bincount(
+        linea_base["region"], weights=linea_base["base"], minlength=len(linea_base["regiones"])
+    )
+    regiones = []
+    for i, nombre in enumerate(linea_base["regiones"]):
+        regiones.append({
+            "region_sanitaria": nombre,
+            "hospitales": int(np.sum(linea_base["region"] == i)),
+            "aumento_pct": aumentos.get(nombre, aumento_general),
+            "base_mensual": round(float(base_region[i]), 4),
+            "media": round(float(simulacion["media_region"][i]), 4),
+            "percentiles": {
+                e: round(float(v), 4) for e, v in zip(etiquetas, simulacion["percentiles_region"][i])
+            }
+        })
+    return {
+        "gas_id": gas.id,
+        "gas_nombre": gas.nombre,
+        "unidad": gas.unidad_base,
+        "escenarios": escenarios,
+        "regiones": regiones,
+        "total": {
+            "base_mensual": round(float(base_region.sum()), 4),
+            "media": round(simulacion["media_total"], 4),
+            "percentiles": {
+                e: round(float(v), 4) for e, v in zip(etiquetas, simulacion["percentiles_total"])
+            }
+        }
+    }
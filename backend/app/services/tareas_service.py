@@ -0,0 +1,67 @@
+"""
+Servicio de Tareas Periódicas
+Ejecuta trabajos de base de datos en segundo plano
+Sistema de Gases Medicinales MSPBS
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Any, Callable
+
+from sqlalchemy.orm import Session
+
+from app.core.database import SessionLocal
+
+
+class TareaPeriodica:
+    """
+    Ejecuta una función sincrónica `funcion(db)` cada `intervalo` segundos.
+    Cada ejecución corre en un hilo aparte con su propia sesión, para no
+    bloquear el event loop.
+    """
+
+    def __init__(self, nombre: str, funcion: Callable[[Session], Any], intervalo: int):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.intervalo = intervalo
+        self.running = False
+        self.task = None
+
+    def ejecutar_una_vez(self) -> Any:
+        """Ejecutar la tarea con una sesión nueva"""
+        db = SessionLocal()
+        try:
+            return self.funcion(db)
+        finally:
+            db.close()
+
+    async def run(self):
+        """Ejecutar la tarea en bucle"""
+        self.running = True
+        print(f"Tarea {self.nombre} iniciada - Intervalo: {self.intervalo} segundos")
+
+        while self.running:
+            try:
+                resultado = await asyncio.to_thread(self.ejecutar_una_vez)
+                # Las tareas de sondeo retornan 0 cuando no hubo nada que hacer
+                if resultado != 0:
+                    print(f"[{datetime.now()}] Tarea {self.nombre} completada: {resultado}")
+            except Exception as e:
+                print(f"[{datetime.now()}] Error en tarea {self.nombre}: {e}")
+            await asyncio.sleep(self.intervalo)
+
+    async def start(self):
+        """Iniciar la tarea en background"""
+        if not self.task:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Detener la tarea"""
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
@@ -0,0 +1,151 @@
+"""
+Servicio de Conversión de Unidades
+Sistema de Gases Medicinales MSPBS
+
+`Consumo.unidad_medida` es texto libre y `Gas.unidad_base` es la unidad
+canónica del gas. Cada consumo guarda además `cantidad_normalizada`, la
+cantidad expresada en la unidad base, calculada al escribir; así todos los
+agregados son un SUM simple sobre una sola columna.
+
+Los volúmenes se refieren a gas a 15 °C y 1 atm. Entre volumen y masa se
+convierte con la densidad del gas, si está registrada para su código.
+"""
+
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func
+from sqlalchemy.orm import Session
+
+from app.models.models import Consumo, Gas
+from app.services.versiones_service import incrementar_version
+
+
+class UnidadNoConvertible(ValueError):
+    """La unidad de un consumo no puede llevarse a la unidad base del gas"""
+
+
+# Unidad canónica -> (magnitud, factor a la unidad SI de la magnitud)
+UNIDADES: Dict[str, Tuple[str, float]] = {
+    "m³": ("volumen", 1.0),
+    "L": ("volumen", 0.001),
+    "mL": ("volumen", 0.000001),
+    "kg": ("masa", 1.0),
+    "g": ("masa", 0.001),
+    "t": ("masa", 1000.0),
+    "lb": ("masa", 0.45359237),
+}
+
+# Escrituras habituales (en minúsculas, sin tildes ni puntos) -> unidad canónica
+SINONIMOS: Dict[str, str] = {
+    "m3": "m³", "m^3": "m³", "mt3": "m³", "mts3": "m³",
+    "metro cubico": "m³", "metros cubicos": "m³",
+    "l": "L", "lt": "L", "lts": "L", "litro": "L", "litros": "L",
+    "ml": "mL", "mililitro": "mL", "mililitros": "mL",
+    "kg": "kg", "kgs": "kg", "kilo": "kg", "kilos": "kg",
+    "kilogramo": "kg", "kilogramos": "kg",
+    "g": "g", "gr": "g", "grs": "g", "gramo": "g", "gramos": "g",
+    "t": "t", "tn": "t", "ton": "t", "tonelada": "t", "toneladas": "t",
+    "lb": "lb", "lbs": "lb", "libra": "lb", "libras": "lb",
+}
+
+# Densidad en kg/m³ (15 °C, 1 atm) por código de gas
+DENSIDADES: Dict[str, float] = {
+    "O2": 1.354,
+    "AIR": 1.225,
+    "N2O": 1.875,
+    "CO2": 1.872,
+    "AR": 1.690,
+}
+
+
+def normalizar_unidad(texto: Optional[str]) -> Optional[str]:
+    """Unidad canónica para un texto libre, o None si no se reconoce"""
+    if not texto:
+        return None
+    limpio = texto.strip()
+    if limpio in UNIDADES:
+        return limpio
+    limpio = unicodedata.normalize("NFKD", limpio.replace("³", "3"))
+    limpio = "".join(c for c in limpio if not unicodedata.combining(c))
+    limpio = " ".join(limpio.lower().replace(".", "").split())
+    return SINONIMOS.get(limpio)
+
+
+def factor_conversion(unidad_medida: str, unidad_base: str, codigo_gas: Optional[str] = None) -> float:
+    """
+    Factor por el que se multiplica una cantidad en `unidad_medida` para
+    expresarla en `unidad_base`. Lanza UnidadNoConvertible si no hay conversión.
+    """
+    origen = normalizar_unidad(unidad_medida)
+    destino = normalizar_unidad(unidad_base)
+    if origen is None or destino is None:
+        # Unidades fuera del registro: solo se acepta la misma unidad
+        if unidad_medida.strip().lower() == unidad_base.strip().lower():
+            return 1.0
+        raise UnidadNoConvertible(
+            f"Unidad '{unidad_medida}' no reconocida para la unidad base '{unidad_base}'"
+        )
+
+    magnitud_origen, factor_origen = UNIDADES[origen]
+    magnitud_destino, factor_destino = UNIDADES[destino]
+    if magnitud_origen == magnitud_destino:
+        return factor_origen / factor_destino
+
+    densidad = DENSIDADES.get(codigo_gas or "")
+    if densidad is None:
+        raise UnidadNoConvertible(
+            f"No se puede convertir '{unidad_medida}' a '{unidad_base}' sin la densidad del gas"
+        )
+    if magnitud_origen == "volumen":
+        return factor_origen * densidad / factor_destino
+    return factor_origen / densidad / factor_destino
+
+
+def normalizar_cantidad(cantidad: float, unidad_medida: str, gas: Gas) -> float:
+    """Cantidad expresada en la unidad base del gas"""
+    return cantidad * factor_conversion(unidad_medida, gas.unidad_base, gas.codigo)
+
+
+def recalcular_cantidades_normalizadas(
+    db: Session,
+    gas_id: Optional[int] = None
+) -> dict:
+    """
+    Recalcular `cantidad_normalizada` con un UPDATE por combinación
+    (gas, unidad_medida). Las combinaciones sin conversión quedan en NULL y
+    se informan. No hace commit.
+    """
+    query = db.query(Consumo.gas_id, Consumo.unidad_medida, Gas.unidad_base, Gas.codigo).join(
+        Gas, Consumo.gas_id == Gas.id
+    ).distinct()
+    if gas_id is not None:
+        query = query.filter(Consumo.gas_id == gas_id)
+
+    actualizados = 0
+    sin_conversion: List[dict] = []
+    for gas, unidad_medida, unidad_base, codigo in query.all():
+        filtro = and_(Consumo.gas_id == gas, Consumo.unidad_medida == unidad_medida)
+        try:
+            factor = factor_conversion(unidad_medida, unidad_base, codigo)
+            valor = Consumo.cantidad * factor
+        except UnidadNoConvertible:
+            valor = None
+            sin_conversion.append({"gas_id": gas, "unidad_medida": unidad_medida})
+        actualizados += db.query(Consumo).filter(filtro).update(
+            {Consumo.cantidad_normalizada: valor}, synchronize_session=False
+        )
+
+    if actualizados:
+        incrementar_version(db, "consumos")
+    return {"actualizados": actualizados, "sin_conversion": sin_conversion}
+
+
+def backfill_cantidades_normalizadas(db: Session) -> dict:
+    """Tarea de migración: completar `cantidad_normalizada` en consumos existentes"""
+    resultado = recalcular_cantidades_normalizadas(db)
+    db.commit()
+    resultado["pendientes"] = db.query(func.count(Consumo.id)).filter(
+        Consumo.cantidad_normalizada.is_(None)
+    ).scalar()
+    return resultado
@@ -0,0 +1,35 @@
+"""
+Servicio de Versiones de Tablas
+Sistema de Gases Medicinales MSPBS
+
+Cada tabla consultada por endpoints cacheables tiene un contador que las
+escrituras incrementan dentro de su misma transacción. Los endpoints de
+lectura derivan su ETag de estos contadores sin ejecutar la consulta.
+"""
+
+from typing import Dict, Iterable
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.models.models import VersionTabla
+
+
+def incrementar_version(db: Session, *tablas: str):
+    """Incrementar el contador de las tablas dadas (sin commit)"""
+    for tabla in tablas:
+        stmt = pg_insert(VersionTabla).values(tabla=tabla, version=1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["tabla"],
+            set_={"version": VersionTabla.version + 1}
+        )
+        db.execute(stmt)
+
+
+def obtener_versiones(db: Session, tablas: Iterable[str]) -> Dict[str, int]:
+    """Versión actual de cada tabla (0 si nunca se escribió)"""
+    tablas = list(tablas)
+    versiones = dict(
+        db.query(VersionTabla.tabla, VersionTabla.version).filter(VersionTabla.tabla.in_(tablas)).all()
+    )
+    return {tabla: versiones.get(tabla, 0) for tabla in tablas}
@@ -6,14 +6,18 @@ DGGIES - Ministerio de Salud y Bienestar Social - Paraguay
 
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from contextlib import asynccontextmanager
 import time
 
 from app.core.config import settings
 from app.core.database import init_db
-from app.api import auth, usuarios, hospitales, gases_consumos, reportes
+from app.core.procesos import cerrar_pool
+from app.api import auth, usuarios, hospitales, gases_consumos, reportes, alertas, planificacion
 from app.services.keep_alive_service import keep_alive_service
+from app.services.alertas_service import detector_alertas
+from app.services.pronostico_service import tarea_pronosticos
+from app.services.cola_exportacion_service import worker_exportaciones
 
 
 # Lifespan para inicialización y limpieza
@@ -34,6 +38,18 @@ async def lifespan(app: FastAPI):
         await keep_alive_service.start()
         print("Servicio Keep-Alive iniciado")
     
+    # Iniciar detector de alertas programado
+    if settings.ALERTAS_INTERVALO > 0:
+        await detector_alertas.start()
+    
+    # Iniciar pronósticos de demanda programados
+    if settings.PRONOSTICO_INTERVALO > 0:
+        await tarea_pronosticos.start()
+    
+    # Iniciar worker interno de exportaciones en segundo plano
+    if settings.EXPORTACION_SONDEO > 0:
+        await worker_exportaciones.start()
+    
     yield
     
     # Shutdown
@@ -43,6 +59,14 @@ async def lifespan(app: FastAPI):
     if settings.KEEP_ALIVE_URL:
         await keep_alive_service.stop()
         print("Servicio Keep-Alive detenido")
+    
+    # Detener tareas programadas
+    await detector_alertas.stop()
+    await tarea_pronosticos.stop()
+    await worker_exportaciones.stop()
+    
+    # Cerrar pool de procesos
+    cerrar_pool()
 
 
 # Crear aplicación
@@ -50,6 +74,7 @@ app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
     description=f"{settings.ORGANIZACION} - {settings.PAIS}",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -125,7 +150,9 @@ async def api_info():
             "hospitales": "/api/hospitales",
             "gases": "/api/gases",
             "consumos": "/api/consumos",
-            "reportes": "/api/reportes"
+            "reportes": "/api/reportes",
+            "alertas": "/api/alertas",
+            "planificacion": "/api/planificacion"
         }
     }
 
@@ -137,6 +164,8 @@ app.include_router(hospitales.router, prefix="/api")
 app.include_router(gases_consumos.router_gases, prefix="/api")
 app.include_router(gases_consumos.router_consumos, prefix="/api")
 app.include_router(reportes.router, prefix="/api")
+app.include_router(alertas.router, prefix="/api")
+app.include_router(planificacion.router, prefix="/api")
 
 
 # Endpoint adicional para auditoría
@@ -0,0 +1,97 @@
+"""
+Benchmark de Serialización del Listado de Consumos
+Compara el camino ORM + Pydantic + json con el de tuplas Core + orjson,
+con todos los campos y con campos dispersos, sobre páginas reales de la
+base configurada.
+Sistema de Gases Medicinales MSPBS
+
+Uso: python scripts/benchmark_serializacion.py [--limite 100] [--paginas 20] [--repeticiones 5]
+"""
+
+import sys
+import os
+import argparse
+import json
+import time
+
+# Añadir el directorio raíz al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import joinedload
+
+from app.core.database import SessionLocal
+from app.models.models import Consumo
+from app.schemas.schemas import ConsumoResponse
+from app.services.consultas_service import resolver_campos, select_consumos_respuesta, serializar_consumos
+
+
+def camino_orm(db, skip: int, limite: int) -> bytes:
+    """Camino original: objetos ORM validados con Pydantic y json de la stdlib"""
+    consumos = db.query(Consumo).options(
+        joinedload(Consumo.hospital), joinedload(Consumo.gas)
+    ).order_by(Consumo.created_at.desc()).offset(skip).limit(limite).all()
+    validados = [ConsumoResponse.model_validate(c) for c in consumos]
+    return json.dumps(jsonable_encoder(validados)).encode()
+
+
+def camino_core(db, skip: int, limite: int) -> bytes:
+    """Camino rápido: tuplas Core armadas como dicts y orjson"""
+    stmt = select_consumos_respuesta().order_by(Consumo.created_at.desc()).offset(skip).limit(limite)
+    return orjson.dumps(serializar_consumos(db.execute(stmt).all()))
+
+
+CAMPOS_LISTADO = resolver_campos("id,fecha_inicio,fecha_fin,cantidad,hospital.codigo")
+
+
+def camino_campos(db, skip: int, limite: int) -> bytes:
+    """Camino con campos dispersos: fields=id,fecha_inicio,fecha_fin,cantidad,hospital.codigo"""
+    stmt = select_consumos_respuesta(CAMPOS_LISTADO).order_by(Consumo.created_at.desc()).offset(skip).limit(limite)
+    return orjson.dumps(serializar_consumos(db.execute(stmt).all(), CAMPOS_LISTADO))
+
+
+def medir(nombre: str, funcion, db, limite: int, paginas: int, repeticiones: int) -> float:
+    """Mejor tiempo por página (ms) entre las repeticiones"""
+    mejores = []
+    for _ in range(repeticiones):
+        db.expunge_all()
+        inicio = time.perf_counter()
+        tamano = 0
+        for pagina in range(paginas):
+            tamano += len(funcion(db, pagina * limite, limite))
+        mejores.append((time.perf_counter() - inicio) / paginas * 1000)
+    mejor = min(mejores)
+    print(f"{nombre:<28} {mejor:8.2f} ms/página  ({tamano / paginas / 1024:.1f} KiB/página)")
+    return mejor
+
+
+def main():
+    """Función principal del benchmark"""
+    parser = argparse.ArgumentParser(description="Benchmark de serialización de /consumos")
+    parser.add_argument("--limite", type=int, default=100, help="Filas por página")
+    parser.add_argument("--paginas", type=int, default=20, help="Páginas por repetición")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    print("=== Benchmark de Serialización de Consumos ===")
+    db = SessionLocal()
+    try:
+        total = db.query(Consumo).count()
+        paginas = max(1, min(args.paginas, total // max(args.limite, 1)))
+        print(f"Consumos en la base: {total} - {paginas} páginas de {args.limite}")
+
+        # Ambos caminos deben producir el mismo JSON
+        if json.loads(camino_orm(db, 0, args.limite)) != orjson.loads(camino_core(db, 0, args.limite)):
+            print("⚠ Los caminos producen resultados distintos")
+
+        orm = medir("ORM + Pydantic + json", camino_orm, db, args.limite, paginas, args.repeticiones)
+        core = medir("Core + orjson", camino_core, db, args.limite, paginas, args.repeticiones)
+        campos = medir("Core + orjson (fields)", camino_campos, db, args.limite, paginas, args.repeticiones)
+        print(f"Aceleración: {orm / core:.1f}x (con fields: {orm / campos:.1f}x)")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
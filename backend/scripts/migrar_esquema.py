@@ -0,0 +1,67 @@
+"""
+Script de Migración de Esquema
+Agrega a una base existente las columnas nuevas de tablas ya creadas
+(init_db solo crea tablas que no existen). Es idempotente.
+Sistema de Gases Medicinales MSPBS
+"""
+
+import sys
+import os
+
+# Añadir el directorio raíz al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from app.core.database import SessionLocal, engine, init_db
+from app.services.cumplimiento_service import reconstruir_cumplimiento
+from app.services.unidades_service import backfill_cantidades_normalizadas
+
+
+# Sentencias en orden de aplicación (PostgreSQL)
+MIGRACIONES = [
+    # Detector de alertas
+    "ALTER TABLE alertas ADD COLUMN IF NOT EXISTS gas_id INTEGER REFERENCES gases(id)",
+    "ALTER TABLE alertas ADD COLUMN IF NOT EXISTS periodo DATE",
+    "CREATE INDEX IF NOT EXISTS ix_alertas_periodo ON alertas (periodo)",
+    # Cantidad normalizada a la unidad base del gas
+    "ALTER TABLE consumos ADD COLUMN IF NOT EXISTS cantidad_normalizada DOUBLE PRECISION",
+    # Modo del reporte PDF de las exportaciones en segundo plano
+    "ALTER TABLE trabajos_exportacion ADD COLUMN IF NOT EXISTS modo VARCHAR(20) NOT NULL DEFAULT 'detalle'",
+    # Avance de los paquetes de reportes por hospital
+    "ALTER TABLE trabajos_exportacion ADD COLUMN IF NOT EXISTS progreso INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE trabajos_exportacion ADD COLUMN IF NOT EXISTS progreso_total INTEGER",
+    "ALTER TABLE trabajos_exportacion ADD COLUMN IF NOT EXISTS progreso_at TIMESTAMP WITH TIME ZONE",
+]
+
+# Tareas de datos a ejecutar después de las sentencias (nombre, función(db))
+TAREAS = [
+    ("Reconstruir índice de cumplimiento de registro", reconstruir_cumplimiento),
+    ("Completar cantidades normalizadas", backfill_cantidades_normalizadas),
+]
+
+
+def main():
+    """Función principal de migración"""
+    print("=== Migrando Esquema ===")
+
+    # Crear tablas nuevas
+    init_db()
+
+    with engine.begin() as conn:
+        for sentencia in MIGRACIONES:
+            conn.execute(text(sentencia))
+            print(f"✓ {sentencia}")
+
+    db = SessionLocal()
+    try:
+        for nombre, tarea in TAREAS:
+            resultado = tarea(db)
+            print(f"✓ {nombre}: {resultado}")
+    finally:
+        db.close()
+
+    print("✓ Migración completada")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Worker de Exportaciones en Segundo Plano
+Lanza procesos que consumen la cola trabajos_exportacion. Los trabajos se
+reclaman con SELECT ... FOR UPDATE SKIP LOCKED, así que pueden correr
+varios procesos (y varias instancias) a la vez junto al worker interno.
+Sistema de Gases Medicinales MSPBS
+
+Uso: python scripts/worker_exportaciones.py [--procesos 2] [--una-vez]
+"""
+
+import sys
+import os
+import argparse
+import multiprocessing
+import time
+
+# Añadir el directorio raíz al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+
+
+def bucle_worker(numero: int, una_vez: bool):
+    """Procesar trabajos de la cola; esperar EXPORTACION_SONDEO cuando está vacía"""
+    from app.services.cola_exportacion_service import procesar_pendientes
+
+    intervalo = settings.EXPORTACION_SONDEO or 10
+    print(f"Worker {numero} iniciado (pid {os.getpid()})")
+    while True:
+        db = SessionLocal()
+        try:
+            procesados = procesar_pendientes(db)
+            if procesados:
+                print(f"Worker {numero}: {procesados} trabajos procesados")
+        except Exception as e:
+            print(f"Worker {numero}: error procesando la cola: {e}")
+        finally:
+            db.close()
+
+        if una_vez:
+            return
+        time.sleep(intervalo)
+
+
+def main():
+    """Función principal del worker"""
+    parser = argparse.ArgumentParser(description="Worker de exportaciones en segundo plano")
+    parser.add_argument("--procesos", type=int, default=settings.PROCESOS_MAX_WORKERS)
+    parser.add_argument("--una-vez", action="store_true", help="Vaciar la cola y terminar")
+    args = parser.parse_args()
+
+    print("=== Worker de Exportaciones ===")
+    # spawn: cada proceso crea su propio engine y pool de conexiones
+    contexto = multiprocessing.get_context("spawn")
+    procesos = [
+        contexto.Process(target=bucle_worker, args=(numero, args.una_vez))
+        for numero in range(1, max(args.procesos, 1) + 1)
+    ]
+    for proceso in procesos:
+        proceso.start()
+    try:
+        for proceso in procesos:
+            proceso.join()
+    except KeyboardInterrupt:
+        for proceso in procesos:
+            proceso.terminate()
+
+    print("✓ Worker detenido")
+
+
+if __name__ == "__main__":
+    main()